@@ -0,0 +1,152 @@
+'''
+Article extraction for the fake news check: model/extract.py against newspaper.
+
+Run from the repository root:
+    pip install newspaper3k
+    python bench/extract.py [pages/] [--pages 200]
+
+pages/ is a directory of saved pages (*.html, *.htm); without one, synthetic news pages are
+generated (inline scripts and styles, navigation, an article, related links and comment sections of
+very different sizes, with and without <article> markup, and a few pages of several megabytes). The
+new path reads a page the way FakeNewsChecker.fetch does, up to FAKE_NEWS_MAX_BYTES, then extracts
+up to FAKE_NEWS_MAX_WORDS words; newspaper parses the whole page.
+
+Reports time per page (p50, p99, max), peak traced memory while extracting one page, how much of
+the vocabulary newspaper's text and ours share (Jaccard similarity of their token sets), and, if the
+fake news model is available, how often the two texts get the same verdict and how far apart their
+probabilities are.
+'''
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, '.')
+import globals
+from model.extract import WORD_PATTERN, decode, extract_text
+
+try:
+    from newspaper import Article
+except ImportError:
+    Article = None
+
+WORDS = ('the president said senate election vaccine media report officials claim study shows '
+         'government secret hoax scientists million people week according sources news breaking '
+         'city council budget health data police court state federal experts warned').split()
+
+
+def paragraph(rng, low=15, high=80):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + '.'
+
+
+def synthetic_page(rng, huge=False):
+    script = 'var config = {' + ','.join(f'"k{i}": "{rng.random()}"' for i in range(rng.randint(50, 2000))) + '};'
+    style = ''.join(f'.c{i} {{ margin: {i}px; }}' for i in range(rng.randint(50, 1000)))
+    nav = ''.join(f'<li><a href="/s/{i}">{paragraph(rng, 1, 3)}</a></li>' for i in range(30))
+    body = ''.join(f'<p>{paragraph(rng)}</p>' for _ in range(rng.randint(3, 40)))
+    related = ''.join(f'<li><a href="/a/{i}">{paragraph(rng, 6, 12)}</a></li>' for i in range(10))
+    comments = ''.join(f'<div class="comment"><p>{paragraph(rng, 5, 60)}</p></div>'
+                       for _ in range(rng.randint(20000, 40000) if huge else rng.randint(0, 200)))
+    article = f'<article><h1>{paragraph(rng, 5, 12)}</h1>{body}</article>' if rng.random() < 0.7 else f'<div class="story">{body}</div>'
+    return (f'<!DOCTYPE html><html><head><title>News</title><style>{style}</style><script>{script}</script></head>'
+            f'<body><header><nav><ul>{nav}</ul></nav></header><main>{article}<aside><ul>{related}</ul></aside></main>'
+            f'<section class="comments">{comments}</section><footer>{paragraph(rng)}</footer></body></html>')
+
+
+def load_pages(directory):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.htm*'))):
+        with open(path, 'rb') as f:
+            pages.append(('http://localhost/' + os.path.basename(path), f.read()))
+    return pages
+
+
+def newspaper_text(link, body):
+    article = Article(link)
+    article.download(input_html=decode(body, None))
+    article.parse()
+    return article.text
+
+
+def bounded_text(link, body):
+    return extract_text(decode(body[:globals.FAKE_NEWS_MAX_BYTES], None))
+
+
+def run(extract, pages):
+    texts = []
+    timings = []
+    for link, body in pages:
+        start = time.perf_counter()
+        texts.append(extract(link, body))
+        timings.append(time.perf_counter() - start)
+    return texts, sorted(timings)
+
+
+def peak_memory(extract, pages):
+    peak = 0
+    tracemalloc.start()
+    for link, body in pages:
+        tracemalloc.reset_peak()
+        extract(link, body)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return peak
+
+
+def tokens(text):
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def load_model():
+    try:
+        from model.abridged import get_fake_news_model
+        return get_fake_news_model()
+    except (ImportError, OSError) as e:
+        print(f'fake news model unavailable ({e!r}), skipping classifier agreement')
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', nargs='?')
+    parser.add_argument('--pages', type=int, default=200, dest='count', help='synthetic pages to generate')
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = load_pages(args.pages)
+    else:
+        rng = random.Random(0)
+        pages = [('http://localhost/%d.html' % i, synthetic_page(rng, huge=i % 50 == 49).encode('utf-8')) for i in range(args.count)]
+    sizes = sorted(len(body) for _, body in pages)
+    print(f'{len(pages)} pages, size p50 {sizes[len(sizes) // 2] / 1024:.0f} KiB, max {sizes[-1] / 2 ** 20:.1f} MiB')
+
+    paths = [('model/extract.py', bounded_text)]
+    if Article is not None:
+        paths.insert(0, ('newspaper', newspaper_text))
+    else:
+        print('newspaper is not installed, skipping it')
+
+    print(f'{"path":>18}{"p50 ms":>10}{"p99 ms":>10}{"max ms":>10}{"peak MiB":>10}')
+    results = {}
+    for name, extract in paths:
+        texts, timings = run(extract, pages)
+        results[name] = texts
+        print(f'{name:>18}{timings[len(timings) // 2] * 1e3:>10.1f}{timings[int(len(timings) * 0.99)] * 1e3:>10.1f}'
+              f'{timings[-1] * 1e3:>10.1f}{peak_memory(extract, pages) / 2 ** 20:>10.1f}')
+
+    if 'newspaper' in results:
+        old, new = results['newspaper'], results['model/extract.py']
+        overlaps = sorted(len(tokens(a) & tokens(b)) / max(len(tokens(a) | tokens(b)), 1) for a, b in zip(old, new))
+        print(f'token set similarity to newspaper: mean {sum(overlaps) / len(overlaps):.2f}, p10 {overlaps[len(overlaps) // 10]:.2f}')
+
+        model = load_model()
+        if model is not None:
+            old_p = model.predict_fake_proba(old)
+            new_p = model.predict_fake_proba(new)
+            agree = sum((a >= 0.5) == (b >= 0.5) for a, b in zip(old_p, new_p)) / len(pages)
+            difference = sorted(abs(a - b) for a, b in zip(old_p, new_p))
+            print(f'classifier agreement: {agree:.1%} same verdict, |p difference| mean {sum(difference) / len(difference):.3f}, '
+                  f'max {difference[-1]:.3f}')
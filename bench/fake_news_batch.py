@@ -0,0 +1,48 @@
+'''
+Throughput of the batched fake news inference API (docs/sec) at batch sizes 1, 8, 64 and 512.
+
+Run from the repository root:
+    python bench/fake_news_batch.py [corpus.txt]
+
+The corpus is one article text per line. Without one, synthetic articles are generated.
+'''
+import random
+import sys
+import time
+
+sys.path.insert(0, '.')
+from model.abridged import predict_fake_news_batch
+
+BATCH_SIZES = [1, 8, 64, 512]
+TOTAL_DOCS = 1024
+
+WORDS = ('the president said senate election vaccine media report officials claim study shows '
+         'government secret hoax scientists million people week according sources news breaking').split()
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(200, 1200))) for _ in range(n)]
+
+
+def load_corpus(path):
+    with open(path) as f:
+        docs = [line.strip() for line in f if line.strip()]
+    return (docs * (TOTAL_DOCS // len(docs) + 1))[:TOTAL_DOCS]
+
+
+if __name__ == '__main__':
+    docs = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic_corpus(TOTAL_DOCS)
+
+    # Load the model before timing anything
+    predict_fake_news_batch(docs[:1])
+
+    print(f'{"batch size":>10}{"docs/sec":>12}{"ms/batch":>12}')
+    for batch_size in BATCH_SIZES:
+        start = time.perf_counter()
+        batches = 0
+        for i in range(0, len(docs), batch_size):
+            predict_fake_news_batch(docs[i:i + batch_size])
+            batches += 1
+        elapsed = time.perf_counter() - start
+        print(f'{batch_size:>10}{len(docs) / elapsed:>12.1f}{elapsed / batches * 1000:>12.2f}')
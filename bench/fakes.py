@@ -0,0 +1,342 @@
+'''
+In-process stand-ins for Discord and Firestore, used by the benchmark harnesses to drive the bot
+without a network. They implement only what the bot calls.
+'''
+import asyncio
+import copy
+import itertools
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+import discord
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id():
+    return next(_ids)
+
+
+class FakeResponse:
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+def not_found():
+    return discord.errors.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+
+
+class DiscordCalls:
+    '''
+    Counts the API calls the bot makes through the fakes, with an optional simulated round trip.
+    '''
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = {}
+
+    async def call(self, route):
+        self.counts[route] = self.counts.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, calls, id, name, discriminator='0001'):
+        self.calls = calls
+        self.id = id
+        self.name = name
+        self.discriminator = discriminator
+        self.bot = False
+        self.dms = []
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+    async def send(self, text):
+        await self.calls.call('dm')
+        self.dms.append(text)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, id=None):
+        self.id = id if id is not None else next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.reactions = []
+        self.deleted = False
+
+    async def delete(self):
+        await self.channel.calls.call('delete')
+        self.channel.remove(self.id)
+
+    async def add_reaction(self, emoji):
+        await self.channel.calls.call('reaction')
+        self.reactions.append(emoji)
+
+
+class FakePartialMessage:
+    def __init__(self, channel, id):
+        self.channel = channel
+        self.id = id
+
+    async def delete(self):
+        await self.channel.calls.call('delete')
+        if not self.channel.remove(self.id):
+            raise not_found()
+
+
+class FakeChannel:
+    def __init__(self, calls, guild, name, bot_user, id=None):
+        self.calls = calls
+        self.id = id if id is not None else next_id()
+        self.guild = guild
+        self.name = name
+        self.bot_user = bot_user
+        self.messages = {} # Key: message id Value: FakeMessage
+
+    def post(self, author, content, id=None):
+        message = FakeMessage(self, author, content, id)
+        self.messages[message.id] = message
+        return message
+
+    def remove(self, message_id):
+        message = self.messages.pop(message_id, None)
+        if message is not None:
+            message.deleted = True
+        return message is not None
+
+    async def send(self, text):
+        await self.calls.call('send')
+        return self.post(self.bot_user, text)
+
+    async def fetch_message(self, message_id):
+        await self.calls.call('fetch')
+        if message_id not in self.messages:
+            raise not_found()
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id):
+        return FakePartialMessage(self, message_id)
+
+    async def delete_messages(self, messages):
+        await self.calls.call('bulk_delete')
+        for message in messages:
+            self.remove(message.id)
+
+
+class FakeDMChannel(FakeChannel):
+    def __init__(self, calls, recipient, bot_user):
+        super().__init__(calls, None, None, bot_user)
+        self.recipient = recipient
+
+
+class FakeGuild:
+    def __init__(self, id=None, name='Replay Guild'):
+        self.id = id if id is not None else next_id()
+        self.name = name
+        self.text_channels = []
+
+    def get_channel(self, channel_id):
+        for channel in self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+
+class FakeEmoji:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeRawEdit:
+    def __init__(self, data, cached_message=None):
+        self.data = data
+        self.message_id = int(data['id'])
+        self.cached_message = cached_message
+
+
+class FakeRawReaction:
+    def __init__(self, guild_id, message_id, member, emoji='✋'):
+        self.guild_id = guild_id
+        self.message_id = message_id
+        self.user_id = member.id
+        self.member = member
+        self.emoji = FakeEmoji(emoji)
+
+
+class _Snapshot:
+    def __init__(self, id, data):
+        self.id = id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class _Document:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return _Collection(self.db, self.path + (name,))
+
+    def get(self):
+        return self.db.get(self.path)
+
+    def set(self, data):
+        self.db.apply([('set', self.path, data)])
+
+    def update(self, fields):
+        self.db.apply([('update', self.path, fields)])
+
+    def create(self, data):
+        if self.db.exists(self.path):
+            from google.api_core.exceptions import AlreadyExists
+            raise AlreadyExists(f'Document {"/".join(self.path)} already exists')
+        self.set(data)
+
+
+class _Collection:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def document(self, id):
+        return _Document(self.db, self.path + (id,))
+
+    def stream(self):
+        return [self.db.get(path) for path in self.db.children(self.path)]
+
+    def on_snapshot(self, callback):
+        # Only the initial snapshot; the bot keeps itself current through the writer's listeners
+        class Change:
+            def __init__(self, snapshot):
+                self.document = snapshot
+                self.type = FakeEmoji('ADDED')
+
+        class Watch:
+            def unsubscribe(self):
+                pass
+
+        docs = self.stream()
+        callback(docs, [Change(doc) for doc in docs], time.time())
+        return Watch()
+
+
+class _Batch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append(('set', ref.path, data))
+
+    def update(self, ref, fields):
+        self.writes.append(('update', ref.path, fields))
+
+    def commit(self):
+        self.db.apply(self.writes)
+
+
+class FakeFirestore:
+    '''
+    Thread-safe in-memory Firestore with the document, batch and get_all calls the bot makes.
+    Increment and SERVER_TIMESTAMP are applied on write. `latency` is added to every read and commit.
+    '''
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.documents = {} # Key: path tuple Value: document data
+        self.reads = 0
+        self.commits = 0
+
+    def collection(self, name):
+        return _Collection(self, (name,))
+
+    def batch(self):
+        return _Batch(self)
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+    def exists(self, path):
+        with self.lock:
+            return path in self.documents
+
+    def children(self, path):
+        with self.lock:
+            return [child for child in self.documents if child[:-1] == path]
+
+    def get(self, path):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.reads += 1
+            data = self.documents.get(path)
+            return _Snapshot(path[-1], copy.deepcopy(data))
+
+    def apply(self, writes):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.commits += 1
+            for op, path, data in writes:
+                if op == 'set':
+                    self.documents[path] = {key: self._resolve(None, value) for key, value in data.items()}
+                    continue
+                document = self.documents.get(path)
+                if document is None:
+                    raise KeyError(f'No document to update: {"/".join(path)}')
+                for field, value in data.items():
+                    *parents, leaf = field.split('.')
+                    target = document
+                    for parent in parents:
+                        target = target.setdefault(parent, {})
+                    target[leaf] = self._resolve(target.get(leaf), value)
+
+    @staticmethod
+    def _resolve(current, value):
+        kind = type(value).__name__
+        if kind == 'Increment':
+            return (current or 0) + value.value
+        if kind == 'Sentinel':
+            # SERVER_TIMESTAMP is the only sentinel the bot writes
+            return time.time()
+        return copy.deepcopy(value)
+
+
+class FirestoreServer(BaseManager):
+    '''
+    Serves one FakeFirestore to several processes, as the real Firestore is shared by every shard:
+        server = FirestoreServer(); server.start(); firestore = server.FakeFirestore(latency)
+    and each process uses it through SharedFirestore(firestore).
+    '''
+
+FirestoreServer.register('FakeFirestore', FakeFirestore, exposed=('get', 'apply', 'exists', 'children'))
+
+
+class SharedFirestore(FakeFirestore):
+    '''
+    A process's view of the FakeFirestore a FirestoreServer serves. Documents are read and written there.
+    '''
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def exists(self, path):
+        return self.proxy.exists(path)
+
+    def children(self, path):
+        return self.proxy.children(path)
+
+    def get(self, path):
+        return self.proxy.get(path)
+
+    def apply(self, writes):
+        self.proxy.apply(writes)
@@ -0,0 +1,119 @@
+'''
+Micro-benchmark of the per-message normalization: uni2ascii on every message (the old path) against
+the channel check first, then fold() (normalize.py).
+
+Run from the repository root:
+    pip install uni2ascii_janin==1.0.1
+    python bench/fold.py [corpus.txt] [--other-channels 0.3] [--repeat 0.2]
+
+The corpus is one message per line; without one, a synthetic chat corpus is generated (mostly
+ASCII, with accents, emoji, fullwidth and math-bold text, homoglyphs and zero-width evasions).
+--other-channels is the share of messages posted outside the group channel, and --repeat the share
+that repeat an earlier message (spam, copypasta). Reports microseconds per message for both paths,
+cold (empty memo caches) and warm, and how many messages the two fold differently.
+'''
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, '.')
+import normalize
+from normalize import fold, content_hash
+
+try:
+    from uni2ascii import uni2ascii
+except ImportError:
+    uni2ascii = None
+
+TOTAL_MESSAGES = 50000
+
+WORDS = ('hey lol did you see the game last night that was wild honestly i think the ref was '
+         'bad free money click here idiot nobody asked check this out news vaccine election').split()
+STYLED = [
+    'café', 'naïve', 'über', '“quoted”', 'it’s', 'wait—what', '😂', '🔥🔥', '👍', 'ｆｒｅｅ', '𝐜𝐥𝐢𝐜𝐤',
+    'іdіоt', 'ѕсаm', 'fr​ee', 'mo‍ney', 'ⓕⓡⓔⓔ', 'ﬁnally', '…', 'z̷a̷l̷g̷o̷', '日本語',
+]
+
+
+def synthetic_corpus(n, styled_rate=0.15, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(n):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 25))]
+        if rng.random() < styled_rate:
+            for _ in range(rng.randint(1, 3)):
+                words.insert(rng.randrange(len(words) + 1), rng.choice(STYLED))
+        messages.append(' '.join(words))
+    return messages
+
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def events(messages, other_channels, repeat, seed=1):
+    '''
+    (channel name, content) pairs in posting order, TOTAL_MESSAGES of them.
+    '''
+    rng = random.Random(seed)
+    posted = []
+    for i in range(TOTAL_MESSAGES):
+        content = rng.choice(posted) if posted and rng.random() < repeat else messages[i % len(messages)]
+        posted.append(content)
+    return [('general' if rng.random() < other_channels else 'group-0', content) for content in posted]
+
+
+def old_path(stream):
+    for channel, content in stream:
+        content = uni2ascii(content)
+        if channel != 'group-0':
+            continue
+        content_hash.__wrapped__(content)
+
+
+def new_path(stream):
+    for channel, content in stream:
+        if channel != 'group-0':
+            continue
+        content_hash(fold(content))
+
+
+def timed(function, stream):
+    start = time.perf_counter()
+    function(stream)
+    return (time.perf_counter() - start) / len(stream) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', nargs='?')
+    parser.add_argument('--other-channels', type=float, default=0.3)
+    parser.add_argument('--repeat', type=float, default=0.2)
+    args = parser.parse_args()
+
+    messages = load_corpus(args.corpus) if args.corpus else synthetic_corpus(TOTAL_MESSAGES)
+    stream = events(messages, args.other_channels, args.repeat)
+    ascii_share = sum(content.isascii() for _, content in stream) / len(stream)
+    print(f'{len(stream)} messages, {ascii_share:.0%} pure ASCII, {args.other_channels:.0%} outside the group channel')
+
+    print(f'{"path":>24}{"us/msg":>10}')
+    if uni2ascii is not None:
+        uni2ascii('warm up the regex')
+        print(f'{"uni2ascii, then check":>24}{timed(old_path, stream):>10.2f}')
+    else:
+        print('uni2ascii is not installed, skipping the old path')
+
+    normalize._fold.cache_clear()
+    content_hash.cache_clear()
+    print(f'{"check, then fold (cold)":>24}{timed(new_path, stream):>10.2f}')
+    print(f'{"check, then fold (warm)":>24}{timed(new_path, stream):>10.2f}')
+    print(f'memo caches: {normalize.stats()}')
+
+    if uni2ascii is not None:
+        unique = {content for _, content in stream}
+        differ = [content for content in unique if uni2ascii(content) != fold(content)]
+        print(f'{len(differ)} of {len(unique)} distinct messages fold differently from uni2ascii, e.g.:')
+        for content in differ[:5]:
+            print(f'  {content!r}: {uni2ascii(content)!r} -> {fold(content)!r}')
@@ -0,0 +1,349 @@
+'''
+Replay load test for the bot.
+
+Drives ModBot.on_message, on_raw_message_edit, on_raw_reaction_add and the DM report and review
+flows from a JSONL event stream, with every external service replaced by a local stand-in:
+fake Discord objects (bench/fakes.py), a Perspective HTTP server and an article server on
+localhost with configurable latency, and an in-memory Firestore installed with set_db. The
+Firestore writer itself is real and needs firebase-admin (for Increment and SERVER_TIMESTAMP); the
+replay exits with an error if it is missing, or if any write to the in-memory Firestore fails. The
+fake news model is real too, so the exported artifact or joblib files must be in the working
+directory for the predict stage to run. Without them, link checks fail and are logged.
+Warnings and errors from the bot are printed to stderr.
+
+Event stream lines (synthetic if no file is given, see synthetic_events):
+    {"type": "message", "user": 3, "id": 1001, "content": "..."}      channel message
+    {"type": "edit", "id": 1001, "content": "..."}                    edit of an earlier message
+    {"type": "dm", "user": 3, "content": "report"}                    DM to the bot (report or review flow)
+    {"type": "claim", "user": 900}                                    moderator reacts ✋ on the newest ticket post
+Article links in messages can use {articles} for the local article server's base URL.
+
+Run from the repository root:
+    python bench/replay.py [--events events.jsonl] [--messages 10000] [--perspective-latency 0.05] ...
+
+Reports events/sec, p50/p95/p99 latency per event type (from dispatch until the handler returns),
+event loop lag, Discord and Firestore call counts, and memory growth per 10k messages. Ticket posts
+and report replies wait on the mod channel's 'send' bucket (OUTBOUND_ROUTE_LIMITS), so at replay
+speed that bucket sets the DM tail latency and, through the concurrency limit, the throughput.
+Tickets, the score cache and the Firestore journal are kept in memory, and the files the bot writes
+anyway go to a temporary directory.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+
+import globals
+import model.abridged
+from model.prefilter import lexicon_risk
+from perspective import REQUESTED_ATTRIBUTES, PerspectiveClient
+from ratelimit import TokenBucket
+from scoring import ScoringQueue
+from fakes import (DiscordCalls, FakeChannel, FakeDMChannel, FakeFirestore, FakeGuild, FakeRawEdit,
+                   FakeRawReaction, FakeUser, next_id)
+
+logger = logging.getLogger('discord')
+
+GROUP_NUM = '0'
+BENIGN = ['good morning everyone', 'has anyone started the problem set?', 'lol same', 'see you at practice',
+          'that movie was great', 'what time is the meeting', 'thanks for the help!', 'ok sounds good']
+TOXIC = ['you are such an idiot', 'shut up loser', 'I will hurt you', 'go away you stupid moron',
+         'nobody likes you, pathetic trash', 'kys']
+# The stand-in Perspective scores these above AUTO_REPORT_THRESHOLD (0.83-0.92) and AUTO_DELETE_THRESHOLD (0.975)
+ABUSIVE = ['shut up you stupid bitch', 'go away, nobody wants you here you dumb slut', 'I will beat you up, you shit',
+           'I hate you so much, kys you stupid whore']
+SEVERE = ['I will kill you, you fucking idiot, I hate you, die', 'shut up and die you stupid bitch, I will hurt you']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def message_content(rng):
+    '''
+    Mostly benign chatter, with toxic messages and article links.
+    '''
+    roll = rng.random()
+    if roll < 0.70:
+        return rng.choice(BENIGN)
+    if roll < 0.80:
+        return rng.choice(TOXIC)
+    if roll < 0.83:
+        return rng.choice(ABUSIVE)
+    if roll < 0.85:
+        return rng.choice(SEVERE)
+    return f'{rng.choice(BENIGN)} {{articles}}/article/{rng.randrange(50)}'
+
+
+def synthetic_events(messages, seed=0, users=200, moderators=5):
+    '''
+    A mix of benign and toxic chatter, article links, edit bursts, DM reports of earlier messages
+    and moderators claiming and reviewing tickets.
+    '''
+    rng = random.Random(seed)
+    sent = []
+    for _ in range(messages):
+        user = rng.randrange(users)
+        content = message_content(rng)
+        message_id = next_id()
+        sent.append(message_id)
+        yield {'type': 'message', 'user': user, 'id': message_id, 'content': content}
+
+        if rng.random() < 0.05:
+            for i in range(rng.randint(1, 5)):
+                yield {'type': 'edit', 'id': message_id, 'content': f'{content} (edit {i})'}
+
+        if rng.random() < 0.02:
+            target = rng.choice(sent)
+            reporter = rng.randrange(users)
+            for content in ('report', f'{{message_link}}/{target}', '3', '5', 'skip'):
+                yield {'type': 'dm', 'user': reporter, 'content': content}
+
+        if rng.random() < 0.02:
+            moderator = 10 ** 6 + rng.randrange(moderators)
+            yield {'type': 'claim', 'user': moderator}
+            for content in ('s', 'y', 'y', 'y'):
+                yield {'type': 'dm', 'user': moderator, 'content': content}
+
+
+async def perspective_handler(request):
+    await asyncio.sleep(request.app['latency'])
+    text = (await request.json())['comment']['text']
+    risk = lexicon_risk(text)
+    scores = {attr: risk * (1.0 if attr == 'TOXICITY' else 0.8) for attr in REQUESTED_ATTRIBUTES}
+    return web.json_response({'attributeScores': {attr: {'summaryScore': {'value': score}} for attr, score in scores.items()}})
+
+
+async def article_handler(request):
+    await asyncio.sleep(request.app['latency'])
+    n = int(request.match_info['n'])
+    paragraphs = ''.join(f'<p>Paragraph {i} of article {n}: officials said the report was released on Tuesday '
+                         f'after weeks of review, according to people familiar with the matter.</p>' for i in range(40))
+    return web.Response(text=f'<html><head><title>Article {n}</title></head><body><h1>Article {n}</h1>'
+                             f'<article>{paragraphs}</article></body></html>', content_type='text/html')
+
+
+async def start_server(routes, latency):
+    app = web.Application()
+    app['latency'] = latency
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+
+def make_bot(calls):
+    # Imported here so the globals above are in place when the bot reads them
+    from bot import ModBot
+
+    class ReplayBot(ModBot):
+        def __init__(self):
+            super().__init__('replay-key')
+            self.bot_user = FakeUser(calls, next_id(), f'Group {GROUP_NUM} Bot')
+            self._connection.user = self.bot_user
+            self.group_num = GROUP_NUM
+            self.guild = FakeGuild()
+            self.channel = FakeChannel(calls, self.guild, f'group-{GROUP_NUM}', self.bot_user)
+            self.mod_channel = FakeChannel(calls, self.guild, f'group-{GROUP_NUM}-mod', self.bot_user)
+            self.guild.text_channels = [self.channel, self.mod_channel]
+            self.mod_channels[self.guild.id] = self.mod_channel
+            self.fake_users = {}
+            self.dm_channels = {}
+
+        def fake_user(self, user_id):
+            if user_id not in self.fake_users:
+                self.fake_users[user_id] = FakeUser(calls, user_id, f'user{user_id}')
+                self.dm_channels[user_id] = FakeDMChannel(calls, self.fake_users[user_id], self.bot_user)
+            return self.fake_users[user_id]
+
+        def get_guild(self, guild_id):
+            return self.guild if guild_id == self.guild.id else None
+
+        def get_channel(self, channel_id):
+            return self.guild.get_channel(channel_id)
+
+        def get_user(self, user_id):
+            return self.fake_users.get(user_id)
+
+        async def fetch_user(self, user_id):
+            return self.fake_user(user_id)
+
+    return ReplayBot()
+
+
+class Replay:
+    def __init__(self, bot, articles_url):
+        self.bot = bot
+        self.articles_url = articles_url
+        self.latencies = {} # Key: event type Value: list of seconds
+        self.loop_lag = []
+        self.user_locks = {} # Events from one user are handled in order, like a real conversation
+        self.running = True
+
+    async def sample_loop_lag(self, interval=0.01):
+        loop = asyncio.get_event_loop()
+        while self.running:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(loop.time() - start - interval)
+
+    async def handle(self, event):
+        bot = self.bot
+        lock = self.user_locks.setdefault(event.get('user'), asyncio.Lock())
+        async with lock:
+            start = time.perf_counter()
+            if event['type'] == 'message':
+                content = event['content'].replace('{articles}', self.articles_url)
+                message = bot.channel.post(bot.fake_user(event['user']), content, event['id'])
+                await bot.on_message(message)
+            elif event['type'] == 'edit':
+                content = event['content'].replace('{articles}', self.articles_url)
+                await bot.on_raw_message_edit(FakeRawEdit({'id': str(event['id']), 'content': content, 'guild_id': str(bot.guild.id),
+                                                           'channel_id': str(bot.channel.id)}))
+            elif event['type'] == 'dm':
+                user = bot.fake_user(event['user'])
+                content = event['content'].replace('{message_link}', f'https://discord.com/channels/{bot.guild.id}/{bot.channel.id}')
+                await bot.on_message(bot.dm_channels[user.id].post(user, content))
+            elif event['type'] == 'claim':
+                posts = [m for m in bot.mod_channel.messages.values() if m.content.startswith('Ticket #')]
+                if posts:
+                    await bot.on_raw_reaction_add(FakeRawReaction(bot.guild.id, posts[-1].id, bot.fake_user(event['user'])))
+            self.latencies.setdefault(event['type'], []).append(time.perf_counter() - start)
+
+    async def run(self, events, rate=0, concurrency=256):
+        sampler = asyncio.ensure_future(self.sample_loop_lag())
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = []
+
+        async def dispatch(event):
+            async with semaphore:
+                try:
+                    await self.handle(event)
+                except Exception:
+                    logger.exception(f'Replay event failed: {event}')
+
+        start = time.perf_counter()
+        for i, event in enumerate(events):
+            if rate:
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # Like the gateway, each event is handled in its own task
+            tasks.append(asyncio.ensure_future(dispatch(event)))
+            if len(tasks) >= concurrency * 4:
+                await asyncio.wait(tasks)
+                tasks = []
+        if tasks:
+            await asyncio.wait(tasks)
+        handled = time.perf_counter() - start
+
+        # Let background work finish: debounced edits, fake news checks, digests and Firestore writes
+        while self.bot.edits.pending or self.bot.fake_news_jobs:
+            await asyncio.sleep(0.05)
+        await self.bot.outbound.close()
+        if not await asyncio.get_event_loop().run_in_executor(None, model.abridged.get_writer().flush, 60):
+            raise RuntimeError('Firestore writes were still queued 60s after the replay ended')
+        drained = time.perf_counter() - start
+
+        self.running = False
+        await sampler
+        return handled, drained
+
+
+async def main(args, state_dir):
+    # Tickets, the score cache and the Firestore journal stay in memory; files the bot always writes go to state_dir
+    globals.TICKET_STORE_PATH = None
+    globals.SCORE_CACHE_PATH = None
+    globals.DOMAIN_REPUTATION_PATH = os.path.join(state_dir, 'domain_reputation.csv')
+    model.abridged.set_journal(None)
+    firestore = FakeFirestore(args.firestore_latency)
+    model.abridged.set_db(firestore)
+    try:
+        import firebase_admin.firestore
+    except ImportError:
+        sys.exit('bench/replay.py needs firebase-admin for the Firestore writer: pip install firebase-admin')
+    if model.abridged.get_writer().get_db() is not firestore:
+        sys.exit('The Firestore writer is not using the in-memory Firestore')
+
+    perspective_runner, perspective_url = await start_server([web.post('/analyze', perspective_handler)], args.perspective_latency)
+    articles_runner, articles_url = await start_server([web.get('/article/{n}', article_handler)], args.article_latency)
+
+    calls = DiscordCalls(args.discord_latency)
+    bot = make_bot(calls)
+    limiter = TokenBucket(args.perspective_qps, args.perspective_qps)
+    bot.perspective = PerspectiveClient('replay-key', url=f'{perspective_url}/analyze', limiter=limiter)
+    bot.scoring_queue = ScoringQueue(bot.perspective.score, limiter=limiter)
+
+    if args.events:
+        with open(args.events) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = list(synthetic_events(args.messages, args.seed))
+    messages = sum(event['type'] == 'message' for event in events)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    replay = Replay(bot, articles_url)
+    handled, drained = await replay.run(events, args.rate, args.concurrency)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f'{len(events)} events ({messages} channel messages) handled in {handled:.2f}s, drained in {drained:.2f}s')
+    print(f'throughput: {len(events) / handled:.0f} events/sec, {messages / handled:.0f} messages/sec')
+    print(f'{"event":>10}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for kind, latencies in sorted(replay.latencies.items()):
+        print(f'{kind:>10}{len(latencies):>8}' + ''.join(f'{percentile(latencies, p) * 1000:>10.1f}' for p in (0.5, 0.95, 0.99)))
+    print(f'event loop lag: p50 {percentile(replay.loop_lag, 0.5) * 1000:.1f} ms, p99 {percentile(replay.loop_lag, 0.99) * 1000:.1f} ms, '
+          f'max {max(replay.loop_lag, default=0) * 1000:.1f} ms')
+    # ru_maxrss is in kilobytes on Linux
+    print(f'peak RSS growth: {(rss_after - rss_before) / 1024:.1f} MB, {(rss_after - rss_before) / 1024 * 10000 / max(messages, 1):.1f} MB per 10k messages')
+    print(f'discord calls: {calls.counts}')
+    writer = model.abridged.get_writer().stats()
+    print(f'firestore: {firestore.reads} reads, {firestore.commits} commits, {writer["mutations_written"]} mutations written')
+    print(f'tickets: {await bot.tickets.backlog_stats()}')
+
+    await bot.perspective.close()
+    await bot.fake_news.close()
+    await perspective_runner.cleanup()
+    await articles_runner.cleanup()
+
+    # A run whose writes didn't land measured a different bot; don't let its numbers pass for a real run
+    if writer['failures'] or writer['dead_lettered']:
+        sys.exit(f'{writer["failures"]} Firestore write attempts failed and {writer["dead_lettered"]} mutations were '
+                 f'dead-lettered (see the log above)')
+    if not writer['mutations_written']:
+        sys.exit('No reports or user stats were written to the in-memory Firestore')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', help='JSONL event stream to replay; synthetic if omitted')
+    parser.add_argument('--messages', type=int, default=10000, help='channel messages in the synthetic stream')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=0, help='events per second; 0 replays as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=256, help='events in flight at once')
+    parser.add_argument('--perspective-latency', type=float, default=0.05)
+    parser.add_argument('--perspective-qps', type=float, default=1000)
+    parser.add_argument('--article-latency', type=float, default=0.1)
+    parser.add_argument('--discord-latency', type=float, default=0.02)
+    parser.add_argument('--firestore-latency', type=float, default=0.01)
+    args = parser.parse_args()
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    logger.addHandler(handler)
+    with tempfile.TemporaryDirectory() as state_dir:
+        asyncio.run(main(args, state_dir))
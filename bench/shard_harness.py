@@ -0,0 +1,443 @@
+'''
+Multi-process scaling harness: the replay (bench/replay.py) run across shard processes.
+
+A synthetic event stream spreads channel messages and edits over guilds, and users report
+earlier messages and moderators take tickets with `!next` in a staff guild and review them over
+DM. Like the real gateway, each guild's events go to shard (guild_id >> 22) % shard_count, every
+DM goes to shard 0, and each worker process runs the shards that shards.shard_ranges gives it.
+
+Each worker drives a real ModBot for its shards through on_message and on_raw_message_edit, with
+the fakes from bench/fakes.py for its own guilds and a fetch_channel that stands in for Discord's
+REST API for the others (reports of messages in guilds on other shards are looked up that way).
+The workers share one SQLite ticket store and the model pool, started as shards.py starts them;
+the guild jobs that the shard 0 worker leaves in the store for other workers' guilds (ticket
+posts, take-downs and decisions, see tickets.py) are run by those workers while they replay. The
+in-memory Firestore is shared too, served from its own process (see fakes.FirestoreServer), and
+each worker gets its own Perspective and article stand-ins in a separate process, so the
+stand-ins don't take CPU from the worker. As in the replay, the fake news
+model is real, and without its files in the working directory link checks fail and are logged.
+
+    python bench/shard_harness.py [--messages 5000] [--processes 1 2 4] [--perspective-latency 0.05] ...
+
+For each process count, prints messages/sec from the first event until every worker has handled
+its events, run the guild jobs left for it and drained its Discord and Firestore writes, the
+speedup over the first count, and what each worker handled. Near-linear scaling means the
+per-process rate holds; the shard 0 worker also handles every DM, so it is the one that falls
+behind. Exits with an error if a worker failed, an event or guild job raised, or a guild job was
+left in the store.
+'''
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+
+import globals
+import model.abridged
+from model.abridged import extract_article_text
+from perspective import PerspectiveClient
+from ratelimit import TokenBucket
+from scoring import ScoringQueue
+from shards import MODEL_POOL_ADDRESS, shard_ranges, start_model_pool, stop_model_pool
+from tickets import SQLiteTicketStore
+from fakes import (DiscordCalls, FakeChannel, FakeDMChannel, FirestoreServer, FakeGuild, FakeMessage, FakeRawEdit, FakeUser, SharedFirestore,
+                   next_id, not_found)
+from replay import article_handler, message_content, perspective_handler, start_server
+
+logger = logging.getLogger('discord')
+
+GROUP_NUM = '0'
+GUILDS = 64
+# Where moderators type !next. Its id is below 2 ** 22, so it is on shard 0 whatever the shard count.
+STAFF_GUILD = 1 << 21
+
+
+def guild_layout(rng):
+    '''
+    Map from guild id to the ids of its group channel and mod channel, the same in every worker.
+    '''
+    channel_ids = itertools.count(1)
+    guild_ids = [STAFF_GUILD] + [(rng.getrandbits(41) << 22) | i for i in range(GUILDS)]
+    return {guild_id: (next(channel_ids), next(channel_ids)) for guild_id in guild_ids}
+
+
+def sharded_events(messages, seed=0, users=200, moderators=5):
+    '''
+    The replay's synthetic stream (see replay.synthetic_events) spread over guilds.
+    '''
+    rng = random.Random(seed)
+    layout = guild_layout(rng)
+    guild_ids = [guild_id for guild_id in layout if guild_id != STAFF_GUILD]
+    sent = []
+    events = []
+    for _ in range(messages):
+        guild_id = rng.choice(guild_ids)
+        user = rng.randrange(users)
+        content = message_content(rng)
+        message_id = next_id()
+        sent.append((guild_id, message_id))
+        events.append({'type': 'message', 'guild': guild_id, 'user': user, 'id': message_id, 'content': content})
+
+        if rng.random() < 0.05:
+            for i in range(rng.randint(1, 5)):
+                events.append({'type': 'edit', 'guild': guild_id, 'id': message_id, 'content': f'{content} (edit {i})'})
+
+        if rng.random() < 0.02:
+            target_guild, target = rng.choice(sent)
+            link = f'https://discord.com/channels/{target_guild}/{layout[target_guild][0]}/{target}'
+            reporter = rng.randrange(users)
+            for content in ('report', link, '3', '5', 'skip'):
+                events.append({'type': 'dm', 'user': reporter, 'content': content})
+
+        if rng.random() < 0.02:
+            moderator = 10 ** 6 + rng.randrange(moderators)
+            events.append({'type': 'next', 'user': moderator})
+            for content in ('s', 'y', 'y', 'y'):
+                events.append({'type': 'dm', 'user': moderator, 'content': content})
+    return layout, events
+
+
+def event_shard(event, shard_count):
+    if event['type'] in ('message', 'edit'):
+        return (event['guild'] >> 22) % shard_count
+    # DMs, and the staff guild
+    return 0
+
+
+class RestChannel(FakeChannel):
+    '''
+    A channel as fetch_channel returns it, for a guild this process doesn't have: its messages are
+    the ones the event stream posted there, whichever process handles them.
+    '''
+    def __init__(self, calls, guild, bot_user, id, posted, articles_url):
+        super().__init__(calls, guild, None, bot_user, id)
+        self.posted = posted
+        self.articles_url = articles_url
+
+    async def fetch_message(self, message_id):
+        await self.calls.call('fetch')
+        event = self.posted.get(message_id)
+        if event is None or self.guild.id != event['guild']:
+            raise not_found()
+        return FakeMessage(self, FakeUser(self.calls, event['user'], f'user{event["user"]}'),
+                           event['content'].replace('{articles}', self.articles_url), message_id)
+
+
+def make_bot(shard_ids, shard_count, executor, calls, layout, posted, articles_url):
+    # Imported here so the globals set by the worker are in place when the bot reads them
+    from bot import ModBot
+
+    class ShardBot(ModBot):
+        def __init__(self):
+            super().__init__('harness-key', shard_ids, shard_count, executor)
+            self.bot_user = FakeUser(calls, next_id(), f'Group {GROUP_NUM} Bot')
+            self._connection.user = self.bot_user
+            self.group_num = GROUP_NUM
+            self.fake_guilds = {} # Key: guild id Value: FakeGuild, for the guilds on this process's shards
+            self.fake_channels = {} # Key: channel id Value: FakeChannel in those guilds
+            self.channel_guilds = {channel_id: guild_id for guild_id, ids in layout.items() for channel_id in ids}
+            for guild_id, (channel_id, mod_channel_id) in layout.items():
+                if not self.owns_guild(guild_id):
+                    continue
+                guild = self.fake_guilds[guild_id] = FakeGuild(guild_id)
+                guild.text_channels = [FakeChannel(calls, guild, f'group-{GROUP_NUM}', self.bot_user, channel_id),
+                                       FakeChannel(calls, guild, f'group-{GROUP_NUM}-mod', self.bot_user, mod_channel_id)]
+                self.fake_channels.update((channel.id, channel) for channel in guild.text_channels)
+                self.mod_channels[guild_id] = guild.text_channels[1]
+            self.fake_users = {}
+            self.dm_channels = {}
+
+        def fake_user(self, user_id):
+            if user_id not in self.fake_users:
+                self.fake_users[user_id] = FakeUser(calls, user_id, f'user{user_id}')
+                self.dm_channels[user_id] = FakeDMChannel(calls, self.fake_users[user_id], self.bot_user)
+            return self.fake_users[user_id]
+
+        def get_guild(self, guild_id):
+            return self.fake_guilds.get(guild_id)
+
+        def get_channel(self, channel_id):
+            return self.fake_channels.get(channel_id)
+
+        def get_user(self, user_id):
+            return self.fake_users.get(user_id)
+
+        async def fetch_user(self, user_id):
+            return self.fake_user(user_id)
+
+        async def fetch_channel(self, channel_id):
+            await calls.call('fetch_channel')
+            guild_id = self.channel_guilds.get(channel_id)
+            if guild_id is None:
+                raise not_found()
+            return RestChannel(calls, FakeGuild(guild_id), self.bot_user, channel_id, posted, articles_url)
+
+    return ShardBot()
+
+
+class ShardReplay:
+    def __init__(self, bot, articles_url):
+        self.bot = bot
+        self.articles_url = articles_url
+        self.counts = {} # Key: event type Value: events handled
+        self.failures = 0
+        self.jobs_run = 0
+        self.running = True
+        self.user_locks = {} # Events from one user are handled in order, like a real conversation
+
+    async def handle(self, event):
+        bot = self.bot
+        async with self.user_locks.setdefault(event.get('user'), asyncio.Lock()):
+            if event['type'] == 'message':
+                channel = bot.fake_guilds[event['guild']].text_channels[0]
+                content = event['content'].replace('{articles}', self.articles_url)
+                await bot.on_message(channel.post(bot.fake_user(event['user']), content, event['id']))
+            elif event['type'] == 'edit':
+                channel = bot.fake_guilds[event['guild']].text_channels[0]
+                content = event['content'].replace('{articles}', self.articles_url)
+                await bot.on_raw_message_edit(FakeRawEdit({'id': str(event['id']), 'content': content, 'guild_id': str(event['guild']),
+                                                           'channel_id': str(channel.id)}))
+            elif event['type'] == 'dm':
+                user = bot.fake_user(event['user'])
+                await bot.on_message(bot.dm_channels[user.id].post(user, event['content']))
+            elif event['type'] == 'next':
+                await bot.on_message(bot.mod_channels[STAFF_GUILD].post(bot.fake_user(event['user']), '!next'))
+        self.counts[event['type']] = self.counts.get(event['type'], 0) + 1
+
+    async def run_jobs(self):
+        '''
+        What ModBot.run_guild_jobs does, counting the jobs run.
+        '''
+        while self.running:
+            await asyncio.sleep(globals.GUILD_JOB_INTERVAL)
+            await self.run_pending_jobs()
+
+    async def run_pending_jobs(self):
+        try:
+            ran = await self.bot.run_pending_guild_jobs()
+        except Exception:
+            logger.exception('Guild jobs failed')
+            self.failures += 1
+            return 0
+        self.jobs_run += ran
+        return ran
+
+    async def run(self, events, handled_everywhere, concurrency=256):
+        jobs = asyncio.ensure_future(self.run_jobs())
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = []
+
+        async def dispatch(event):
+            async with semaphore:
+                try:
+                    await self.handle(event)
+                except Exception:
+                    logger.exception(f'Harness event failed: {event}')
+                    self.failures += 1
+
+        for event in events:
+            tasks.append(asyncio.ensure_future(dispatch(event)))
+            if len(tasks) >= concurrency * 4:
+                await asyncio.wait(tasks)
+                tasks = []
+        if tasks:
+            await asyncio.wait(tasks)
+        while self.bot.edits.pending or self.bot.fake_news_jobs:
+            await asyncio.sleep(0.05)
+        handled = time.time()
+
+        # Guild jobs are only left for other processes while handling events, so once every worker
+        # has handled its own, whatever is left for this one is in the store
+        await asyncio.get_event_loop().run_in_executor(None, handled_everywhere.wait)
+        self.running = False
+        await jobs
+        while await self.run_pending_jobs():
+            pass
+
+        await self.bot.outbound.close()
+        if not await asyncio.get_event_loop().run_in_executor(None, model.abridged.get_writer().flush, 60):
+            raise RuntimeError('Firestore writes were still queued 60s after the events were handled')
+        return handled
+
+
+def use_state_dir(tmp):
+    # The ticket store is shared by the workers; each keeps its score cache and Firestore journal in memory
+    globals.TICKET_STORE_PATH = os.path.join(tmp, 'tickets.sqlite3')
+    globals.SCORE_CACHE_PATH = None
+    globals.DOMAIN_REPUTATION_PATH = os.path.join(tmp, 'domain_reputation.csv')
+
+
+def serve_stand_ins(perspective_latency, article_latency, urls):
+    async def start():
+        perspective_runner, perspective_url = await start_server([web.post('/analyze', perspective_handler)], perspective_latency)
+        articles_runner, articles_url = await start_server([web.get('/article/{n}', article_handler)], article_latency)
+        urls.put((perspective_url, articles_url))
+        await asyncio.Event().wait()
+
+    asyncio.run(start())
+
+
+def worker(shard_ids, shard_count, layout, events, urls, firestore, tmp, authkey, args, ready, start, handled_everywhere, results):
+    use_state_dir(tmp)
+    model.abridged.set_journal(None)
+    model.abridged.set_db(SharedFirestore(firestore))
+    posted = {event['id']: event for event in events if event['type'] == 'message'}
+    mine = [event for event in events if event_shard(event, shard_count) in shard_ids]
+    results.put(asyncio.run(run_worker(shard_ids, shard_count, layout, mine, posted, urls, authkey, args, ready, start, handled_everywhere)))
+
+
+async def run_worker(shard_ids, shard_count, layout, events, posted, urls, authkey, args, ready, start, handled_everywhere):
+    from workerpool import RemoteExecutor
+
+    perspective_url, articles_url = urls
+    calls = DiscordCalls(args.discord_latency)
+    bot = make_bot(shard_ids, shard_count, RemoteExecutor(MODEL_POOL_ADDRESS, authkey), calls, layout, posted, articles_url)
+    limiter = TokenBucket(args.perspective_qps, args.perspective_qps)
+    bot.perspective = PerspectiveClient('harness-key', url=f'{perspective_url}/analyze', limiter=limiter)
+    bot.scoring_queue = ScoringQueue(bot.perspective.score, limiter=limiter)
+    replay = ShardReplay(bot, articles_url)
+
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, ready.wait)
+        await loop.run_in_executor(None, start.wait)
+        began = time.time()
+        handled = await replay.run(events, handled_everywhere, args.concurrency)
+        done = time.time()
+    finally:
+        await bot.perspective.close()
+        await bot.fake_news.close()
+        bot.fake_news.executor.shutdown()
+        bot.score_cache.close()
+        bot.tickets.close()
+    writer = model.abridged.get_writer().stats()
+    return {'shard_ids': shard_ids, 'began': began, 'handled': handled, 'done': done, 'counts': replay.counts,
+            'jobs_run': replay.jobs_run, 'failures': replay.failures + writer['failures'] + writer['dead_lettered']}
+
+
+def wait_for_pool(authkey, timeout=30):
+    '''
+    Runs one job through the model pool, retrying while its server starts up.
+    '''
+    from workerpool import RemoteExecutor
+
+    deadline = time.monotonic() + timeout
+    while True:
+        executor = RemoteExecutor(MODEL_POOL_ADDRESS, authkey, max_threads=1)
+        try:
+            return executor.submit(extract_article_text, '', '<p>ready</p>').result(timeout=timeout)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+        finally:
+            executor.shutdown()
+
+
+def run(processes, layout, events, stand_ins, authkey, args):
+    shard_count = processes * 2
+    with tempfile.TemporaryDirectory() as tmp:
+        use_state_dir(tmp)
+        SQLiteTicketStore(globals.TICKET_STORE_PATH).close()
+
+        firestore_server = FirestoreServer()
+        firestore_server.start()
+        firestore = firestore_server.FakeFirestore(args.firestore_latency)
+        ready = multiprocessing.Barrier(processes + 1)
+        start = multiprocessing.Barrier(processes + 1)
+        handled_everywhere = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=worker, args=(shard_ids, shard_count, layout, events, stand_ins[i], firestore, tmp, authkey,
+                                                                args, ready, start, handled_everywhere, results))
+                   for i, shard_ids in enumerate(shard_ranges(shard_count, processes))]
+        for w in workers:
+            w.start()
+        ready.wait()
+        start.wait()
+        # Results are read before joining, so no worker is left blocked writing to the queue
+        reports = []
+        while len(reports) < processes:
+            try:
+                reports.append(results.get(timeout=1))
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers) and results.empty():
+                    break
+        for w in workers:
+            w.join()
+        firestore_server.shutdown()
+        failed = [w.name for w in workers if w.exitcode != 0]
+        if failed or len(reports) != processes:
+            sys.exit(f'shard workers failed: {failed}')
+
+        store = SQLiteTicketStore(globals.TICKET_STORE_PATH)
+        left = store.take_guild_jobs(set(layout))
+        backlog = store.backlog_stats()
+        store.close()
+        if left:
+            sys.exit(f'{len(left)} guild jobs were left in the ticket store')
+        failures = sum(report['failures'] for report in reports)
+        if failures:
+            sys.exit(f'{failures} events, guild jobs or Firestore writes failed (see the log above)')
+        return sorted(reports, key=lambda report: report['shard_ids']), backlog
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000, help='channel messages in the synthetic stream')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=256, help='events in flight at once in each worker')
+    parser.add_argument('--perspective-latency', type=float, default=0.05)
+    parser.add_argument('--perspective-qps', type=float, default=1000, help='Perspective quota of each worker')
+    parser.add_argument('--article-latency', type=float, default=0.1)
+    parser.add_argument('--discord-latency', type=float, default=0.02)
+    parser.add_argument('--firestore-latency', type=float, default=0.01)
+    args = parser.parse_args()
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    logger.addHandler(handler)
+    try:
+        import firebase_admin.firestore
+    except ImportError:
+        sys.exit('bench/shard_harness.py needs firebase-admin for the Firestore writer: pip install firebase-admin')
+
+    layout, events = sharded_events(args.messages, args.seed)
+    authkey = os.urandom(16)
+    pool = start_model_pool(authkey)
+    urls = multiprocessing.Queue()
+    servers = [multiprocessing.Process(target=serve_stand_ins, args=(args.perspective_latency, args.article_latency, urls), daemon=True)
+               for _ in range(max(args.processes))]
+    try:
+        for server in servers:
+            server.start()
+        stand_ins = [urls.get(timeout=30) for _ in servers]
+        wait_for_pool(authkey)
+        baseline = None
+        print(f'{len(events)} events, {args.messages} channel messages over {GUILDS} guilds')
+        print(f'{"processes":>10}{"msgs/sec":>12}{"speedup":>10}')
+        for processes in args.processes:
+            reports, backlog = run(processes, layout, events, stand_ins, authkey, args)
+            elapsed = max(report['done'] for report in reports) - min(report['began'] for report in reports)
+            rate = args.messages / elapsed
+            baseline = baseline or rate
+            print(f'{processes:>10}{rate:>12.0f}{rate / baseline:>10.2f}    tickets: {backlog["open"]} open, {backlog["decided"]} decided')
+            for report in reports:
+                counts = report['counts']
+                print(f'{"":>14}shards {report["shard_ids"]}: {counts.get("message", 0)} messages, {counts.get("edit", 0)} edits, '
+                      f'{counts.get("dm", 0) + counts.get("next", 0)} DMs and !next, {report["jobs_run"]} guild jobs run, '
+                      f'events handled in {report["handled"] - report["began"]:.2f}s, done in {report["done"] - report["began"]:.2f}s')
+    finally:
+        for server in servers:
+            server.terminate()
+        stop_model_pool(pool)
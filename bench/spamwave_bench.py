@@ -0,0 +1,135 @@
+'''
+Throughput and accuracy of the spam wave detector (spamwave.py) on a synthetic channel stream.
+
+Run from the repository root:
+    python bench/spamwave_bench.py [--rate 12000] [--minutes 15] [--raid-share 0.2]
+
+Ordinary chat is mixed with raids: waves of copies of a spam message, each copy varied the way
+raids vary them (mentions, random suffixes, case, dropped or added words, different links). Raid
+messages are drawn from the same vocabulary as the chat, so every raid is a distinct message.
+Messages are fed at --rate messages per simulated minute, so the detector's window and memory
+bound behave as they would live. Reports messages/sec the detector sustains (against the rate
+needed), p50/p99 time per message, clusters held and memory at the end, and how well clusters
+match the ground truth: the share of raid copies in their raid's largest cluster, how many
+clusters (and so tickets) each raid splits into, and the share of chat messages attached to another
+message.
+'''
+import argparse
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, '.')
+from spamwave import SpamWaveDetector
+
+FILLERS = ['!!', 'lol', 'pls', 'fr', 'now', 'omg', '🔥', 'asap']
+
+
+class Message:
+    def __init__(self, id, content, wave):
+        self.id = id
+        self.channel = None
+        self.content = content
+        self.wave = wave # Ground truth: raid number, or None for chat
+
+
+def random_word(rng):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+
+
+def chat_message(rng, vocabulary):
+    return ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(3, 30)))
+
+
+def raid_copy(rng, template):
+    link = f'https://{rng.choice(["bit.ly", "tinyurl.com", "spam.example"])}/{random_word(rng)}{rng.randint(1, 9999)}'
+    words = template.format(link=link).split()
+    for _ in range(rng.randint(0, 3)):
+        edit = rng.random()
+        if edit < 0.3:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(FILLERS))
+        elif edit < 0.5 and len(words) > 5:
+            del words[rng.randrange(len(words))]
+        elif edit < 0.7:
+            i = rng.randrange(len(words))
+            words[i] = words[i].upper()
+        elif edit < 0.85:
+            words.append(f'<@{rng.randint(10 ** 17, 10 ** 18)}>')
+        else:
+            words.append(str(rng.randint(1, 99999)))
+    return ' '.join(words)
+
+
+def stream(rate, minutes, raid_share, seed=0):
+    '''
+    Yields (simulated time, Message). Raids start at random and last a minute or two each.
+    '''
+    rng = random.Random(seed)
+    vocabulary = [random_word(rng) for _ in range(5000)]
+    raids = [] # List of (end time, wave number, template)
+    waves = 0
+    for i in range(int(rate * minutes)):
+        now = i * 60.0 / rate
+        raids = [raid for raid in raids if raid[0] > now]
+        if not raids or rng.random() < 0.002:
+            template = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(8, 20))) + ' {link}'
+            raids.append((now + rng.uniform(60, 120), waves, template))
+            waves += 1
+        if rng.random() < raid_share:
+            _, wave, template = rng.choice(raids)
+            yield now, Message(i, raid_copy(rng, template), wave)
+        else:
+            yield now, Message(i, chat_message(rng, vocabulary), None)
+
+
+def run(messages, detector):
+    timings = []
+    waves = {} # Key: wave number Value: {cluster id: copies in it}
+    chat = wrongly_joined = 0
+    start = time.perf_counter()
+    for now, message in messages:
+        before = time.perf_counter()
+        cluster = detector.add(message, now)
+        timings.append(time.perf_counter() - before)
+        if cluster is None:
+            continue
+        if message.wave is None:
+            chat += 1
+            wrongly_joined += cluster.size > 1
+        else:
+            clusters = waves.setdefault(message.wave, {})
+            clusters[cluster.id] = clusters.get(cluster.id, 0) + 1
+    elapsed = time.perf_counter() - start
+    return elapsed, sorted(timings), waves, chat, wrongly_joined
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=int, default=12000, help='messages per minute')
+    parser.add_argument('--minutes', type=float, default=15)
+    parser.add_argument('--raid-share', type=float, default=0.2)
+    args = parser.parse_args()
+
+    messages = list(stream(args.rate, args.minutes, args.raid_share))
+    detector = SpamWaveDetector()
+    elapsed, timings, waves, chat, wrongly_joined = run(messages, detector)
+    copies = sum(sum(clusters.values()) for clusters in waves.values())
+    in_main_cluster = sum(max(clusters.values()) for clusters in waves.values())
+    fragments = sorted(len(clusters) for clusters in waves.values())
+
+    print(f'{len(messages)} messages at {args.rate}/min over {args.minutes:g} simulated minutes')
+    print(f'throughput: {len(messages) / elapsed:.0f} msgs/sec (needed: {args.rate / 60:.0f})')
+    print(f'per message: p50 {timings[len(timings) // 2] * 1e6:.0f} us, p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} us')
+    print(f'{len(waves)} raids, {copies} copies: {in_main_cluster / max(copies, 1):.1%} in their raid\'s largest cluster, '
+          f'clusters (tickets) per raid p50 {fragments[len(fragments) // 2]}, max {fragments[-1]}')
+    print(f'chat messages attached to another message: {wrongly_joined / max(chat, 1):.2%} of {chat}')
+    print(f'detector: {detector.stats()}')
+
+    # Memory is measured on a second run, since tracing slows everything down
+    tracemalloc.start()
+    detector = SpamWaveDetector()
+    run(messages, detector)
+    current, peak = tracemalloc.get_traced_memory()
+    print(f'memory held: {current / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB) for {len(detector.clusters)} clusters')
@@ -0,0 +1,61 @@
+'''
+Startup benchmark for the fake news model: import time and peak RSS of the old eager joblib load
+versus the compact artifact. Importing model.abridged itself no longer loads either, so the
+first-use rows are paid on the first fake news check rather than at bot startup. Each case runs
+in a fresh interpreter.
+
+Run from the repository root (where the joblib files and exported fake_news_model/ live):
+    python bench/startup.py
+'''
+import json
+import subprocess
+import sys
+
+SAMPLE = 'Woah, the senator says the election was stolen and the media is covering it up'
+
+CASES = {
+    # What importing model.abridged used to cost at startup
+    'eager joblib': '''
+import numpy, pandas, matplotlib.pyplot, sklearn.ensemble, sklearn.metrics, sklearn.model_selection
+from joblib import load
+vectorizer = load('text_tf_idf_vectorizer.joblib')
+clf = load('fake_news_classifier.joblib')
+''',
+    # First prediction with the compact artifact
+    'compact first use': f'''
+from model.compact import CompactModel
+CompactModel('fake_news_model').predict_fake_proba([{SAMPLE!r}])
+''',
+    # First prediction with the joblib files
+    'joblib first use': f'''
+from joblib import load
+vectorizer = load('text_tf_idf_vectorizer.joblib')
+clf = load('fake_news_classifier.joblib')
+clf.predict_proba(vectorizer.transform([{SAMPLE!r}]))
+''',
+}
+
+MEASURE = '''
+import json, resource, time
+start = time.perf_counter()
+exec(compile({code!r}, 'case', 'exec'))
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+'''
+
+
+def run_case(code):
+    result = subprocess.run([sys.executable, '-c', MEASURE.format(code=code)], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1]), None
+
+
+if __name__ == '__main__':
+    print(f'{"case":<20}{"seconds":>10}{"max RSS (MB)":>15}')
+    for name, code in CASES.items():
+        measurement, error = run_case(code)
+        if measurement is None:
+            print(f'{name:<20}  failed: {error}')
+        else:
+            print(f'{name:<20}{measurement["seconds"]:>10.3f}{measurement["max_rss_kb"] / 1024:>15.1f}')
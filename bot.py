@@ -1,46 +1,112 @@
 # bot.py
+import asyncio
 import discord
-from discord.ext import commands
-from discord.utils import get
 import os
 import json
 import logging
 import re
-import requests
-from report import Report, ReportDatabaseEntry
-from review import Review
-from uni2ascii import uni2ascii
+from report import Report, ReportDatabaseEntry, MessageRef, UserRef, MODBOT
+from review import Review, BulkReview
+from perspective import PerspectiveClient
+from scoring import ScoringQueue
+from outbound import OutboundScheduler
+from cache import LRUCache, ScoreCache
+import normalize
+from normalize import content_hash, fold
+from edits import EditTracker, split_links
+from spamwave import SpamWaveDetector
+from metrics import METRICS
+from logs import setup_logging
+from fakenews import FakeNewsChecker
+from model.prefilter import LocalPrefilter
+from model.registry import UserRegistry
+from model.writer import report_weight
+from tickets import open_ticket_store, ticket_priority, AsyncTicketStore, reporter_key, Conversations, OPEN, DECIDED, CREATED, MERGED
+from ratelimit import TokenBucket
 import globals
 from model.abridged import *
 
-# Set up logging to the console
+# Logging is set up in main() (see logs.py)
 logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
 
 
-# There should be a file called 'token.json' inside the same folder as this file
-token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
-    perspective_key = tokens['perspective']
+def load_tokens():
+    # There should be a file called 'token.json' inside the same folder as this file
+    token_path = 'tokens.json'
+    if not os.path.isfile(token_path):
+        raise Exception(f"{token_path} not found!")
+    with open(token_path) as f:
+        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+        tokens = json.load(f)
+        return tokens['discord'], tokens['perspective']
 
 
-class ModBot(discord.Client):
-    def __init__(self, key):
+def shard_path(path, shard_ids):
+    '''
+    Gives each shard process its own copy of a file the process writes: path suffixed with its first shard id.
+    '''
+    if not shard_ids:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}-{shard_ids[0]}{ext}'
+
+
+# Fields a raw message edit payload needs for discord.Message to be built from it
+MESSAGE_FIELDS = ('id', 'author', 'content', 'attachments', 'embeds', 'edited_timestamp', 'type', 'pinned', 'mention_everyone', 'tts')
+
+
+class ModBot(discord.AutoShardedClient):
+    def __init__(self, key, shard_ids=None, shard_count=None, model_executor=None):
+        '''
+        With no shard arguments the bot runs as a single process using Discord's recommended shard count.
+        shards.py passes each process its shard_ids and the executor for the shared model pool.
+        '''
         intents = discord.Intents.default()
-        super().__init__(command_prefix='.', intents=intents)
+        super().__init__(command_prefix='.', intents=intents, shard_ids=shard_ids, shard_count=shard_count)
         self.group_num = None   
         self.mod_channels = {} # Map from guild to the mod channel id for that guild
-        self.reports = {} # Map from user IDs to the state of their report
-        self.reviews = {} # Map from user IDs to the state of their review
+        # Ticket and conversation state is shared by every bot process through the ticket store
+        self.tickets = AsyncTicketStore(open_ticket_store(globals.TICKET_STORE_PATH))
+        self.backlog = {} # Latest backlog_stats() of the ticket store, refreshed by sweep_leases
+        self.reports = Conversations(self.tickets, 'report', Report, self) # Map from user IDs to the state of their report
+        self.reviews = Conversations(self.tickets, 'review', Review, self) # Map from user IDs to the state of their review
+        self.bulk_reviews = Conversations(self.tickets, 'bulk', BulkReview, self) # Map from user IDs to the page they are bulk reviewing
         self.perspective_key = key
+        # First attempts and retries are paced by the same Perspective quota
+        perspective_limiter = TokenBucket(globals.PERSPECTIVE_QPS, globals.PERSPECTIVE_BURST)
+        self.perspective = PerspectiveClient(key, limiter=perspective_limiter)
+        self.scoring_queue = ScoringQueue(self.perspective.score, limiter=perspective_limiter)
+        self.prefilter = LocalPrefilter()
+        self.score_cache = ScoreCache(globals.SCORE_CACHE_SIZE, globals.SCORE_CACHE_TTL, globals.SCORE_CACHE_PATH)
+        # Every process saves its domain reputation index on close, so each shard keeps its own on top of the shared pre-warm file
+        self.fake_news = FakeNewsChecker(executor=model_executor, reputation_path=shard_path(globals.DOMAIN_REPUTATION_PATH, shard_ids))
+        self.fake_news_jobs = {} # Map from message IDs to the set of their running fake news checks
+        self.edits = EditTracker()
+        self.spam_waves = SpamWaveDetector()
+        self.user_registry = UserRegistry()
+        self.lease_sweeper = None
+        self.job_runner = None
+        # Guild jobs (see tickets.py) by name; each takes a ticket id
+        self.guild_jobs = {'post': self.handle_report, 'take_down': self.take_down_full_ticket, 'decide': self.handle_review}
+        self.outbound = OutboundScheduler()
+        self.messages = LRUCache(globals.MESSAGE_CACHE_SIZE, globals.MESSAGE_CACHE_TTL) # Map from message IDs to messages we've seen
+        self.report_throttles = LRUCache(globals.REPORT_THROTTLE_USERS) # Map from reporter IDs to their report token buckets
+        self.ticket_posts = LRUCache(globals.MESSAGE_CACHE_SIZE) # Map from mod channel message IDs to the ticket they post
+        self.loop_lag_sampler = None
+
+        # Read when the metrics endpoint is scraped
+        METRICS.register('scoring', lambda: self.scoring_queue.stats())
+        METRICS.register('score_cache', lambda: self.score_cache.stats())
+        METRICS.register('prefilter', lambda: self.prefilter.stats())
+        METRICS.register('fake_news', lambda: self.fake_news.stats())
+        METRICS.register('outbound', lambda: self.outbound.stats())
+        METRICS.register('edits', lambda: self.edits.stats())
+        METRICS.register('spam_waves', lambda: self.spam_waves.stats())
+        METRICS.register('tickets', lambda: self.backlog)
+        METRICS.register('message_cache', lambda: self.messages.stats())
+        METRICS.register('users', lambda: self.user_registry.stats())
+        METRICS.register('firestore_writer', lambda: get_writer().stats())
+        METRICS.register('normalize', normalize.stats)
 
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
@@ -61,6 +127,46 @@ class ModBot(discord.Client):
                 if channel.name == f'group-{self.group_num}-mod':
                     self.mod_channels[guild.id] = channel
 
+        # Load the set of registered users so !add_user doesn't need to scan Firestore
+        await self.loop.run_in_executor(None, self.user_registry.start)
+
+        if self.lease_sweeper is None:
+            self.lease_sweeper = asyncio.ensure_future(self.sweep_leases())
+        if self.job_runner is None:
+            self.job_runner = asyncio.ensure_future(self.run_guild_jobs())
+
+        if self.loop_lag_sampler is None:
+            self.loop_lag_sampler = asyncio.ensure_future(METRICS.sample_loop_lag(globals.METRICS_LOOP_LAG_INTERVAL))
+            if globals.METRICS_PORT is not None:
+                # Each shard process gets its own port
+                port = globals.METRICS_PORT + (self.shard_ids[0] if self.shard_ids else 0)
+                await METRICS.serve(globals.METRICS_HOST, port)
+
+    async def close(self):
+        await self.perspective.close()
+        self.prefilter.close()
+        self.user_registry.stop()
+        if self.lease_sweeper is not None:
+            self.lease_sweeper.cancel()
+        if self.job_runner is not None:
+            self.job_runner.cancel()
+        if self.loop_lag_sampler is not None:
+            self.loop_lag_sampler.cancel()
+        await METRICS.stop()
+        for jobs in self.fake_news_jobs.values():
+            for job in jobs:
+                job.cancel()
+        await self.fake_news.close()
+        await self.outbound.close()
+        # Closing the stores writes out what they have pending, which may mean waiting on the disk or Firestore
+        await self.loop.run_in_executor(None, self.close_stores)
+        await super().close()
+
+    def close_stores(self):
+        if not get_writer().flush(globals.FIRESTORE_SHUTDOWN_TIMEOUT):
+            logger.error(f'Firestore writes still queued after {globals.FIRESTORE_SHUTDOWN_TIMEOUT}s; journaled ones are replayed on the next start')
+        self.score_cache.close()
+        self.tickets.close()
 
     async def on_message(self, message):
         '''
@@ -70,6 +176,7 @@ class ModBot(discord.Client):
         # Ignore messages from us 
         if message.author.id == self.user.id:
             return
+        self.messages.put(message.id, message)
         
         # Check if this message was sent in a server ("guild") or if it's a DM
         if message.guild:
@@ -79,70 +186,240 @@ class ModBot(discord.Client):
         
         if message.content == '!add_user':
             mod_channel = self.mod_channels[message.guild.id]
-            if str(message.author) not in get_all_users_firebase():
-                add_user(str(message.author))
+            user_name = str(message.author)
+            if user_name not in self.user_registry and await self.loop.run_in_executor(None, self.user_registry.create_if_absent, user_name):
                 await mod_channel.send(f'```Added User: {str(message.author)} to the Firebase Database.```')
             else:
                 await mod_channel.send(f'```User: {str(message.author)} is trying to re-add themselves to the Firebase Database.```')
 
+        if message.guild and self.mod_channels.get(message.guild.id) == message.channel:
+            if message.content == '!next':
+                # Hand the moderator the most urgent ticket they can take
+                id = await self.tickets.claim_next(message.author.id, await self.required_reviewers(), globals.REVIEW_LEASE)
+                if id is None:
+                    await message.author.send('```There are no tickets waiting for you.```')
+                else:
+                    await self.claimed_ticket(message.author, id)
+            elif BulkReview.START_PATTERN.match(message.content):
+                await self.start_bulk_review(message)
+            elif message.content == '!backlog':
+                stats = await self.tickets.backlog_stats()
+                reply = f'Open tickets: {stats["open"]} ({stats["claimed"]} being reviewed), oldest waiting {stats["oldest_open_age"] / 60:.0f} min\n'
+                reply += f'Decided tickets: {stats["decided"]}, average time to decision {stats["avg_time_to_decision"] / 60:.0f} min'
+                await message.channel.send(self.code_format(reply))
+
     async def on_raw_message_edit(self, payload):
+        # Embeds being added to a message also arrive as edits; without new content there is nothing to re-check
+        if "content" not in payload.data:
+            return
+
         # Message sent in a server
         if "guild_id" in payload.data:
             # Search for the message via guild and channel
-            guild = client.get_guild((int)(payload.data["guild_id"]))
+            guild = self.get_guild((int)(payload.data["guild_id"]))
             if not guild:
                 return
             channel = guild.get_channel((int)(payload.data["channel_id"]))
             if not channel:
                 return
-            try:
-                message = await channel.fetch_message((int)(payload.data["id"]))
-            except discord.errors.NotFound:
+            message = await self.message_from_edit(channel, payload)
+            if message is None:
                 return
             
-            await self.handle_channel_message(message)
+            # Bursts of edits are handled once, after they stop
+            self.edits.submit(message, self.handle_channel_edit)
         
         # Message is a DM
         else:
             # Search for the message via channel
-            channel = client.get_channel((int)(payload.data["channel_id"]))
+            channel = self.get_channel((int)(payload.data["channel_id"]))
             if not channel:
                 return
-            try:
-                message = await channel.fetch_message((int)(payload.data["id"]))
-            except discord.errors.NotFound:
+            message = await self.message_from_edit(channel, payload)
+            if message is None:
                 return
 
             await self.handle_dm(message)
 
+    async def message_from_edit(self, channel, payload):
+        '''
+        The edited message, built from what we already have where possible: a cached copy with the new
+        content, or a message constructed from the payload when the payload is complete. Only fetched as a last resort.
+        '''
+        message = self.messages.get(payload.message_id) or payload.cached_message
+        if message is not None:
+            message.content = payload.data["content"]
+        elif all(key in payload.data for key in MESSAGE_FIELDS):
+            message = discord.Message(state=self._connection, channel=channel, data=payload.data)
+        else:
+            try:
+                message = await channel.fetch_message(payload.message_id)
+            except discord.errors.NotFound:
+                return None
+        self.messages.put(message.id, message)
+        return message
+
+    async def get_message(self, channel, message_id):
+        '''
+        Like channel.fetch_message, but answered from the message cache when we've seen the message.
+        '''
+        message = self.messages.get(message_id)
+        if message is None or message.channel.id != channel.id:
+            message = await channel.fetch_message(message_id)
+            self.messages.put(message_id, message)
+        return message
+
     async def on_raw_reaction_add(self, payload):
-        mod_channel = self.mod_channels[payload.guild_id]
         if payload.guild_id in self.mod_channels and payload.emoji.name == "✋" and self.user.id != payload.user_id:
-            message = await mod_channel.fetch_message(payload.message_id)
-            reaction = get(message.reactions, emoji=payload.emoji.name)
-                
-            # DM user 
-            ticket_message = await mod_channel.fetch_message(payload.message_id)
-            id = ticket_message.content.split()[1][1:]
-            report = globals.REPORTS_DATABASE[(int)(id)]
-
-            if reaction and reaction.count > globals.NUM_REVIEWERS:
-                await message.delete()
-
-            reply = "Report summary for Ticket #" + id + "\n```"
-            reply += "Reporting user: " + str(report.reporting_user) + "\n"
-            reply += "Reported user: " + str(report.reported_user) + "\n"
-            reply += "Message: " + str(report.reported_message.content) + "\n"
-            reply += "Category: " + globals.get_catStr(report) + "\n"
-            reply += "Additional Info: " + str(report.reported_description) + "```\n"
-            reply += "Enter 's' when you're ready to start reviewing."
-            await payload.member.send(reply)
-
-            globals.CURRENT_REVIEWERS_DB[payload.user_id] = id
+            id = self.ticket_posts.get(payload.message_id)
+            if id is None:
+                id = await self.tickets.ticket_for_mod_message(payload.message_id)
+                if id is None:
+                    return
+                self.ticket_posts.put(payload.message_id, id)
+
+            if not await self.tickets.claim(id, payload.user_id, await self.required_reviewers(), globals.REVIEW_LEASE):
+                current = await self.tickets.reviewer_ticket(payload.user_id)
+                if current is not None and current != id:
+                    await payload.member.send(f'```You are still reviewing Ticket #{current}. Finish it before claiming another.```')
+                else:
+                    await payload.member.send(f'```Ticket #{id} already has enough reviewers or has been decided.```')
+                return
+
+            await self.claimed_ticket(payload.member, id)
+
+    async def start_bulk_review(self, message):
+        '''
+        Sends the moderator a page of tickets to review with one batched verdict (see BulkReview).
+        '''
+        current = await self.tickets.reviewer_ticket(message.author.id)
+        if current is not None:
+            await message.author.send(f'```You are still reviewing Ticket #{current}. Finish it before starting a bulk review.```')
+            return
+        size = BulkReview.START_PATTERN.match(message.content).group(1)
+        size = min(max(int(size), 1), globals.BULK_REVIEW_MAX_PAGE) if size else globals.BULK_REVIEW_PAGE
+
+        bulk_flow = BulkReview(self)
+        responses = await bulk_flow.start(message.author.id, size)
+        if not responses:
+            await message.author.send('```There are no tickets waiting for you.```')
+            return
+        await self.bulk_reviews.save(message.author.id, bulk_flow)
+        for r in responses:
+            await message.author.send(r)
+
+    async def claimed_ticket(self, reviewer, id):
+        '''
+        Sends a reviewer the summary of the ticket they just claimed, and takes the ticket's post down
+        once it has as many reviewers as it needs.
+        '''
+        report = await self.tickets.get_report(id)
+        reply = "Report summary for Ticket #" + str(id) + "\n```"
+        reply += "Reporting user: " + str(report.reporting_user) + "\n"
+        reply += "Reported user: " + str(report.reported_user) + "\n"
+        reply += "Message: " + str(report.reported_message.content) + "\n"
+        reply += "Category: " + globals.get_catStr(report) + "\n"
+        reply += "Additional Info: " + str(report.reported_description) + "\n"
+        # Reports of the same message by other users were merged into this ticket
+        for merged in await self.tickets.get_ticket_reports(id):
+            if reporter_key(merged) != reporter_key(report):
+                reply += f"Also reported by {merged.reporting_user}: {globals.get_catStr(merged)}\n"
+        reply += "```\n"
+        reply += f"Enter 's' when you're ready to start reviewing. Your claim lapses after {globals.REVIEW_LEASE // 60} minutes without activity."
+        await reviewer.send(reply)
+        await self.in_guild(report, 'take_down', id)
+
+    async def take_down_full_ticket(self, id, report=None):
+        '''
+        Takes a ticket's post down once it has as many reviewers as it needs.
+        '''
+        if report is None:
+            report = await self.tickets.get_report(id)
+        taken = len(await self.tickets.ticket_reviewers(id)) + len(await self.tickets.get_reviews(id))
+        message_id = await self.tickets.get_mod_message(id)
+        if taken >= await self.required_reviewers() and message_id is not None:
+            await self.tickets.set_mod_message(id, None)
+            mod_channel = self.mod_channels[report.reported_message.guild_id]
+            try:
+                await mod_channel.get_partial_message(message_id).delete()
+            except discord.errors.NotFound:
+                pass
+
+    async def sweep_leases(self):
+        '''
+        Returns tickets whose reviewers went quiet to the queue.
+        '''
+        while True:
+            await asyncio.sleep(globals.REVIEW_LEASE_SWEEP_INTERVAL)
+            self.backlog = await self.tickets.backlog_stats()
+            for reviewer_id, id in await self.tickets.expire_leases():
+                await self.reviews.pop(reviewer_id)
+                try:
+                    reviewer = self.get_user(reviewer_id) or await self.fetch_user(reviewer_id)
+                    await reviewer.send(f'```Your claim on Ticket #{id} expired and the ticket has been returned to the queue.```')
+                except discord.errors.HTTPException:
+                    logger.warning(f'Could not tell reviewer {reviewer_id} their claim on ticket {id} expired')
+
+                # Re-post the ticket if its post was taken down when it filled up
+                if await self.tickets.get_state(id) == OPEN and await self.tickets.get_mod_message(id) is None:
+                    await self.in_guild(await self.tickets.get_report(id), 'post', id)
+
+    def owns_guild(self, guild_id):
+        '''
+        Whether this process runs the shard that guild_id's events go to. Unsharded, it runs them all.
+        '''
+        return self.shard_ids is None or (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def in_guild(self, report, job, id):
+        '''
+        Runs a guild job (see tickets.py) for ticket id, whose report is given, in the guild of the
+        reported message. Only the process running that guild's shard knows its mod channel and its
+        spam waves, and DMs all arrive at the process running shard 0, so jobs for guilds on other
+        shards are left in the ticket store for their own process to pick up (see run_guild_jobs).
+        '''
+        guild_id = report.reported_message.guild_id
+        if not self.owns_guild(guild_id):
+            await self.tickets.add_guild_job(guild_id, job, id)
+        elif guild_id not in self.mod_channels:
+            logger.warning(f'Guild {guild_id} of ticket {id} has no mod channel, dropping its {job} job')
+        else:
+            await self.guild_jobs[job](id)
+
+    async def run_guild_jobs(self):
+        while True:
+            await asyncio.sleep(globals.GUILD_JOB_INTERVAL)
+            try:
+                await self.run_pending_guild_jobs()
+            except Exception:
+                logger.exception('Could not run guild jobs')
+
+    async def run_pending_guild_jobs(self):
+        '''
+        Runs the guild jobs other processes left for this process's guilds. Jobs for different tickets
+        run together, so their notices share digests; each ticket's own jobs run in order. Returns how many ran.
+        '''
+        jobs = {} # Key: ticket id Value: list of its jobs, oldest first
+        for job, id in await self.tickets.take_guild_jobs(set(self.mod_channels)):
+            jobs.setdefault(id, []).append(job)
+        await self.outbound.dispatch(*(self.run_ticket_jobs(id, names) for id, names in jobs.items()))
+        count = sum(len(names) for names in jobs.values())
+        METRICS.inc('guild_jobs_run', count)
+        return count
+
+    async def run_ticket_jobs(self, id, names):
+        for name in names:
+            await self.guild_jobs[name](id)
+
+    async def required_reviewers(self):
+        '''
+        How many reviews a ticket needs: NUM_REVIEWERS, unless it was changed from a DM.
+        '''
+        required = await self.tickets.get_setting('num_reviewers')
+        return globals.NUM_REVIEWERS if required is None else required
 
     async def handle_dm(self, message):
-        # Translate unicode
-        message.content = uni2ascii(message.content)
+        # Fold look-alike unicode to ASCII
+        message.content = fold(message.content)
 
         # Handle a help message
         if message.content == Report.HELP_KEYWORD:
@@ -155,102 +432,253 @@ class ModBot(discord.Client):
         responses = []
 
         # Let the report class handle this message; forward all the messages it returns to us
-        if author_id not in globals.CURRENT_REVIEWERS_DB:
-        # Only respond to messages if they're part of a reporting flow
-            if author_id not in self.reports and not message.content.startswith(Report.START_KEYWORD):
+        case_id = await self.tickets.reviewer_ticket(author_id)
+        if case_id is None:
+            bulk_flow = await self.bulk_reviews.get(author_id)
+            if bulk_flow is not None:
+                await self.handle_bulk_review(message, bulk_flow)
+                return
+
+            report_flow = await self.reports.get(author_id)
+            # Only respond to messages if they're part of a reporting flow
+            if report_flow is None and not message.content.startswith(Report.START_KEYWORD):
                 return
 
             # If we don't currently have an active report for this user, add one
-            if author_id not in self.reports:
-                self.reports[author_id] = Report(self)
+            if report_flow is None:
+                report_flow = Report(self)
         
-            responses, report = await self.reports[author_id].handle_message(message)
+            responses, report = await report_flow.handle_message(message)
             for r in responses:
                 await message.channel.send(r)
 
             # If the report is complete or cancelled, remove it from our map
-            if self.reports[author_id].report_complete():
-                if report is not None and report.reporting_user not in globals.BAD_REPORT_TRACKER:
-                    globals.BAD_REPORT_TRACKER[report.reporting_user] = 1
-                self.reports.pop(author_id)
-                if report is not None and globals.BAD_REPORT_TRACKER[report.reporting_user] <= globals.BAD_REPORT_THRESHOLD:
-                    globals.TICKET_NUM += 1
-                    globals.REPORTS_DATABASE[globals.TICKET_NUM] = report
-                    await self.handle_report(globals.TICKET_NUM)
+            if report_flow.report_complete():
+                await self.reports.pop(author_id)
+                if report is not None and await self.may_report(author_id):
+                    # Messages that have been scored recently carry their Perspective score into the ticket priority
+                    scores = self.score_cache.get(content_hash(report.reported_message.content)) or {}
+                    await self.open_ticket(report, max(scores.values(), default=0.0))
+            else:
+                await self.reports.save(author_id, report_flow)
         else: # This is a review from a moderator
             # If we don't currently have an active report for this user, add one
-            if author_id not in self.reviews and message.content != "s":
+            review_flow = await self.reviews.get(author_id)
+            if review_flow is None and message.content != "s":
                 return
 
-            if author_id not in self.reviews:
-                self.reviews[author_id] = Review(self)
+            if review_flow is None:
+                review_flow = Review(self)
             
-            case_id = globals.CURRENT_REVIEWERS_DB[author_id]
-            report = globals.REPORTS_DATABASE[(int)(case_id)]
+            report = await self.tickets.get_report(case_id)
+            await self.tickets.renew_lease(author_id, globals.REVIEW_LEASE)
 
-            responses = await self.reviews[author_id].review_report(message, report, case_id, author_id)
+            responses = await review_flow.review_report(message, report, case_id, author_id)
             for r in responses:
                 await message.channel.send(r) 
 
             # If the review is complete or cancelled, remove it from our map
-            if self.reviews[author_id].review_complete():
-                self.reviews.pop(author_id)
-                del globals.CURRENT_REVIEWERS_DB[author_id]
-                # Set number of reviewers in globals file
-                if (len(globals.REVIEWS_DATABASE[case_id]) >= globals.NUM_REVIEWERS):
-                    await self.handle_review(case_id)
+            if review_flow.review_complete():
+                await self.reviews.pop(author_id)
+                await self.tickets.release_reviewer(author_id)
+                # Only the review that completes the set applies the decision
+                if await self.tickets.try_decide(case_id, await self.required_reviewers()):
+                    await self.in_guild(report, 'decide', case_id)
+            else:
+                await self.reviews.save(author_id, review_flow)
+
+    async def handle_bulk_review(self, message, bulk_flow):
+        author_id = message.author.id
+        responses, reviewed = await bulk_flow.review_page(message, author_id)
+        for r in responses:
+            await message.channel.send(r)
+        if bulk_flow.review_complete():
+            await self.bulk_reviews.pop(author_id)
+        else:
+            await self.bulk_reviews.save(author_id, bulk_flow)
+
+        # Tickets the batch filled up are taken down, then every one it decided is applied at once:
+        # their mod channel notices share a digest and their Firestore writes share a batch (per process,
+        # for tickets from guilds on other shards)
+        required = await self.required_reviewers()
+        reports = {id: await self.tickets.get_report(id) for id in reviewed}
+        await self.outbound.dispatch(*(self.in_guild(report, 'take_down', id) for id, report in reports.items()))
+        decided = [id for id in reviewed if await self.tickets.try_decide(id, required)]
+        await self.outbound.dispatch(*(self.in_guild(reports[id], 'decide', id) for id in decided))
 
     async def handle_review(self, case_id):
-        report = globals.REPORTS_DATABASE[(int)(case_id)]
-        mod_channel = self.mod_channels[report.reported_message.guild.id]
+        report = await self.tickets.get_report(case_id)
+        mod_channel = self.mod_channels[report.reported_message.guild_id]
 
-        decision_code_list = globals.REVIEWS_DATABASE[case_id]
+        decision_code_list = await self.tickets.get_reviews(case_id)
         for i in range(len(decision_code_list)):
             if decision_code_list[i] != decision_code_list[0]:
                 decision_code_list[0] = 0
                 break
 
+        if decision_code_list[0] != 0:
+            await self.tickets.set_state(case_id, DECIDED)
+
+        # The deletion, mod channel notice and reporter DM for a decision are independent, so they go out together
         if decision_code_list[0] > 90:
-            evaluate_report(report.report_id,False)
-            if report.reporting_user in globals.BAD_REPORT_TRACKER:
-                globals.BAD_REPORT_TRACKER[report.reporting_user] += 1
-            await mod_channel.send(f'```Code: {decision_code_list[0]}, Ticket: {case_id} - {report.reported_user}\'s post was deemed not a violation.```')
-            await report.reporting_user.send('```Your report has been processed - we have decided not to take action at this time. Feel free to DM a moderator if you have further questions.```')
+            reporters = await self.evaluate_reports(case_id, report, False)
+            for reporter in reporters:
+                if reporter.id is not None:
+                    await self.tickets.add_bad_report(reporter.id)
+            await self.outbound.dispatch(
+                self.outbound.notify(mod_channel, f'```Code: {decision_code_list[0]}, Ticket: {case_id} - {report.reported_user}\'s post was deemed not a violation.```'),
+                *(self.send_to_user(reporter, '```Your report has been processed - we have decided not to take action at this time. Feel free to DM a moderator if you have further questions.```') for reporter in reporters))
         elif 20 <= decision_code_list[0] < 30:
-            evaluate_report(report.report_id,True)
-            await report.reported_message.delete()
-            await mod_channel.send(f'```Code: {decision_code_list[0]}, Ticket: {case_id} - {report.reported_user} has been (not actually) kicked.```')
-            await report.reporting_user.send('```Your report has been processed - the offending user has been kicked and their post has been deleted.```')
+            reporters = await self.evaluate_reports(case_id, report, True)
+            await self.outbound.dispatch(
+                self.delete_message(report.reported_message),
+                *self.delete_wave(case_id, mod_channel),
+                self.outbound.notify(mod_channel, f'```Code: {decision_code_list[0]}, Ticket: {case_id} - {report.reported_user} has been (not actually) kicked.```'),
+                *(self.send_to_user(reporter, '```Your report has been processed - the offending user has been kicked and their post has been deleted.```') for reporter in reporters))
         elif 10 <= decision_code_list[0] < 20:
-            evaluate_report(report.report_id,True)
-            await report.reported_message.delete()
-            await mod_channel.send(f'```Code: {decision_code_list[0]}, Ticket: {case_id} - {report.reported_user}\'s offending post has been deleted.```')
-            await report.reporting_user.send('```Your report has been processed - the offending post has been deleted.```')
+            reporters = await self.evaluate_reports(case_id, report, True)
+            await self.outbound.dispatch(
+                self.delete_message(report.reported_message),
+                *self.delete_wave(case_id, mod_channel),
+                self.outbound.notify(mod_channel, f'```Code: {decision_code_list[0]}, Ticket: {case_id} - {report.reported_user}\'s offending post has been deleted.```'),
+                *(self.send_to_user(reporter, '```Your report has been processed - the offending post has been deleted.```') for reporter in reporters))
         elif decision_code_list[0] == 0:
-            del globals.REVIEWS_DATABASE[case_id]
-            await mod_channel.send(f'```Code: {decision_code_list[0]}, Ticket: {case_id} - Consensus not reached, the ticket has been reopened. 👇```')
+            await self.tickets.clear_reviews(case_id)
+            await self.outbound.notify(mod_channel, f'```Code: {decision_code_list[0]}, Ticket: {case_id} - Consensus not reached, the ticket has been reopened. 👇```')
             await self.handle_report(case_id)
         
         
 
+    async def evaluate_reports(self, case_id, report, validity):
+        '''
+        Records the verdict for the report that opened a ticket and for every report merged into it.
+        Returns all of their reporting users.
+        '''
+        evaluate_report(report.report_id, validity, str(report.reporting_user), str(report.reported_user))
+        reporters = [report.reporting_user]
+        for merged in await self.tickets.get_ticket_reports(case_id):
+            if reporter_key(merged) != reporter_key(report):
+                evaluate_user_report(str(merged.reporting_user), validity, 'reports_for')
+                reporters.append(merged.reporting_user)
+        return reporters
+
+    async def open_ticket(self, report, score=0.0):
+        '''
+        Files a report for review. A report of a message that already has an undecided ticket is merged
+        into it; otherwise a new ticket is queued, prioritized by its category, score and the reporter's
+        track record. Returns the ticket id.
+        '''
+        reporter_weight = None
+        if report.reporting_user.id is not None:
+            info = await self.loop.run_in_executor(None, self.user_registry.get_user_info, str(report.reporting_user))
+            if info is not None and info['reports_for'].get('total_reports'):
+                reporter_weight = report_weight(info['reports_for'])
+        weight = 0.5 if reporter_weight is None else reporter_weight
+        ticket_id, outcome = await self.tickets.file_report(report, ticket_priority(report, score, reporter_weight), weight)
+        METRICS.inc('reports_filed', outcome=outcome)
+
+        if outcome == CREATED:
+            # Only the report that opens a ticket gets a Firestore report; later reporters are indexed against it
+            report.report_id = add_report(str(report.reported_message.content), str(report.reported_user), str(report.reporting_user))
+            await self.tickets.update_report(ticket_id, report)
+            METRICS.inc('tickets_created')
+            await self.in_guild(report, 'post', ticket_id)
+        elif outcome == MERGED and report.reporting_user.id is not None:
+            report_id = (await self.tickets.get_report(ticket_id)).report_id
+            if report_id is not None:
+                add_user_report(str(report.reporting_user), report_id, 'reports_for')
+        return ticket_id
+
+    async def may_report(self, user_id):
+        '''
+        Whether to file a user's report. Users with BAD_REPORT_THRESHOLD false reports are ignored, and
+        everyone else is throttled, more tightly for each false report (see REPORT_RATE).
+        '''
+        bad_reports = await self.tickets.bad_report_count(user_id)
+        if bad_reports >= globals.BAD_REPORT_THRESHOLD:
+            return False
+        rate = globals.REPORT_RATE / 3600 / 2 ** bad_reports
+        bucket = self.report_throttles.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(rate, globals.REPORT_BURST)
+            self.report_throttles.put(user_id, bucket)
+        bucket.rate = rate
+        if not bucket.try_acquire():
+            METRICS.inc('reports_throttled')
+            return False
+        return True
+
     async def handle_report(self, id):
-        report = globals.REPORTS_DATABASE[(int)(id)]
-        mod_channel = self.mod_channels[report.reported_message.guild.id]
-        message = await mod_channel.send(f'Ticket #{id} | {globals.get_catStr(report)}')
-        await message.add_reaction('✋')
+        report = await self.tickets.get_report(id)
+        await self.tickets.set_state(id, OPEN)
+        mod_channel = self.mod_channels[report.reported_message.guild_id]
+        message = await self.outbound.send(mod_channel, f'Ticket #{id} | {globals.get_catStr(report)}')
+        await self.tickets.set_mod_message(id, message.id)
+        self.ticket_posts.put(message.id, id)
+        await self.outbound.add_reaction(message, '✋')
+
+    def delete_wave(self, case_id, mod_channel):
+        '''
+        Deletes the other copies of the spam wave a ticket was opened for, and tells the mod channel.
+        Copies posted later are deleted on sight (see handle_channel_message).
+        '''
+        members = self.spam_waves.remove(case_id)
+        if not members:
+            return []
+        return [self.outbound.delete(channel, message_id) for channel, message_id in members] + [
+            self.outbound.notify(mod_channel, f'```Ticket: {case_id} - {len(members)} other copies of the post were deleted with it.```')]
+
+    async def send_to_user(self, user_ref, text):
+        # Reports filed by the bot itself have nobody to notify
+        if user_ref.id is None:
+            return
+        user = self.get_user(user_ref.id) or await self.fetch_user(user_ref.id)
+        await self.outbound.send_dm(user, text)
 
-    async def handle_channel_message(self, message):
-        # Translate unicode
-        message.content = uni2ascii(message.content)
+    async def delete_message(self, message_ref):
+        channel = self.get_channel(message_ref.channel_id)
+        if channel is None:
+            return
+        await self.outbound.delete(channel, message_ref.message_id)
+
+    async def handle_channel_edit(self, message):
+        await self.handle_channel_message(message, edited=True)
 
+    async def handle_channel_message(self, message, edited=False):
         # Only handle messages sent in the "group-#" channel
         if not message.channel.name == f'group-{self.group_num}':
             return 
+
+        # Fold look-alike unicode to ASCII. Everything after this (the score cache, scoring dedup,
+        # edit tracking and link extraction) works on the folded text.
+        message.content = fold(message.content)
         
         # Forward the message to the mod channel
         mod_channel = self.mod_channels[message.guild.id]
 
-        scores = self.eval_text(message)
+        # A new message joins the cluster of any recent near-duplicate, and shares its verdict and ticket (see spamwave.py)
+        cluster = None if edited else self.spam_waves.add(message)
+        if cluster is not None and cluster.removed:
+            METRICS.inc('moderation_actions', action='spam_wave_delete')
+            await self.outbound.dispatch(
+                self.outbound.send_dm(message.author, '```Your message was removed as a copy of a post our moderators deleted.```'),
+                self.outbound.delete(message.channel, message.id),
+                self.outbound.notify(mod_channel, f'```Ticket: {cluster.ticket_id} - {message.author.name}\'s copy of the deleted post was removed: "{message.content}"```'))
+            return
+
+        # An edit only re-runs the stages whose input changed: scoring if the text did, the fake news check for new links
+        plan = self.edits.plan(message.id, message.content) if edited else None
+        if plan is not None and not plan:
+            return
+        if cluster is not None:
+            scores = await self.spam_waves.verdict(cluster, lambda: self.eval_text(message))
+            self.edits.record(message.id, message.content, scores)
+        elif plan is None or plan.rescore:
+            scores = await self.eval_text(message)
+            self.edits.record(message.id, message.content, scores, None if plan is None else plan.new_links)
+        else:
+            scores = {}
+            self.edits.record(message.id, message.content, None, plan.new_links)
 
         # Determine moderation actions based on scores
         should_delete = False
@@ -265,66 +693,123 @@ class ModBot(discord.Client):
         
         # Handle moderation actions
         if should_delete:
-            await message.author.send('```Your message was flagged by our automatic moderation system and has been deleted.```')
-            await mod_channel.send(f'```{message.author.name}\'s post auto-deleted: "{message.content}"```')
-            await message.delete()
+            METRICS.inc('moderation_actions', action='auto_delete')
+            # During a raid these are merged into digests and bulk deletes by the outbound scheduler,
+            # and the mod channel only hears about the first copy of a spam wave
+            actions = [
+                self.outbound.send_dm(message.author, '```Your message was flagged by our automatic moderation system and has been deleted.```'),
+                self.outbound.delete(message.channel, message.id)]
+            if cluster is None or self.spam_waves.claim_action(cluster):
+                actions.append(self.outbound.notify(mod_channel, f'```{message.author.name}\'s post auto-deleted: "{message.content}"```'))
+            await self.outbound.dispatch(*actions)
         elif should_report:
-            await message.author.send('```Your message was flagged by our automatic moderation system and is under review.```')
+            METRICS.inc('moderation_actions', action='auto_report')
+            # A spam wave gets one ticket, opened for its first copy
+            if cluster is not None and not self.spam_waves.claim_action(cluster):
+                await self.outbound.send_dm(message.author, '```Your message was flagged by our automatic moderation system and is under review.```')
+                return
+
             # Auto detection falls under offensive/harmful/abusive content
-            report = ReportDatabaseEntry('ModBot', message.author, message, '1', '5', reported_description)
+            report = ReportDatabaseEntry(MODBOT, UserRef.from_user(message.author), MessageRef.from_message(message), '1', '5', reported_description)
 
-            report_id = add_report(str(report.reported_message.content), str(report.reported_user), str(report.reporting_user))
-            report.report_id = report_id
+            # Create report ticket
+            _, ticket_id = await self.outbound.dispatch(
+                self.outbound.send_dm(message.author, '```Your message was flagged by our automatic moderation system and is under review.```'),
+                self.open_ticket(report, max(scores.values())))
+            if cluster is not None and not isinstance(ticket_id, Exception):
+                self.spam_waves.set_ticket(cluster, ticket_id, message.id)
+        elif cluster is not None:
+            # Links another copy of the wave already had checked aren't checked again
+            links = self.spam_waves.unchecked_links(cluster, split_links(message.content)[1])
+            if links:
+                self.start_fake_news_check(message, links, cluster)
+        elif plan is None or plan.new_links:
+            # Check for fake news in the background; the verdict is applied when the job finishes
+            self.start_fake_news_check(message, None if plan is None else plan.new_links)
+
+    def start_fake_news_check(self, message, links=None, cluster=None):
+        '''
+        Checks every link in the message, or only `links` if given. A full check supersedes any still
+        running for the message's old content; a check of new links runs alongside them. Messages
+        of a spam wave pass its cluster, so the wave gets one ticket.
+        '''
+        jobs = self.fake_news_jobs.setdefault(message.id, set())
+        if links is None:
+            for job in jobs:
+                job.cancel()
+            jobs.clear()
+
+        job = asyncio.ensure_future(self.handle_fake_news(message, message.content if links is None else ' '.join(sorted(links)), cluster, links))
+        jobs.add(job)
+
+        def done(finished):
+            jobs.discard(finished)
+            if not jobs and self.fake_news_jobs.get(message.id) is jobs:
+                del self.fake_news_jobs[message.id]
+        job.add_done_callback(done)
+
+    async def handle_fake_news(self, message, text, cluster=None, links=None):
+        checked = ()
+        try:
+            # Check if the post contains links to fake news
+            result = await self.fake_news.check(text)
+            checked = [verdict.url for verdict in result.links if verdict.error is None]
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f'Fake news check failed for message {message.id}')
+            return
+        finally:
+            # Links of a spam wave only count as checked once they have a verdict
+            if cluster is not None:
+                self.spam_waves.links_checked(cluster, links, checked)
+
+        if result.is_fake:
+            METRICS.inc('moderation_actions', action='fake_news_report')
+            if cluster is not None and not self.spam_waves.claim_action(cluster):
+                return
+
+            # Auto detection falls under fake news
+            report = ReportDatabaseEntry(MODBOT, UserRef.from_user(message.author), MessageRef.from_message(message), '1', '6', result.describe())
 
             # Create report ticket
-            globals.TICKET_NUM += 1
-            globals.REPORTS_DATABASE[globals.TICKET_NUM] = report
-            await self.handle_report(globals.TICKET_NUM)
-        else:
-            # Check if the post contains a link to fake news
-            isFake = isFakeNews(message.content)
-            if isFake:
-                # Auto detection falls under fake news
-                report = ReportDatabaseEntry('ModBot', message.author, message, '1', '6', reported_description)
-                
-                report_id = add_report(str(report.reported_message.content), str(report.reported_user), str(report.reporting_user))
-                report.report_id = report_id
-
-                # Create report ticket
-                globals.TICKET_NUM += 1
-                globals.REPORTS_DATABASE[globals.TICKET_NUM] = report
-                await self.handle_report(globals.TICKET_NUM)
-
-
-    def eval_text(self, message):
-        '''
-        Given a message, forwards the message to Perspective and returns a dictionary of scores.
-        '''
-        PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
-
-        url = PERSPECTIVE_URL + '?key=' + self.perspective_key
-        data_dict = {
-            'comment': {'text': message.content},
-            'languages': ['en'],
-            'requestedAttributes': {
-                                    'SEVERE_TOXICITY': {}, 'PROFANITY': {},
-                                    'IDENTITY_ATTACK': {}, 'THREAT': {},
-                                    'TOXICITY': {}, 'FLIRTATION': {}
-                                },
-            'doNotStore': True
-        }
-        response = requests.post(url, data=json.dumps(data_dict))
-        response_dict = response.json()
-
-        scores = {}
-        for attr in response_dict["attributeScores"]:
-            scores[attr] = response_dict["attributeScores"][attr]["summaryScore"]["value"]
-
-        return scores
+            ticket_id = await self.open_ticket(report, result.max_probability())
+            if cluster is not None:
+                self.spam_waves.set_ticket(cluster, ticket_id, message.id)
+
+
+    async def eval_text(self, message):
+        '''
+        Given a message, queues the message for Perspective and returns a dictionary of scores.
+        Repeated content is answered from the score cache without a network call, and messages
+        the local pre-filter considers clearly benign get no scores at all.
+        '''
+        with METRICS.timer('eval_text_seconds'):
+            key = content_hash(message.content)
+            scores = self.score_cache.get(key)
+            if scores is None:
+                if not await self.prefilter.escalate(message.content):
+                    return {}
+                scores = await self.scoring_queue.score(message.content)
+                self.score_cache.put(key, scores)
+            return scores
     
     def code_format(self, text):
         return "```" + text + "```"
             
         
-client = ModBot(perspective_key)
-client.run(discord_token)
\ No newline at end of file
+def main(shard_ids=None, shard_count=None, model_executor=None):
+    # Shard processes each write their own log, and each journals its own pending Firestore writes:
+    # a writer replays and truncates its whole journal, so it can't share one with other processes
+    log_listener = setup_logging(logger, shard_path(globals.LOG_PATH, shard_ids), globals.LOG_LEVEL, globals.LOG_RATE, globals.LOG_BURST)
+    set_journal(shard_path(FIRESTORE_JOURNAL, shard_ids))
+    discord_token, perspective_key = load_tokens()
+    client = ModBot(perspective_key, shard_ids, shard_count, model_executor)
+    try:
+        client.run(discord_token)
+    finally:
+        log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+import globals
+
+
+class LRUCache:
+    '''
+    Bounded mapping that evicts the least recently used entry once it holds `maxsize` entries.
+    Entries older than `ttl` seconds (if given) are treated as missing.
+    '''
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict() # Key: cache key Value: (expiry time, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.time():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value, expires_at=None):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        self.data[key] = (expires_at, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self.data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key):
+        entry = self.data.get(key)
+        return entry is not None and (entry[0] is None or entry[0] > time.time())
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ScoreCache(LRUCache):
+    '''
+    LRU/TTL cache of Perspective scores keyed on content hash. If `path` is given, entries are also
+    written to a SQLite file so the cache survives restarts; lookups that miss in memory fall back to it.
+    New entries are written in batches (see flush), so a put rarely touches the disk.
+    '''
+    def __init__(self, maxsize, ttl=None, path=None, flush_size=globals.SCORE_CACHE_FLUSH_SIZE,
+                 flush_interval=globals.SCORE_CACHE_FLUSH_INTERVAL):
+        super().__init__(maxsize, ttl)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.pending = {} # Key: cache key Value: (serialized scores, expiry time) not yet written to disk
+        self.last_flush = time.monotonic()
+        self.flushes = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, scores TEXT NOT NULL, expires_at REAL)')
+            self.db.execute('DELETE FROM scores WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+            self.db.commit()
+
+    def get(self, key, default=None):
+        value = super().get(key)
+        if value is not None or self.db is None:
+            return default if value is None else value
+
+        # Evicted from memory before it was written
+        row = self.pending.get(key) or self.db.execute('SELECT scores, expires_at FROM scores WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+
+        # Found on disk: count it as a hit and promote it back into memory
+        self.misses -= 1
+        self.hits += 1
+        value = json.loads(row[0])
+        super().put(key, value, expires_at=row[1])
+        return value
+
+    def put(self, key, value, expires_at=None):
+        super().put(key, value, expires_at)
+        if self.db is not None:
+            self.pending[key] = (json.dumps(value), self.data[key][0])
+            if len(self.pending) >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        '''
+        Writes the entries cached since the last flush in one transaction.
+        '''
+        self.last_flush = time.monotonic()
+        if self.db is None or not self.pending:
+            return
+        self.db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?)',
+                            [(key, scores, expires_at) for key, (scores, expires_at) in self.pending.items()])
+        self.db.commit()
+        self.pending = {}
+        self.flushes += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats['pending_writes'] = len(self.pending)
+        stats['flushes'] = self.flushes
+        return stats
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
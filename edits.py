@@ -0,0 +1,151 @@
+'''
+Edit handling for channel messages.
+
+Every edit used to run the full pipeline again (Perspective, article download and the fake news model),
+so rapid edits to one message multiplied our outbound calls. Edits are now debounced per message: a
+burst of edits is handled once, for the latest content, after EDIT_DEBOUNCE seconds of quiet (and no
+later than EDIT_DEBOUNCE_MAX seconds after the first edit of the burst). Each message's last checked
+state is kept, so an edit only re-runs the stages whose input changed: Perspective if the text
+outside links changed, and the fake news check for links that weren't there before.
+'''
+import asyncio
+import time
+
+import globals
+from cache import LRUCache
+from fakenews import LINK_PATTERN
+from normalize import content_hash
+from reputation import canonicalize_url
+
+
+def split_links(content):
+    '''
+    Returns the hash of the text with links removed and the set of canonical links in it.
+    '''
+    links = set()
+    for link in LINK_PATTERN.findall(content):
+        try:
+            links.add(canonicalize_url(link))
+        except ValueError:
+            # Bad port or host: kept as posted, and the fake news check reports it as failed
+            links.add(link)
+    return content_hash(LINK_PATTERN.sub(' ', content)), links
+
+
+class EditPlan:
+    '''
+    What an edit needs re-checked: whether to score the text again, and which links are new.
+    '''
+    def __init__(self, rescore, new_links):
+        self.rescore = rescore
+        self.new_links = new_links
+
+    def __bool__(self):
+        return self.rescore or bool(self.new_links)
+
+
+class MessageHistory:
+    '''
+    Per-message record of each check: when it ran, the content hash, the scores and the links checked.
+    '''
+    def __init__(self, max_length):
+        self.text_hash = None
+        self.links = set()
+        self.scores = {}
+        self.checks = []
+        self.max_length = max_length
+
+    def record(self, content, scores, checked_links=None):
+        self.text_hash, self.links = split_links(content)
+        if checked_links is None:
+            checked_links = self.links
+        if scores is not None:
+            self.scores = scores
+        self.checks.append({'time': time.time(), 'content_hash': content_hash(content),
+                            'scores': scores, 'links': sorted(checked_links)})
+        del self.checks[:-self.max_length]
+
+
+class EditTracker:
+    def __init__(self, debounce=globals.EDIT_DEBOUNCE, max_delay=globals.EDIT_DEBOUNCE_MAX,
+                 history_size=globals.EDIT_HISTORY_SIZE, history_length=globals.EDIT_HISTORY_LENGTH):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.history = LRUCache(history_size) # Key: message id Value: MessageHistory
+        self.history_length = history_length
+        self.pending = {} # Key: message id Value: [latest message, timer handle, time of the first edit in the burst]
+
+        # Metrics
+        self.edits = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.rescored = 0
+        self.links_only = 0
+
+    def submit(self, message, handler):
+        '''
+        Schedules handler(message) once this message's burst of edits is over. A later edit of
+        the same message replaces this one.
+        '''
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        self.edits += 1
+
+        pending = self.pending.get(message.id)
+        if pending is None:
+            pending = self.pending[message.id] = [message, None, now]
+        else:
+            self.coalesced += 1
+            pending[0] = message
+            pending[1].cancel()
+
+        delay = min(self.debounce, pending[2] + self.max_delay - now)
+        pending[1] = loop.call_later(max(delay, 0), self._fire, message.id, handler)
+
+    def _fire(self, message_id, handler):
+        message, _, _ = self.pending.pop(message_id)
+        asyncio.ensure_future(handler(message))
+
+    def record(self, message_id, content, scores, checked_links=None):
+        '''
+        Records a check of message_id's content. scores is None if Perspective wasn't asked again,
+        and checked_links None if every link in the content was checked.
+        '''
+        history = self.history.get(message_id)
+        if history is None:
+            history = MessageHistory(self.history_length)
+            self.history.put(message_id, history)
+        history.record(content, scores, checked_links)
+
+    def plan(self, message_id, content):
+        '''
+        Works out which stages an edit to `content` needs. Messages we have no record of get everything.
+        '''
+        text_hash, links = split_links(content)
+        history = self.history.get(message_id)
+        if history is None:
+            return EditPlan(True, links)
+
+        plan = EditPlan(text_hash != history.text_hash, links - history.links)
+        if not plan:
+            self.unchanged += 1
+        elif plan.rescore:
+            self.rescored += 1
+        else:
+            self.links_only += 1
+        return plan
+
+    def get_history(self, message_id):
+        history = self.history.get(message_id)
+        return [] if history is None else list(history.checks)
+
+    def stats(self):
+        return {
+            'edits': self.edits,
+            'pending': len(self.pending),
+            'coalesced': self.coalesced,
+            'unchanged': self.unchanged,
+            'rescored': self.rescored,
+            'links_only': self.links_only,
+            'history': self.history.stats(),
+        }
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+import globals
+from cache import LRUCache
+from metrics import METRICS
+from model.abridged import extract_article_text, predict_fake_news_batch
+from model.extract import decode, is_html
+from reputation import DomainReputation, canonicalize_url, domain_of
+
+logger = logging.getLogger('discord')
+
+LINK_PATTERN = re.compile(r'(https?://\S+)')
+
+
+class NotAnArticle(Exception):
+    pass
+
+
+class LinkVerdict:
+    '''
+    Outcome of checking one link: the probability it is fake news, where that came from
+    ('cache', 'domain' or 'model'), how long it took, and the error if it couldn't be checked.
+    '''
+    def __init__(self, url, probability=None, source=None, elapsed=0.0, error=None):
+        self.url = url
+        self.probability = probability
+        self.source = source
+        self.elapsed = elapsed
+        self.error = error
+
+    def is_fake(self):
+        return self.probability is not None and self.probability >= globals.FAKE_NEWS_LINK_THRESHOLD
+
+
+class FakeNewsResult:
+    '''
+    Aggregated fake news verdict for every link in a post. `policy` is one of
+    'any' (any link reaches FAKE_NEWS_LINK_THRESHOLD), 'majority' (more than half of the checked links are fake) or
+    'max_probability' (the most suspicious link reaches FAKE_NEWS_PROBABILITY_THRESHOLD).
+    '''
+    def __init__(self, links, policy, elapsed):
+        self.links = links
+        self.policy = policy
+        self.elapsed = elapsed
+
+        checked = [link for link in self.links if link.probability is not None]
+        if not checked:
+            self.is_fake = False
+        elif policy == 'any':
+            self.is_fake = any(link.is_fake() for link in checked)
+        elif policy == 'majority':
+            self.is_fake = sum(link.is_fake() for link in checked) * 2 > len(checked)
+        elif policy == 'max_probability':
+            self.is_fake = self.max_probability() >= globals.FAKE_NEWS_PROBABILITY_THRESHOLD
+        else:
+            raise ValueError(f'Unknown fake news aggregation policy: {policy}')
+
+    def __bool__(self):
+        return self.is_fake
+
+    def max_probability(self):
+        return max((link.probability for link in self.links if link.probability is not None), default=0.0)
+
+    def describe(self):
+        description = ''
+        for link in self.links:
+            if link.probability is not None:
+                description += f'\n{link.url} fake news probability: {link.probability:.2f} ({link.source})'
+        return description
+
+
+class ArticleBatcher:
+    '''
+    Collects article texts from concurrent fake news checks and classifies them together, flushing
+    once `batch_size` texts are waiting or the oldest has waited `deadline` seconds. Each batch is
+    vectorized and predicted in one call in the worker pool.
+    '''
+    def __init__(self, executor, batch_size=globals.FAKE_NEWS_BATCH_SIZE, deadline=globals.FAKE_NEWS_BATCH_DEADLINE):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.deadline = deadline
+        self.pending = [] # List of (text, future) waiting for the next flush
+        self.timer = None
+
+        # Metrics
+        self.batches = 0
+        self.texts_classified = 0
+
+    async def predict(self, text):
+        '''
+        Queues an article text and waits for its fake news probability.
+        '''
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.deadline, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        asyncio.ensure_future(self._predict_batch(batch))
+
+    async def _predict_batch(self, batch):
+        loop = asyncio.get_event_loop()
+        try:
+            probabilities = await loop.run_in_executor(self.executor, predict_fake_news_batch, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.texts_classified += len(batch)
+        for (_, future), probability in zip(batch, probabilities):
+            if not future.done():
+                future.set_result(float(probability))
+
+    def stats(self):
+        return {
+            'queue_depth': len(self.pending),
+            'batches': self.batches,
+            'avg_batch_size': self.texts_classified / self.batches if self.batches else 0.0,
+        }
+
+
+class FakeNewsChecker:
+    '''
+    Async fake news check. Articles are downloaded with an async HTTP client under a strict timeout
+    and body size cap, then parsed and classified in a bounded pool of worker processes so neither
+    slow sites nor the model ever block the event loop. Verdicts are cached per canonical URL, and
+    domains with a consistent track record are decided without downloading anything.
+    '''
+    def __init__(self, max_workers=globals.FAKE_NEWS_WORKERS, timeout=globals.FAKE_NEWS_FETCH_TIMEOUT,
+                 max_bytes=globals.FAKE_NEWS_MAX_BYTES, executor=None, reputation_path=None):
+        # Sharded deployments pass in the executor for the shared model pool (see workerpool.py)
+        self.executor = executor if executor is not None else ProcessPoolExecutor(max_workers=max_workers)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_bytes = max_bytes
+        self.session = None
+        self.batcher = ArticleBatcher(self.executor)
+
+        self.verdicts = LRUCache(globals.URL_VERDICT_CACHE_SIZE, globals.URL_VERDICT_CACHE_TTL)
+        # Canonical URLs that redirected, mapped to the canonical URL they ended up at
+        self.redirects = LRUCache(globals.URL_VERDICT_CACHE_SIZE, globals.URL_VERDICT_CACHE_TTL)
+        self.reputation = DomainReputation(globals.DOMAIN_REPUTATION_MIN_SAMPLES, globals.DOMAIN_REPUTATION_RATIO)
+        self.reputation_path = reputation_path if reputation_path is not None else globals.DOMAIN_REPUTATION_PATH
+        if self.reputation_path != globals.DOMAIN_REPUTATION_PATH:
+            # Shard processes all start from the shared pre-warm file, and each saves what it learns to its own
+            self.reputation.load(globals.DOMAIN_REPUTATION_PATH, learned=False)
+        self.reputation.load(self.reputation_path)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.executor.shutdown(wait=False)
+        self.reputation.save(self.reputation_path)
+
+    async def fetch(self, link):
+        '''
+        Downloads up to max_bytes of a page and returns its html and final URL after redirects. The
+        rest of a larger page is never read; articles are classified on their first max_bytes.
+        Responses that aren't HTML (images, PDFs, downloads) raise NotAnArticle before their body is read.
+        '''
+        async with self._get_session().get(link) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type')
+            if not is_html(content_type):
+                raise NotAnArticle(f'{link} is {content_type}')
+
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                body.extend(chunk)
+                if len(body) >= self.max_bytes:
+                    break
+            return decode(body[:self.max_bytes], content_type), str(response.url)
+
+    async def classify(self, link):
+        '''
+        Returns the probability that the article behind link is fake news, and where that came from.
+        '''
+        key = canonicalize_url(link)
+        key = self.redirects.get(key, key)
+
+        probability = self.verdicts.get(key)
+        if probability is not None:
+            return probability, 'cache'
+        is_fake = self.reputation.verdict(domain_of(key))
+        if is_fake is not None:
+            return float(is_fake), 'domain'
+
+        with METRICS.timer('fake_news_seconds', stage='download'):
+            html, final_url = await self.fetch(link)
+        loop = asyncio.get_event_loop()
+        with METRICS.timer('fake_news_seconds', stage='parse'):
+            text = await loop.run_in_executor(self.executor, extract_article_text, final_url, html)
+        with METRICS.timer('fake_news_seconds', stage='predict'):
+            probability = await self.batcher.predict(text)
+
+        # Remember where the link redirected so later posts of it skip straight to the cached verdict
+        final_key = canonicalize_url(final_url)
+        if final_key != key:
+            self.redirects.put(key, final_key)
+            self.verdicts.put(final_key, probability)
+        self.verdicts.put(key, probability)
+        self.reputation.record(domain_of(final_key), probability >= globals.FAKE_NEWS_LINK_THRESHOLD)
+        return probability, 'model'
+
+    async def check_link(self, link):
+        start = time.monotonic()
+        try:
+            probability, source = await self.classify(link)
+            return LinkVerdict(link, probability, source, time.monotonic() - start)
+        except (aiohttp.ClientError, asyncio.TimeoutError, NotAnArticle) as e:
+            logger.info(f'Could not fetch {link} for fake news check: {e!r}')
+            return LinkVerdict(link, elapsed=time.monotonic() - start, error=repr(e))
+        except Exception as e:
+            # A malformed link or a failed job only loses this link's verdict, not the post's
+            logger.exception(f'Fake news check of {link} failed')
+            return LinkVerdict(link, elapsed=time.monotonic() - start, error=repr(e))
+
+    async def check(self, post_text, policy=globals.FAKE_NEWS_POLICY, deadline=globals.FAKE_NEWS_DEADLINE):
+        '''
+        Checks every link in a post concurrently. Links still running when the deadline passes are
+        cancelled and left out of the verdict.
+        '''
+        start = time.monotonic()
+
+        # The same article linked twice only needs checking once. Links that can't be canonicalized
+        # (bad ports or hosts) are still checked, and fail in their own task
+        links = {}
+        for link in LINK_PATTERN.findall(post_text):
+            try:
+                key = canonicalize_url(link)
+            except ValueError:
+                key = link
+            links.setdefault(key, link)
+        links = list(links.values())[:globals.FAKE_NEWS_MAX_LINKS]
+
+        tasks = [asyncio.ensure_future(self.check_link(link)) for link in links]
+        verdicts = []
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+            for link, task in zip(links, tasks):
+                if task in pending:
+                    task.cancel()
+                    verdicts.append(LinkVerdict(link, elapsed=time.monotonic() - start, error='deadline exceeded'))
+                else:
+                    verdicts.append(task.result())
+
+        METRICS.observe('fake_news_seconds', time.monotonic() - start, stage='check')
+        return FakeNewsResult(verdicts, policy, time.monotonic() - start)
+
+    def stats(self):
+        return {
+            'url_cache': self.verdicts.stats(),
+            'domain_reputation': self.reputation.stats(),
+            'batcher': self.batcher.stats(),
+        }
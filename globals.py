@@ -1,17 +1,160 @@
 AUTO_REPORT_THRESHOLD = 0.80
 AUTO_DELETE_THRESHOLD = 0.97
-TICKET_NUM = 0
-# Key: case_id Value: Report
-REPORTS_DATABASE = {}
-# Key: case_id Value: List of decision codes
-REVIEWS_DATABASE = {}
-# Key: user_id Value: case_id
-CURRENT_REVIEWERS_DB = {}
-# Number of reviewers
+# Logs are written from a background thread; below WARNING at most LOG_RATE records per second (bursts of LOG_BURST) are kept
+LOG_PATH = 'discord.log'
+LOG_LEVEL = 'INFO'
+LOG_RATE = 50
+LOG_BURST = 200
+# Metrics are served at http://METRICS_HOST:METRICS_PORT/metrics (plus the first shard id, for sharded processes).
+# Set METRICS_PORT to None to turn the endpoint off
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9152
+METRICS_LOOP_LAG_INTERVAL = 0.5
+# Tickets, reviews, reviewer assignments and false report counts live in the ticket store (see tickets.py).
+# Set TICKET_STORE_PATH to None to keep them in memory only.
+TICKET_STORE_PATH = 'tickets.sqlite3'
+# Number of reviewers, until it is changed from a DM (which stores it in the ticket store for every bot process)
 NUM_REVIEWERS = 1
-# Track number of false reports
-BAD_REPORT_TRACKER = {}
+# Users with this many false reports can no longer open tickets
 BAD_REPORT_THRESHOLD = 1
+# Below that, each user may file REPORT_BURST reports at once and REPORT_RATE more per hour, halved for every false
+# report. Throttles are kept for the REPORT_THROTTLE_USERS most recent reporters
+REPORT_RATE = 10
+REPORT_BURST = 5
+REPORT_THROTTLE_USERS = 10000
+# Review queue: a ticket's priority is REVIEW_SEVERITY_WEIGHT * its category severity (see CATEGORY_SEVERITY)
+# + REVIEW_SCORE_WEIGHT * its highest Perspective or fake news score + REVIEW_REPORTER_WEIGHT * the reporter's
+# report_weight, and grows by REVIEW_AGE_WEIGHT for every hour it waits. Further reports of the same message add
+# REVIEW_CORROBORATION_WEIGHT * their reporter's report_weight to the strongest report's priority
+REVIEW_SEVERITY_WEIGHT = 1.0
+REVIEW_SCORE_WEIGHT = 1.0
+REVIEW_REPORTER_WEIGHT = 0.5
+REVIEW_AGE_WEIGHT = 0.25
+REVIEW_CORROBORATION_WEIGHT = 0.5
+# Seconds a reviewer's claim on a ticket lasts without activity before the ticket is re-queued,
+# and how often expired claims are swept
+REVIEW_LEASE = 15 * 60
+REVIEW_LEASE_SWEEP_INTERVAL = 60
+# How often each bot process picks up the guild jobs (see tickets.py) other processes left for its guilds
+GUILD_JOB_INTERVAL = 0.5
+# Bulk review (!bulk [N] in the mod channel): tickets on a page by default and at most, how many of
+# the most urgent tickets are grouped to fill it, and how many characters of each message it shows
+BULK_REVIEW_PAGE = 10
+BULK_REVIEW_MAX_PAGE = 25
+BULK_REVIEW_POOL = 100
+BULK_REVIEW_SNIPPET = 80
+
+# Perspective API client settings
+PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
+# Max number of Perspective requests in flight at once
+PERSPECTIVE_MAX_CONCURRENCY = 8
+# Seconds before a single Perspective request is abandoned
+PERSPECTIVE_TIMEOUT = 5
+# Retries on 429/5xx responses, with exponential backoff starting at PERSPECTIVE_BACKOFF seconds. No retry waits
+# longer than PERSPECTIVE_MAX_BACKOFF seconds, even if the server's Retry-After asks for more
+PERSPECTIVE_MAX_RETRIES = 3
+PERSPECTIVE_BACKOFF = 0.5
+PERSPECTIVE_MAX_BACKOFF = 30
+# Perspective quota in queries per second, and how many queries may burst above it
+PERSPECTIVE_QPS = 1
+PERSPECTIVE_BURST = 1
+
+# Channel messages are scored in batches of up to SCORING_BATCH_SIZE, or every SCORING_BATCH_DEADLINE seconds
+SCORING_BATCH_SIZE = 32
+SCORING_BATCH_DEADLINE = 0.05
+
+# Local pre-filter: only messages with local risk >= AUTO_REPORT_THRESHOLD - PREFILTER_MARGIN are sent to Perspective.
+# Messages of PREFILTER_ALWAYS_ESCALATE_LENGTH characters or more are always sent.
+PREFILTER_MARGIN = 0.6
+PREFILTER_ALWAYS_ESCALATE_LENGTH = 200
+
+# Folded message texts and content hashes are memoized, NORMALIZE_CACHE_SIZE of each at most
+NORMALIZE_CACHE_SIZE = 10000
+
+# Scores are cached by normalized content for SCORE_CACHE_TTL seconds, SCORE_CACHE_SIZE entries at most.
+# Set SCORE_CACHE_PATH to None to keep the cache in memory only. New scores are written to it in one transaction
+# once SCORE_CACHE_FLUSH_SIZE have been cached or SCORE_CACHE_FLUSH_INTERVAL seconds have passed, and on shutdown
+SCORE_CACHE_SIZE = 50000
+SCORE_CACHE_TTL = 24 * 60 * 60
+SCORE_CACHE_PATH = 'score_cache.sqlite3'
+SCORE_CACHE_FLUSH_SIZE = 100
+SCORE_CACHE_FLUSH_INTERVAL = 5.0
+
+# Outbound Discord calls: mod channel notices within OUTBOUND_DIGEST_WINDOW seconds are sent as one digest,
+# and deletions in a channel within OUTBOUND_DELETE_WINDOW seconds as one bulk delete.
+# OUTBOUND_ROUTE_LIMITS gives (calls per second, burst) for each route, per channel or user, matching Discord's buckets
+OUTBOUND_DIGEST_WINDOW = 1.0
+OUTBOUND_DELETE_WINDOW = 0.5
+OUTBOUND_ROUTE_LIMITS = {
+    'send': (1.0, 5),
+    'dm': (1.0, 5),
+    'delete': (5.0, 5),
+    'bulk_delete': (1.0, 1),
+    'reaction': (4.0, 1),
+}
+
+# Recently seen Discord messages and ticket posts, so edits, reports and claims don't need to fetch them again
+MESSAGE_CACHE_SIZE = 10000
+MESSAGE_CACHE_TTL = 24 * 60 * 60
+
+# Edits to a channel message are handled once they stop for EDIT_DEBOUNCE seconds, or EDIT_DEBOUNCE_MAX seconds
+# after the first edit of a burst. The last EDIT_HISTORY_LENGTH checks are kept for EDIT_HISTORY_SIZE messages
+EDIT_DEBOUNCE = 2.0
+EDIT_DEBOUNCE_MAX = 10.0
+EDIT_HISTORY_SIZE = 10000
+EDIT_HISTORY_LENGTH = 10
+
+# Spam waves: channel messages of SPAMWAVE_MIN_LENGTH characters or more with an estimated similarity of at least
+# SPAMWAVE_SIMILARITY to a message seen in the last SPAMWAVE_WINDOW seconds share its verdict and ticket. Signatures
+# are SPAMWAVE_BANDS bands of SPAMWAVE_ROWS slots, and a cluster is matched against its first SPAMWAVE_REPRESENTATIVES
+# messages. At most SPAMWAVE_MAX_CLUSTERS clusters of SPAMWAVE_MAX_MEMBERS messages are kept (about 2 KB each), and
+# SPAMWAVE_TICKET_CLUSTERS clusters with tickets until they are decided
+SPAMWAVE_WINDOW = 5 * 60
+SPAMWAVE_SIMILARITY = 0.5
+SPAMWAVE_BANDS = 10
+SPAMWAVE_ROWS = 3
+SPAMWAVE_REPRESENTATIVES = 8
+SPAMWAVE_MIN_LENGTH = 20
+SPAMWAVE_MAX_CLUSTERS = 20000
+SPAMWAVE_MAX_MEMBERS = 500
+SPAMWAVE_TICKET_CLUSTERS = 1000
+
+# Cached Firestore user documents
+USER_INFO_CACHE_SIZE = 10000
+USER_INFO_CACHE_TTL = 10 * 60
+# On shutdown, wait up to FIRESTORE_SHUTDOWN_TIMEOUT seconds for queued report and user stat writes to reach Firestore
+FIRESTORE_SHUTDOWN_TIMEOUT = 30
+
+# Fake news check: article download timeout in seconds, bytes of a page read at most (the rest is never downloaded),
+# and worker processes for the model
+FAKE_NEWS_FETCH_TIMEOUT = 5
+FAKE_NEWS_MAX_BYTES = 1024 * 1024
+FAKE_NEWS_WORKERS = 2
+# Words of article text taken from a page (see model/extract.py); parsing stops once it has this many
+FAKE_NEWS_MAX_WORDS = 2000
+# Worker processes in the model pool shared by all shard processes (see shards.py)
+MODEL_POOL_WORKERS = 4
+# Every link in a post (up to FAKE_NEWS_MAX_LINKS) is checked concurrently within FAKE_NEWS_DEADLINE seconds.
+# FAKE_NEWS_POLICY is 'any', 'majority' or 'max_probability' (compared against FAKE_NEWS_PROBABILITY_THRESHOLD).
+# A single link counts as fake news (for 'any', 'majority' and domain reputation) at FAKE_NEWS_LINK_THRESHOLD
+FAKE_NEWS_MAX_LINKS = 10
+FAKE_NEWS_DEADLINE = 10
+FAKE_NEWS_POLICY = 'any'
+FAKE_NEWS_PROBABILITY_THRESHOLD = 0.7
+FAKE_NEWS_LINK_THRESHOLD = 0.5
+# Extracted article texts are classified in batches of up to FAKE_NEWS_BATCH_SIZE, or every FAKE_NEWS_BATCH_DEADLINE seconds
+FAKE_NEWS_BATCH_SIZE = 16
+FAKE_NEWS_BATCH_DEADLINE = 0.05
+
+# Verdicts are cached per canonical article URL
+URL_VERDICT_CACHE_SIZE = 10000
+URL_VERDICT_CACHE_TTL = 6 * 60 * 60
+# A domain is decided without downloading once it has DOMAIN_REPUTATION_MIN_SAMPLES verdicts
+# and at least DOMAIN_REPUTATION_RATIO of them agree. The index is loaded from and saved to DOMAIN_REPUTATION_PATH;
+# shard processes also load it, but save to their own domain_reputation-<shard>.csv (see bot.shard_path)
+DOMAIN_REPUTATION_MIN_SAMPLES = 5
+DOMAIN_REPUTATION_RATIO = 0.9
+DOMAIN_REPUTATION_PATH = 'domain_reputation.csv'
 
 """ 
 Decision Codes:
@@ -28,6 +171,14 @@ CATEGORY_CODES = {
     "2": {"1" : "Nudity or Exploitation", "2" : "Violence, Terrorism, or Incitement", "3" : "Suicide or Self-Injury", "4" : "Unauthorized or Illegal Sales", "5" : "Hate Speech, Harassment, or Bullying"}
 }
 
+# Key: cat_code Value: Dict (Key: subcat_code Value: severity in [0, 1]) or the severity of the whole category
+CATEGORY_SEVERITY = {
+    "1": {"1" : 0.6, "2" : 0.4, "3" : 0.2, "4" : 0.5, "5" : 0.7, "6" : 0.4},
+    "2": {"1" : 1.0, "2" : 1.0, "3" : 1.0, "4" : 0.6, "5" : 0.8},
+    "3": 0.5
+}
+DEFAULT_SEVERITY = 0.5
+
 def get_catStr(report):
     if report.reported_category == "3":
         return report.reported_subcategory
@@ -0,0 +1,51 @@
+'''
+Logging setup. Records are handed to a background thread through a queue, so the event loop never
+waits on file I/O, and records below WARNING are rate limited so a flood of events can't turn into
+a flood of log lines. Dropped records are counted in the metrics.
+'''
+import logging
+import logging.handlers
+import queue
+import threading
+
+from metrics import METRICS
+from ratelimit import TokenBucket
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Passes at most `rate` records per second (with bursts of `burst`) below WARNING; WARNING and
+    above always pass.
+    '''
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            allowed = self.bucket.try_acquire()
+        if not allowed:
+            METRICS.inc('log_records_dropped', level=record.levelname)
+        return allowed
+
+
+def setup_logging(logger, path, level, rate, burst):
+    '''
+    Sends logger's records to a file at path through a queue. Returns the listener, which must be
+    stopped on shutdown to write out what is still queued.
+    '''
+    file_handler = logging.FileHandler(filename=path, encoding='utf-8', mode='w')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+
+    records = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(rate, burst))
+
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,179 @@
+'''
+In-process instrumentation, exposed in the Prometheus text format on a local HTTP endpoint.
+
+Code records into the shared METRICS registry: timers (histograms of seconds) around the expensive
+stages, counters for moderation outcomes, and collectors that read each component's stats() when
+the endpoint is scraped, so queue depths and cache hit rates need no bookkeeping on the hot path.
+All names are prefixed with 'modbot_'. Recording is thread-safe, since the Firestore writer and the
+user registry record from their own threads.
+
+    curl http://127.0.0.1:9152/metrics
+'''
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('discord')
+
+# Upper bounds in seconds of the histogram buckets every timer uses
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels)) + '}'
+
+
+def _flatten(prefix, stats):
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {} # Key: (name, labels) Value: count
+        self.histograms = {} # Key: (name, labels) Value: Histogram
+        self.collectors = {} # Key: component name Value: function returning a stats() dict
+        self.server = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''
+        Times the block (including time spent awaiting inside it) into the histogram `name`.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        '''
+        Decorator form of timer() for plain and async functions.
+        '''
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await function(*args, **kwargs)
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def register(self, component, stats):
+        '''
+        Adds a component whose stats() numbers are exported as gauges named modbot_<component>_<key>.
+        '''
+        self.collectors[component] = stats
+
+    async def sample_loop_lag(self, interval=0.5):
+        '''
+        Measures how late the event loop wakes up from a sleep; anything blocking the loop shows up here.
+        '''
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.observe('event_loop_lag_seconds', max(0.0, loop.time() - start - interval))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.counts), h.count, h.sum) for key, h in self.histograms.items()}
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE modbot_{name}_total counter')
+            for (counter_name, labels), value in counters.items():
+                if counter_name == name:
+                    lines.append(f'modbot_{name}_total{_labels(labels)} {value}')
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# TYPE modbot_{name} histogram')
+            for (histogram_name, labels), (counts, count, total) in histograms.items():
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(f'modbot_{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'modbot_{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'modbot_{name}_sum{_labels(labels)} {total}')
+                lines.append(f'modbot_{name}_count{_labels(labels)} {count}')
+
+        for component, stats in self.collectors.items():
+            try:
+                values = list(_flatten(f'modbot_{component}', stats()))
+            except Exception:
+                logger.exception(f'Could not collect {component} metrics')
+                continue
+            for name, value in values:
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host, port):
+        '''
+        Serves the metrics at http://host:port/metrics until stop() is called.
+        '''
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self.server = web.AppRunner(app)
+        await self.server.setup()
+        await web.TCPSite(self.server, host, port).start()
+
+    async def stop(self):
+        if self.server is not None:
+            await self.server.cleanup()
+            self.server = None
+
+
+METRICS = MetricsRegistry()
@@ -1,148 +1,205 @@
 # Import Packages
-import numpy as np
-import pandas as pd
-
-import matplotlib.pyplot as plt
-
-# import gdown
-from zipfile import ZipFile
-from joblib import dump, load
-
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics import plot_confusion_matrix
-
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import RandomizedSearchCV
-
-# from bs4 import BeautifulSoup
-# import requests
-import re
-
-from newspaper import Article
+# Heavy packages (numpy, sklearn, firebase) are imported lazily on first use to keep bot startup fast.
+# Training and evaluation live in fake_news_detection.ipynb.
+import os
 
 import uuid
 
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-
-cred = credentials.Certificate('cs152-project-service-account.json')
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
-
-seed = 0
-np.random.seed(seed)
-
-text_tf_idf_vectorizer = load('text_tf_idf_vectorizer.joblib')
-
-text_clf = load('fake_news_classifier.joblib')
+from metrics import METRICS
+from model.extract import extract_text
+from model.writer import FirestoreWriter, REPORT_INDEX
+
+FIREBASE_CREDENTIALS = 'cs152-project-service-account.json'
+# Report and user stat writes are journaled here until Firestore has them; shard processes each use their own (see bot.main)
+FIRESTORE_JOURNAL = 'firestore_journal.jsonl'
+
+_db = None
+_writer = None
+
+def get_db():
+    '''
+    Connects to Firestore on first use. Set FIRESTORE_EMULATOR_HOST to use the emulator.
+    '''
+    global _db
+    if _db is None:
+        import firebase_admin
+        from firebase_admin import credentials
+        from firebase_admin import firestore
+
+        cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+        firebase_admin.initialize_app(cred)
+        _db = firestore.client()
+    return _db
+
+def set_db(db):
+    '''
+    Swaps in another Firestore client, e.g. an in-memory fake.
+    '''
+    global _db
+    _db = db
+
+def set_journal(path):
+    '''
+    Journals pending writes to another file, or keeps them in memory only if path is None. Must be
+    called before the writer starts.
+    '''
+    global FIRESTORE_JOURNAL
+    FIRESTORE_JOURNAL = path
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        _writer = FirestoreWriter(get_db, FIRESTORE_JOURNAL)
+    return _writer
+
+# Compact artifact exported by model/compact.py; falls back to the joblib files if it hasn't been exported
+FAKE_NEWS_ARTIFACT = 'fake_news_model'
+FAKE_NEWS_VECTORIZER = 'text_tf_idf_vectorizer.joblib'
+FAKE_NEWS_CLASSIFIER = 'fake_news_classifier.joblib'
+
+_fake_news_model = None
+
+class JoblibModel:
+    def __init__(self, vectorizer_path, classifier_path):
+        from joblib import load
+        self.vectorizer = load(vectorizer_path)
+        self.clf = load(classifier_path)
+        # Label 1 is fake news
+        self.fake_column = list(self.clf.classes_).index(1)
+
+    def predict_fake_proba(self, texts):
+        return self.clf.predict_proba(self.vectorizer.transform(texts))[:, self.fake_column]
+
+def get_fake_news_model():
+    '''
+    Loads the fake news model on first use.
+    '''
+    global _fake_news_model
+    if _fake_news_model is None:
+        if os.path.isdir(FAKE_NEWS_ARTIFACT):
+            from model.compact import CompactModel
+            _fake_news_model = CompactModel(FAKE_NEWS_ARTIFACT)
+        else:
+            _fake_news_model = JoblibModel(FAKE_NEWS_VECTORIZER, FAKE_NEWS_CLASSIFIER)
+    return _fake_news_model
 
 '''
 Fake News Detection
 '''
 
-# post_text = ' Woah, check out https://www.thegatewaypundit.com/2021/02/ignored-media-dirtbag-joe-biden-says-us-veterans-former-police-officers-fueling-white-supremacism-america/ here'
-def isFakeNews(post_text):
-    links_in_post = re.findall(r'(https?://\S+)', post_text)
-
-    for link in links_in_post:
-        # raw_html = requests.get(link).text        
-        # webpage_text = BeautifulSoup(raw_html, features="html.parser").text
-
-        article = Article(link)
-        article.download()
-        article.parse()
-
-        webpage_text = article.text
-
-        webpage_vector = text_tf_idf_vectorizer.transform([webpage_text])
-
-        # print(webpage_text)
-
-        return text_clf.predict(webpage_vector)[0]
+def extract_article_text(link, html):
+    '''
+    Parses already-downloaded article html and returns the article text, stopping once it has
+    FAKE_NEWS_MAX_WORDS words (see model/extract.py). link isn't needed, but is part of the job's
+    signature in workerpool.py.
+    CPU-bound, so the bot runs this in a worker process rather than on the event loop.
+    '''
+    return extract_text(html)
+
+def predict_fake_news_batch(webpage_texts):
+    '''
+    Vectorizes many article texts in one sparse-matrix pass and returns the probability that each is fake news.
+    '''
+    return get_fake_news_model().predict_fake_proba(list(webpage_texts))
 
 '''
 Firebase Databse Functions
 '''
 
-def add_user(user_name):
-    doc_ref = db.collection('users').document(user_name)
-    doc_ref.set({
+def new_user_data(user_name):
+    return {
         'name': user_name,
         'reports_for': {
             'correct_reports': 0,
             'incorrect_reports': 0,
-            'total_reports': 0,
-            'report_weight': 0,
-            'report_ids': []
+            'total_reports': 0
         },
         'reports_against': {
             'correct_reports': 0,
             'incorrect_reports': 0,
-            'total_reports': 0,
-            'report_weight': 0,
-            'report_ids': []
+            'total_reports': 0
         }
-    })
+    }
 
+# Each of these is timed under modbot_firestore_seconds. The write functions only queue for the writer
+# (which times its own reads and commits), so their time is how long callers waited to queue, or to
+# journal the mutation while the queue was full
+
+@METRICS.timed('firestore_seconds', call='add_user')
+def add_user(user_name):
+    get_writer().enqueue({'op': 'add_user', 'user_name': user_name, 'data': new_user_data(user_name)})
+
+@METRICS.timed('firestore_seconds', call='add_report')
 def add_report(post_text, poster_username, reporter_username):
+    '''
+    Queues the report and its user stat updates for the background writer and returns the new report id.
+    '''
     report_id = str(uuid.uuid4())
-    doc_ref = db.collection('reports').document(report_id)
-    doc_ref.set({
+    get_writer().enqueue({'op': 'add_report', 'report_id': report_id, 'data': {
         'post_text': post_text,
         'poster_username': poster_username,
         'reporter_username': reporter_username,
         'manual_review_validity': None
-    })
+    }})
 
     add_user_report(reporter_username, report_id, 'reports_for')
     add_user_report(poster_username, report_id, 'reports_against')
 
     return report_id
 
+@METRICS.timed('firestore_seconds', call='add_user_report')
 def add_user_report(user_name, report_id, report_type):
-    doc_ref = db.collection('users').document(user_name)
-    doc = doc_ref.get()
-
-    if doc.exists:
-        doc = doc.to_dict()
+    get_writer().enqueue({'op': 'add_user_report', 'user_name': user_name, 'report_id': report_id, 'report_type': report_type})
 
-        doc[report_type]['total_reports'] += 1
-        doc[report_type]['correct_reports'] = doc[report_type]['correct_reports'] / doc[report_type]['total_reports']
-        doc[report_type]['report_ids'].append(report_id)
-
-        doc_ref.set(doc)
-
-def evaluate_report(report_id, validity):
-    doc_ref = db.collection('reports').document(report_id)
-    doc = doc_ref.get().to_dict()
-    
-    doc['manual_review_validity'] = validity
-    doc_ref.set(doc)
-
-    evaluate_user_report(doc['reporter_username'],validity,'reports_for')
-    evaluate_user_report(doc['poster_username'],validity,'reports_against')
+@METRICS.timed('firestore_seconds', call='evaluate_report')
+def evaluate_report(report_id, validity, reporter_username=None, poster_username=None):
+    '''
+    Queues a review verdict. Passing the usernames saves the writer from reading the report back.
+    '''
+    get_writer().enqueue({'op': 'evaluate_report', 'report_id': report_id, 'validity': validity,
+                          'reporter_username': reporter_username, 'poster_username': poster_username})
 
+@METRICS.timed('firestore_seconds', call='evaluate_user_report')
 def evaluate_user_report(user_name, validity, report_type):
-    doc_ref = db.collection('users').document(user_name)
-    doc = doc_ref.get()
-
-    if doc.exists:
-        doc = doc.to_dict()
-        if validity:
-            doc[report_type]['correct_reports'] += 1
-            doc[report_type]['report_weight'] = doc[report_type]['correct_reports'] / doc[report_type]['total_reports']
-        else:
-            doc[report_type]['incorrect_reports'] += 1
-    
-        doc_ref.set(doc)
-
+    get_writer().enqueue({'op': 'evaluate_user_report', 'user_name': user_name, 'validity': validity, 'report_type': report_type})
+
+def iter_user_reports(user_name, report_type=None, page_size=100):
+    '''
+    Streams the ids of reports a user made ('reports_for') or received ('reports_against'), oldest first,
+    reading the user's report index one page at a time. Filtering by report_type uses the composite
+    index on (report_type, created_at).
+    '''
+    cursor = None
+    while True:
+        report_ids, cursor = get_user_reports_page(user_name, report_type, page_size, cursor)
+        yield from report_ids
+        if cursor is None:
+            return
+
+@METRICS.timed('firestore_seconds', call='get_user_reports_page')
+def get_user_reports_page(user_name, report_type=None, page_size=100, start_after=None):
+    '''
+    Returns one page of report ids from a user's report index and a cursor for the next page
+    (None once there are no more).
+    '''
+    query = get_db().collection('users').document(user_name).collection(REPORT_INDEX)
+    if report_type is not None:
+        query = query.where('report_type', '==', report_type)
+    query = query.order_by('created_at').order_by('report_id')
+    if start_after is not None:
+        query = query.start_after(start_after)
+
+    docs = list(query.limit(page_size).stream())
+    cursor = {'created_at': docs[-1].get('created_at'), 'report_id': docs[-1].get('report_id')} if len(docs) == page_size else None
+    return [doc.get('report_id') for doc in docs], cursor
+
+@METRICS.timed('firestore_seconds', call='get_user_info')
 def get_user_info(user_name):
-    return db.collection('users').document(user_name).get().to_dict()
+    return get_db().collection('users').document(user_name).get().to_dict()
 
+@METRICS.timed('firestore_seconds', call='get_all_users')
 def get_all_users_firebase():
-    docs = db.collection('users').stream()
+    docs = get_db().collection('users').stream()
 
     all_users = []
     for doc in docs:
@@ -0,0 +1,209 @@
+'''
+Compact fake news inference artifact.
+
+The notebook pipeline produces a bigram TfidfVectorizer and a RandomForestClassifier, both pickled
+with joblib. Unpickling the vectorizer builds a Python dict with one entry per bigram, which dominates
+startup time and memory. The exported artifact instead stores the vocabulary as sorted 64-bit term
+hashes with float32 idf weights in .npy files that are memory-mapped, so only the pages a document
+actually touches are read. The classifier is either the original forest or, if training texts are
+given at export time, a sparse float32 linear model distilled from it.
+
+Export from the joblib files with:
+    python -m model.compact text_tf_idf_vectorizer.joblib fake_news_classifier.joblib fake_news_model [train.csv]
+'''
+import hashlib
+import json
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class CompactTfidfVectorizer:
+    '''
+    Reproduces TfidfVectorizer.transform (word analyzer) from a hashed vocabulary. Columns are
+    positions in the sorted hash array, not the original vectorizer's column numbers.
+    '''
+    def __init__(self, config, hashes, idf):
+        self.lowercase = config['lowercase']
+        self.strip_accents = config['strip_accents']
+        self.token_pattern = re.compile(config['token_pattern'])
+        self.min_n, self.max_n = config['ngram_range']
+        self.stop_words = frozenset(config['stop_words'] or ())
+        # Artifacts exported before binary was supported were all from vectorizers without it
+        self.binary = config.get('binary', False)
+        self.sublinear_tf = config['sublinear_tf']
+        self.norm = config['norm']
+        self.hashes = hashes
+        self.idf = idf
+
+    def terms(self, text):
+        if self.lowercase:
+            text = text.lower()
+        if self.strip_accents == 'ascii':
+            text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+        elif self.strip_accents == 'unicode':
+            text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+        tokens = [t for t in self.token_pattern.findall(text) if t not in self.stop_words]
+        for n in range(self.min_n, self.max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                yield ' '.join(tokens[i:i + n])
+
+    def transform(self, texts):
+        from scipy.sparse import csr_matrix
+
+        indptr = [0]
+        indices = []
+        data = []
+        for text in texts:
+            counts = Counter(self.terms(text))
+            hashes = np.fromiter((term_hash(t) for t in counts), dtype=np.uint64, count=len(counts))
+            positions = np.searchsorted(self.hashes, hashes)
+            positions[positions == len(self.hashes)] = 0
+            found = self.hashes[positions] == hashes
+
+            columns = positions[found]
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))[found]
+            if self.binary:
+                tf = np.ones_like(tf)
+            if self.sublinear_tf:
+                tf = 1 + np.log(tf)
+            weights = tf * self.idf[columns]
+            if self.norm == 'l2':
+                weights /= max(float(np.sqrt(np.dot(weights, weights))), 1e-12)
+            elif self.norm == 'l1':
+                weights /= max(float(np.abs(weights).sum()), 1e-12)
+
+            order = np.argsort(columns)
+            indices.append(columns[order])
+            data.append(weights[order])
+            indptr.append(indptr[-1] + len(columns))
+
+        return csr_matrix((np.concatenate(data) if data else np.zeros(0, np.float32),
+                           np.concatenate(indices) if indices else np.zeros(0, np.int64),
+                           indptr), shape=(len(texts), len(self.hashes)), dtype=np.float32)
+
+
+class CompactModel:
+    '''
+    Vectorizer plus classifier loaded from an exported artifact directory.
+    '''
+    def __init__(self, path):
+        with open(os.path.join(path, 'config.json')) as f:
+            config = json.load(f)
+
+        hashes = np.load(os.path.join(path, 'hashes.npy'), mmap_mode='r')
+        idf = np.load(os.path.join(path, 'idf.npy'), mmap_mode='r')
+        self.vectorizer = CompactTfidfVectorizer(config, hashes, idf)
+
+        self.linear = config['classifier'] == 'linear'
+        if self.linear:
+            weights = np.load(os.path.join(path, 'weights.npz'))
+            self.weight_columns = weights['columns']
+            self.weight_values = weights['values']
+            self.intercept = float(weights['intercept'])
+        else:
+            from joblib import load
+            self.columns = np.load(os.path.join(path, 'columns.npy'), mmap_mode='r')
+            self.forest = load(os.path.join(path, 'forest.joblib'), mmap_mode='r')
+            self.fake_column = list(self.forest.classes_).index(1)
+
+    def predict_fake_proba(self, texts):
+        '''
+        Returns the probability that each text is fake news.
+        '''
+        vectors = self.vectorizer.transform(texts)
+        if self.linear:
+            logits = vectors[:, self.weight_columns] @ self.weight_values + self.intercept
+            return 1 / (1 + np.exp(-np.asarray(logits).ravel()))
+
+        # The forest was trained on the original column order
+        from scipy.sparse import csr_matrix
+        vectors = csr_matrix((vectors.data, self.columns[vectors.indices], vectors.indptr),
+                             shape=(vectors.shape[0], len(self.columns)))
+        vectors.sort_indices()
+        return self.forest.predict_proba(vectors)[:, self.fake_column]
+
+
+def export_artifact(vectorizer, clf, path, distill_texts=None):
+    '''
+    Writes a compact artifact for a fitted TfidfVectorizer and classifier. If distill_texts is given,
+    an L1-regularized logistic regression is fitted to the classifier's own predictions on those texts
+    and stored as sparse float32 weights instead of the forest. Vectorizers with settings that
+    CompactTfidfVectorizer can't reproduce raise ValueError.
+    '''
+    from joblib import dump
+
+    if vectorizer.analyzer != 'word' or vectorizer.preprocessor is not None or vectorizer.tokenizer is not None:
+        raise ValueError('Only the default word analyzer can be exported')
+    if vectorizer.input != 'content' or vectorizer.strip_accents not in (None, 'ascii', 'unicode') or \
+            vectorizer.norm not in (None, 'l1', 'l2'):
+        raise ValueError(f'Cannot export a vectorizer with input={vectorizer.input!r}, '
+                         f'strip_accents={vectorizer.strip_accents!r}, norm={vectorizer.norm!r}')
+    os.makedirs(path, exist_ok=True)
+
+    terms = list(vectorizer.vocabulary_.keys())
+    original_columns = np.fromiter(vectorizer.vocabulary_.values(), dtype=np.int64, count=len(terms))
+    hashes = np.fromiter((term_hash(t) for t in terms), dtype=np.uint64, count=len(terms))
+    order = np.argsort(hashes)
+    hashes = hashes[order]
+    if np.any(hashes[1:] == hashes[:-1]):
+        raise ValueError('Term hash collision, cannot export vocabulary')
+    columns = original_columns[order]
+
+    config = {
+        'lowercase': vectorizer.lowercase,
+        'strip_accents': vectorizer.strip_accents,
+        'token_pattern': vectorizer.token_pattern,
+        'ngram_range': list(vectorizer.ngram_range),
+        'stop_words': sorted(vectorizer.get_stop_words() or ()),
+        'binary': vectorizer.binary,
+        'sublinear_tf': vectorizer.sublinear_tf,
+        'norm': vectorizer.norm,
+        'classifier': 'forest' if distill_texts is None else 'linear',
+    }
+    with open(os.path.join(path, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    np.save(os.path.join(path, 'hashes.npy'), hashes)
+    # Without idf every term weighs 1, which keeps the loader the same for both
+    idf = vectorizer.idf_[columns] if vectorizer.use_idf else np.ones(len(terms))
+    np.save(os.path.join(path, 'idf.npy'), idf.astype(np.float32))
+
+    if distill_texts is None:
+        np.save(os.path.join(path, 'columns.npy'), columns)
+        dump(clf, os.path.join(path, 'forest.joblib'))
+        return
+
+    from sklearn.linear_model import LogisticRegression
+    vectors = vectorizer.transform(distill_texts)
+    student = LogisticRegression(penalty='l1', solver='liblinear', C=10)
+    student.fit(vectors[:, columns], clf.predict(vectors) == 1)
+    nonzero = np.flatnonzero(student.coef_[0])
+    np.savez(os.path.join(path, 'weights.npz'), columns=nonzero.astype(np.int64),
+             values=student.coef_[0][nonzero].astype(np.float32), intercept=np.float32(student.intercept_[0]))
+
+
+if __name__ == '__main__':
+    from joblib import load
+
+    if len(sys.argv) not in (4, 5):
+        print(__doc__)
+        sys.exit(1)
+
+    distill_texts = None
+    if len(sys.argv) == 5:
+        # Same text construction as the notebook's training data
+        import pandas as pd
+        train_data = pd.read_csv(sys.argv[4]).fillna(' ')
+        distill_texts = (train_data['title'] + ' ' + train_data['author'] + ' ' + train_data['text']).to_numpy().astype(str)
+
+    export_artifact(load(sys.argv[1]), load(sys.argv[2]), sys.argv[3], distill_texts)
+    print(f'Exported fake news model to {sys.argv[3]}')
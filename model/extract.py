@@ -0,0 +1,165 @@
+'''
+Bounded article text extraction for the fake news check, in place of newspaper.
+
+newspaper builds the whole page's DOM before picking out the article, so a huge or hostile page
+costs seconds of CPU and a DOM's worth of memory. Here the page is fed through an incremental
+HTMLParser in slices, and parsing stops as soon as FAKE_NEWS_MAX_WORDS words of article text have
+been collected or the page's marked-up article has ended. Nothing is kept but the paragraphs
+collected so far. The download itself is capped at FAKE_NEWS_MAX_BYTES (see
+FakeNewsChecker.fetch), and pages that aren't HTML are never parsed.
+
+Text is taken from paragraph-level blocks outside scripts, navigation, headers, footers, forms and
+the like, dropping short blocks and blocks that are mostly link text (menus, related links). If the
+page marks up its article (<article>, <main> or itemprop="articleBody"), only blocks inside it are
+kept. The result is plain text with entities decoded and paragraphs separated by blank lines, like
+newspaper's Article.text, so the fake news vectorizer sees the same kind of tokens it was trained on.
+
+Compare against newspaper on saved pages with bench/extract.py.
+'''
+import re
+from html.parser import HTMLParser
+
+import globals
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+CHARSET_PATTERN = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+# Characters fed to the parser at a time, so the word budget is checked often
+EXTRACT_CHUNK = 16 * 1024
+# Blocks shorter than this are headings, captions, bylines and buttons rather than article text
+MIN_PARAGRAPH_WORDS = 8
+# Blocks where at least this share of the words are link text are menus and link lists
+MAX_LINK_DENSITY = 0.5
+
+# Words as the vectorizer's default token pattern counts them
+WORD_PATTERN = re.compile(r'\b\w\w+\b')
+
+SKIP_TAGS = {'head', 'script', 'style', 'noscript', 'template', 'svg', 'math', 'iframe', 'object',
+             'nav', 'header', 'footer', 'aside', 'form', 'button', 'select', 'textarea', 'figcaption'}
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'dl', 'dd', 'dt', 'blockquote',
+              'pre', 'table', 'tr', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'hr'}
+ARTICLE_TAGS = {'article', 'main'}
+# Elements that never have an end tag, so they can't open a skipped or article region
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+def is_html(content_type):
+    '''
+    Whether a Content-Type header value (or None, if the server sent none) may be an HTML page.
+    '''
+    if not content_type:
+        return True
+    return content_type.split(';')[0].strip().lower() in HTML_TYPES
+
+
+def decode(body, content_type):
+    '''
+    Decodes a page body with the charset from its Content-Type header, or as UTF-8 if it has none
+    (or one Python doesn't know). A multi-byte character cut off by the byte budget becomes U+FFFD.
+    '''
+    match = CHARSET_PATTERN.search(content_type or '')
+    try:
+        return bytes(body).decode(match.group(1) if match else 'utf-8', errors='replace')
+    except LookupError:
+        return bytes(body).decode('utf-8', errors='replace')
+
+
+class ArticleExtractor(HTMLParser):
+    '''
+    Incremental extractor: feed() it the page in pieces, stop once done(), then read text().
+    '''
+    def __init__(self, max_words=globals.FAKE_NEWS_MAX_WORDS):
+        super().__init__(convert_charrefs=True)
+        self.max_words = max_words
+        self.skip_depth = 0
+        self.link_depth = 0
+        self.article_regions = [] # List of [tag, how many elements with that tag are open inside it] for the article regions we are in
+        self.seen_article = False
+        self.block = [] # Text of the current block
+        self.block_link_words = 0
+        self.paragraphs = []
+        self.words = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            # A <head> that was never closed ends here
+            self.skip_depth = 0
+        if tag in BLOCK_TAGS:
+            self._end_block()
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'a':
+            self.link_depth += 1
+        for region in self.article_regions:
+            if region[0] == tag:
+                region[1] += 1
+        if tag in ARTICLE_TAGS or ('itemprop', 'articleBody') in attrs:
+            self.article_regions.append([tag, 1])
+            if not self.seen_article:
+                # Paragraphs from before the article were only kept in case there was none
+                self.seen_article = True
+                self.paragraphs = []
+                self.words = 0
+
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self._end_block()
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'a':
+            self.link_depth = max(0, self.link_depth - 1)
+        for region in self.article_regions:
+            if region[0] == tag:
+                region[1] -= 1
+        self.article_regions = [region for region in self.article_regions if region[1] > 0]
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        self.block.append(data)
+        if self.link_depth:
+            self.block_link_words += len(WORD_PATTERN.findall(data))
+
+    def _end_block(self):
+        # Blocks still in the slice being parsed when the budget ran out aren't kept
+        if not self.block or self.words >= self.max_words:
+            self.block = []
+            self.block_link_words = 0
+            return
+        text = ' '.join(''.join(self.block).split())
+        link_words = self.block_link_words
+        self.block = []
+        self.block_link_words = 0
+
+        words = len(WORD_PATTERN.findall(text))
+        if words < MIN_PARAGRAPH_WORDS or link_words >= MAX_LINK_DENSITY * words:
+            return
+        if self.seen_article and not self.article_regions:
+            return
+        self.paragraphs.append(text)
+        self.words += words
+
+    def done(self):
+        # Past the end of a marked-up article there is nothing left to keep (comments, related stories)
+        return self.words >= self.max_words or bool(self.paragraphs and self.seen_article and not self.article_regions)
+
+    def close(self):
+        super().close()
+        self._end_block()
+
+    def text(self):
+        return '\n\n'.join(self.paragraphs)
+
+
+def extract_text(html, max_words=globals.FAKE_NEWS_MAX_WORDS):
+    '''
+    Returns the article text of a page, parsing only as much of it as the word budget needs.
+    '''
+    extractor = ArticleExtractor(max_words)
+    for start in range(0, len(html), EXTRACT_CHUNK):
+        extractor.feed(html[start:start + EXTRACT_CHUNK])
+        if extractor.done():
+            break
+    extractor.close()
+    return extractor.text()
@@ -0,0 +1,64 @@
+'''
+One-off migration from the old user document layout, where every report id was appended to
+reports_for.report_ids / reports_against.report_ids, to the per-user report_index subcollection.
+
+Each id becomes a report_index document and the arrays are then deleted from the user document.
+Safe to re-run: index documents are keyed by report id, and users without arrays are skipped.
+
+Run from the repository root:
+    python -m model.migrate_report_index [--dry-run]
+'''
+import sys
+
+from firebase_admin import firestore
+
+from model.abridged import get_db
+from model.writer import REPORT_INDEX, REPORT_TYPES
+
+# Stay under Firestore's 500 writes per batch
+BATCH_LIMIT = 450
+
+
+def migrate(dry_run=False):
+    db = get_db()
+    users = 0
+    report_ids = 0
+
+    for user in db.collection('users').stream():
+        doc = user.to_dict()
+        ids = {report_type: doc.get(report_type, {}).get('report_ids') for report_type in REPORT_TYPES}
+        if all(value is None for value in ids.values()):
+            continue
+
+        users += 1
+        batch = db.batch()
+        writes = 0
+        for report_type, type_ids in ids.items():
+            for report_id in type_ids or []:
+                batch.set(user.reference.collection(REPORT_INDEX).document(report_id), {
+                    'report_id': report_id,
+                    'report_type': report_type,
+                    # The original times were never stored; the migration time keeps ordering by created_at working
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                })
+                writes += 1
+                report_ids += 1
+                if writes == BATCH_LIMIT:
+                    if not dry_run:
+                        batch.commit()
+                    batch = db.batch()
+                    writes = 0
+
+        # Only drop the arrays once every id they held has been indexed
+        batch.update(user.reference, {f'{report_type}.report_ids': firestore.DELETE_FIELD
+                                      for report_type, type_ids in ids.items() if type_ids is not None})
+        if not dry_run:
+            batch.commit()
+
+    return users, report_ids
+
+
+if __name__ == '__main__':
+    dry_run = '--dry-run' in sys.argv[1:]
+    users, report_ids = migrate(dry_run)
+    print(f'{"Would migrate" if dry_run else "Migrated"} {report_ids} report ids for {users} users')
@@ -0,0 +1,101 @@
+'''
+In-memory registry of Firestore users.
+
+`!add_user` used to stream the whole users collection to check one name. The registry keeps the set
+of user names in memory instead: it is filled by the initial snapshot of a listener on the users
+collection and kept fresh by that listener's later changes, so membership checks are O(1) and need
+no network. get_user_info is cached per user and invalidated whenever a user document changes,
+either through the listener or when the write-behind writer commits new stats.
+'''
+import logging
+import threading
+
+import globals
+from cache import LRUCache
+from metrics import METRICS
+from model.abridged import get_db, get_writer, new_user_data
+
+logger = logging.getLogger('discord')
+
+
+class UserRegistry:
+    def __init__(self, info_cache_size=globals.USER_INFO_CACHE_SIZE, info_cache_ttl=globals.USER_INFO_CACHE_TTL):
+        self.users = set()
+        self.info = LRUCache(info_cache_size, info_cache_ttl)
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.watch = None
+
+    def start(self, timeout=30):
+        '''
+        Starts listening to the users collection and blocks until the initial snapshot has loaded.
+        '''
+        if self.watch is None:
+            get_writer().add_listener(self.invalidate)
+            self.watch = get_db().collection('users').on_snapshot(self._on_snapshot)
+        if not self.ready.wait(timeout):
+            logger.warning('User registry is still loading; membership checks may miss existing users')
+
+    def stop(self):
+        if self.watch is not None:
+            self.watch.unsubscribe()
+            self.watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self.lock:
+            for change in changes:
+                user_name = change.document.id
+                if change.type.name == 'REMOVED':
+                    self.users.discard(user_name)
+                else:
+                    self.users.add(user_name)
+                self.info.pop(user_name)
+        self.ready.set()
+
+    def __contains__(self, user_name):
+        return user_name in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def create_if_absent(self, user_name):
+        '''
+        Creates the user's document unless it already exists. Returns whether it was created.
+        '''
+        from google.api_core.exceptions import AlreadyExists
+
+        if user_name in self.users:
+            return False
+        try:
+            # create() fails if the document exists, so two concurrent calls can't both succeed
+            with METRICS.timer('firestore_seconds', call='create_user'):
+                get_db().collection('users').document(user_name).create(new_user_data(user_name))
+        except AlreadyExists:
+            created = False
+        else:
+            created = True
+        with self.lock:
+            self.users.add(user_name)
+        return created
+
+    def get_user_info(self, user_name):
+        with self.lock:
+            info = self.info.get(user_name)
+        if info is None and user_name in self.users:
+            with METRICS.timer('firestore_seconds', call='get_user_info'):
+                info = get_db().collection('users').document(user_name).get().to_dict()
+            with self.lock:
+                self.info.put(user_name, info)
+        return info
+
+    def invalidate(self, user_names):
+        with self.lock:
+            for user_name in user_names:
+                self.info.pop(user_name)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'users': len(self.users),
+                'info_cache': self.info.stats(),
+            }
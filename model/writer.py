@@ -0,0 +1,401 @@
+'''
+Write-behind persistence for reports and user stats.
+
+The report functions in model/abridged.py used to make 5-7 sequential Firestore round trips per
+report from inside the event loop. They now only enqueue mutations here. A background thread drains
+the queue and applies everything waiting in one pass: a single get_all for the user documents
+involved, then a single batched write that updates individual fields with atomic increments
+instead of rewriting whole documents.
+
+enqueue() runs on the event loop, so normally it never touches the disk or blocks: it only hands the
+mutation to the writer thread. The queue is bounded; once it is full, enqueue() journals each new
+mutation itself (one fsync each) and sets it aside to be written after everything queued, so nothing
+is dropped under overload. The writer thread appends each batch to a local journal (one fsync per
+batch) before writing it, and the journal records which mutations have been committed, so anything
+still pending when the bot stops is replayed on the next start (at-least-once). Mutations still in
+the queue when the process dies are lost; ModBot.close() flushes the queue first.
+
+A batch that fails because of one bad mutation (an update of a report that was never written, say)
+is written again one mutation at a time. Mutations that fail on their own with an error retrying
+can't fix are moved to a dead-letter file next to the journal, so the journal can still be
+truncated. Outages and throttling are retried, then left in the journal until the next start.
+
+Every user stat is an atomic increment, so shard processes writing the same user never lose each
+other's updates. report_weight is derived from the counters when it is read (see report_weight).
+'''
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import METRICS
+
+logger = logging.getLogger('discord')
+
+# Firestore batches are capped at 500 writes; each mutation produces a few
+MAX_FLUSH_MUTATIONS = 100
+REPORT_TYPES = ('reports_for', 'reports_against')
+# Subcollection under each user document holding one document per report they made or received
+REPORT_INDEX = 'report_index'
+
+
+def report_weight(stats):
+    '''
+    Share of a user's decided reports that were correct, from their 'reports_for' or 'reports_against' stats.
+    '''
+    total = stats.get('total_reports', 0)
+    return stats.get('correct_reports', 0) / total if total else 0
+
+
+def dead_letter_path(journal_path):
+    if journal_path is None:
+        return None
+    root, ext = os.path.splitext(journal_path)
+    return f'{root}-dead-letter{ext}'
+
+
+def is_permanent(error):
+    '''
+    Whether a failed write is down to the mutations themselves (a missing document, bad data), so
+    retrying can't help. Outages, throttling and configuration errors aren't.
+    '''
+    if isinstance(error, (LookupError, TypeError, ValueError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (exceptions.NotFound, exceptions.InvalidArgument, exceptions.FailedPrecondition, exceptions.AlreadyExists))
+
+
+class FirestoreWriter:
+    def __init__(self, get_db, journal_path=None, max_queue=10000, flush_interval=0.2, max_retries=5, backoff=0.5):
+        self.get_db = get_db
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path(journal_path)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Guards next_seq, spilled, uncommitted and unfinished; taken before journal_lock when both are needed
+        self.lock = threading.Lock()
+        self.journal_lock = threading.Lock()
+        self.idle = threading.Condition(self.lock) # Notified when unfinished drops to 0
+        self.next_seq = 0
+        self.spilled = [] # Mutations enqueued while the queue was full (or after ones that were), already journaled
+        self.uncommitted = 0 # Mutations in the journal that haven't been committed or dead-lettered yet
+        self.unfinished = 0 # Mutations not yet written, dead-lettered or given up on
+        self.thread = None
+        self.listeners = [] # Called with the set of user names whose documents changed after each commit
+
+        # Metrics
+        self.flushes = 0
+        self.mutations_written = 0
+        self.failures = 0
+        self.spills = 0
+        self.dead_lettered = 0
+
+        # Written by the writer thread before anything new
+        self.replayed = self._read_journal()
+        self.unfinished = len(self.replayed)
+        if self.replayed:
+            self.start()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='firestore-writer', daemon=True)
+            self.thread.start()
+
+    def enqueue(self, mutation):
+        '''
+        Queues a mutation (a JSON-serializable dict with an 'op' key) for the next flush. Only blocks
+        (to journal the mutation) while the queue is full.
+        '''
+        with self.lock:
+            mutation = dict(mutation, seq=self.next_seq)
+            self.next_seq += 1
+            self.unfinished += 1
+            queued = False
+            if not self.spilled:
+                try:
+                    self.queue.put_nowait(mutation)
+                    queued = True
+                except queue.Full:
+                    logger.warning('Firestore write queue is full, journaling new mutations as they arrive')
+            if not queued:
+                # Anything after a spilled mutation is spilled too, so mutations are still written in order
+                self._journal([{'mutation': mutation}])
+                self.uncommitted += 1
+                self.spilled.append(mutation)
+                self.spills += 1
+                METRICS.inc('firestore_mutations_spilled', op=mutation['op'])
+        self.start()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def flush(self, timeout=None):
+        '''
+        Blocks until every mutation enqueued so far has been written, dead-lettered or left in the
+        journal for the next start, or until timeout seconds have passed. Returns whether it finished.
+        '''
+        self.start()
+        with self.idle:
+            return self.idle.wait_for(lambda: self.unfinished == 0, timeout)
+
+    def queue_depth(self):
+        return self.queue.qsize() + len(self.spilled)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'flushes': self.flushes,
+            'mutations_written': self.mutations_written,
+            'failures': self.failures,
+            'spilled': self.spills,
+            'dead_lettered': self.dead_lettered,
+        }
+
+    def _run(self):
+        if self.replayed:
+            logger.info(f'Replaying {len(self.replayed)} uncommitted Firestore mutations from {self.journal_path}')
+            # Already in the journal
+            for i in range(0, len(self.replayed), MAX_FLUSH_MUTATIONS):
+                batch = self.replayed[i:i + MAX_FLUSH_MUTATIONS]
+                self._write_with_retry(batch)
+                self._finished(len(batch))
+            self.replayed = []
+
+        while True:
+            with self.lock:
+                # Spilled mutations are newer than anything queued, so they go once the queue is empty
+                spilled = self.spilled[:MAX_FLUSH_MUTATIONS] if self.queue.empty() else []
+                del self.spilled[:len(spilled)]
+            if spilled:
+                # Journaled by enqueue()
+                self._write_with_retry(spilled)
+                self._finished(len(spilled))
+                continue
+
+            mutations = [self.queue.get()]
+            # Give concurrent reports a moment to arrive so they share the flush
+            deadline = time.monotonic() + self.flush_interval
+            while len(mutations) < MAX_FLUSH_MUTATIONS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    mutations.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._journal([{'mutation': m} for m in mutations])
+            with self.lock:
+                self.uncommitted += len(mutations)
+            self._write_with_retry(mutations)
+            for _ in mutations:
+                self.queue.task_done()
+            self._finished(len(mutations))
+
+    def _finished(self, count):
+        with self.lock:
+            self.unfinished -= count
+            if self.unfinished == 0:
+                self.idle.notify_all()
+
+    def _write_with_retry(self, mutations):
+        error = self._attempt(mutations)
+        if error is None:
+            return
+        if not is_permanent(error):
+            # Still in the journal, so they will be retried on the next start
+            logger.error(f'Giving up on {len(mutations)} Firestore mutations until restart', exc_info=error)
+            return
+        if len(mutations) == 1:
+            self._dead_letter(mutations[0], error)
+            return
+
+        # One bad mutation fails the whole batch; find it by committing them one at a time
+        logger.warning(f'Firestore flush of {len(mutations)} mutations failed ({error!r}), writing them one at a time')
+        for i, mutation in enumerate(mutations):
+            error = self._attempt([mutation])
+            if error is None:
+                continue
+            if not is_permanent(error):
+                logger.error(f'Giving up on {len(mutations) - i} Firestore mutations until restart', exc_info=error)
+                return
+            self._dead_letter(mutation, error)
+
+    def _attempt(self, mutations):
+        '''
+        Writes mutations, retrying errors that aren't permanent. Returns None once they are committed,
+        or the last error.
+        '''
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write(mutations)
+            except Exception as e:
+                self.failures += 1
+                if attempt == self.max_retries or is_permanent(e):
+                    return e
+                logger.warning(f'Firestore flush failed, retrying in {self.backoff * 2 ** attempt:.1f}s', exc_info=True)
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                self.flushes += 1
+                self.mutations_written += len(mutations)
+                self._committed(mutations)
+                return None
+
+    def _dead_letter(self, mutation, error):
+        self.dead_lettered += 1
+        METRICS.inc('firestore_mutations_dead_lettered', op=mutation['op'])
+        logger.error(f'Moving a {mutation["op"]} mutation that can\'t be written to {self.dead_letter_path}: {error!r}')
+        if self.dead_letter_path is not None:
+            with open(self.dead_letter_path, 'a') as f:
+                f.write(json.dumps({'mutation': mutation, 'error': repr(error), 'time': time.time()}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self._committed([mutation])
+
+    def _committed(self, mutations):
+        # Committed or dead-lettered: either way the journal no longer needs them
+        self._journal([{'committed': [m['seq'] for m in mutations]}])
+        with self.lock:
+            self.uncommitted -= len(mutations)
+            if self.uncommitted == 0:
+                self._truncate_journal()
+
+    def write(self, mutations):
+        '''
+        Applies a list of mutations with one read and one batched write.
+        '''
+        from firebase_admin import firestore
+
+        db = self.get_db()
+        batch = db.batch()
+
+        # Reports created in this flush don't exist in Firestore yet; evaluations of them can use them directly
+        new_reports = {m['report_id']: m['data'] for m in mutations if m['op'] == 'add_report'}
+        # Copied, since counters get folded into them and a retried flush must start from the original
+        new_users = {m['user_name']: copy.deepcopy(m['data']) for m in mutations if m['op'] == 'add_user'}
+
+        # Sum counter changes per user and report type so each user document gets one update
+        deltas = {}
+        report_ids = {} # Key: (user_name, report_type) Value: list of report ids to index
+        def delta(user_name, report_type, counter):
+            user = deltas.setdefault(user_name, {t: {} for t in REPORT_TYPES})
+            user[report_type][counter] = user[report_type].get(counter, 0) + 1
+
+        for m in mutations:
+            if m['op'] == 'add_report':
+                batch.set(db.collection('reports').document(m['report_id']), m['data'])
+            elif m['op'] == 'add_user_report':
+                delta(m['user_name'], m['report_type'], 'total_reports')
+                report_ids.setdefault((m['user_name'], m['report_type']), []).append(m['report_id'])
+            elif m['op'] == 'evaluate_report':
+                report = new_reports.get(m['report_id'])
+                if report is None and (m.get('reporter_username') is None or m.get('poster_username') is None):
+                    report = db.collection('reports').document(m['report_id']).get().to_dict()
+                    if report is None:
+                        raise LookupError(f'Report {m["report_id"]} does not exist')
+                reporter = m.get('reporter_username') or report['reporter_username']
+                poster = m.get('poster_username') or report['poster_username']
+
+                batch.update(db.collection('reports').document(m['report_id']), {'manual_review_validity': m['validity']})
+                counter = 'correct_reports' if m['validity'] else 'incorrect_reports'
+                delta(reporter, 'reports_for', counter)
+                delta(poster, 'reports_against', counter)
+            elif m['op'] == 'evaluate_user_report':
+                delta(m['user_name'], m['report_type'], 'correct_reports' if m['validity'] else 'incorrect_reports')
+
+        # Report membership lives in a subcollection so user documents stay constant-size
+        def index_reports(user_name):
+            user_ref = db.collection('users').document(user_name)
+            for report_type in REPORT_TYPES:
+                for report_id in report_ids.get((user_name, report_type), []):
+                    batch.set(user_ref.collection(REPORT_INDEX).document(report_id), {
+                        'report_id': report_id,
+                        'report_type': report_type,
+                        'created_at': firestore.SERVER_TIMESTAMP,
+                    })
+
+        # Stats are only kept for registered users, as before
+        refs = [db.collection('users').document(user_name) for user_name in deltas if user_name not in new_users]
+        with METRICS.timer('firestore_seconds', call='get_all'):
+            snapshots = {snapshot.id: snapshot for snapshot in db.get_all(refs)} if refs else {}
+        for user_name, user_deltas in deltas.items():
+            if user_name in new_users:
+                # New users are written whole below, so fold the counters straight into their data
+                for report_type, counters in user_deltas.items():
+                    stats = new_users[user_name][report_type]
+                    for counter, amount in counters.items():
+                        stats[counter] = stats.get(counter, 0) + amount
+                index_reports(user_name)
+                continue
+
+            snapshot = snapshots.get(user_name)
+            if snapshot is None or not snapshot.exists:
+                continue
+
+            fields = {}
+            for report_type, counters in user_deltas.items():
+                for counter, amount in counters.items():
+                    fields[f'{report_type}.{counter}'] = firestore.Increment(amount)
+            batch.update(db.collection('users').document(user_name), fields)
+            index_reports(user_name)
+
+        for user_name, data in new_users.items():
+            batch.set(db.collection('users').document(user_name), data)
+
+        with METRICS.timer('firestore_seconds', call='commit'):
+            batch.commit()
+
+        changed_users = set(new_users) | set(deltas)
+        for callback in self.listeners:
+            callback(changed_users)
+
+    def _journal(self, entries):
+        if self.journal_path is None:
+            return
+        with self.journal_lock:
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _truncate_journal(self):
+        if self.journal_path is not None:
+            with self.journal_lock:
+                open(self.journal_path, 'w').close()
+
+    def _read_journal(self):
+        '''
+        Returns the journal's uncommitted mutations in order. They keep their seq numbers and stay in
+        the journal until committed; new mutations are numbered after them.
+        '''
+        if self.journal_path is None or not os.path.isfile(self.journal_path):
+            return []
+
+        pending = {}
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                if 'mutation' in entry:
+                    pending[entry['mutation']['seq']] = entry['mutation']
+                else:
+                    for seq in entry['committed']:
+                        pending.pop(seq, None)
+
+        if not pending:
+            self._truncate_journal()
+            return []
+        self.next_seq = max(pending) + 1
+        self.uncommitted = len(pending)
+        return [pending[seq] for seq in sorted(pending)]
@@ -0,0 +1,121 @@
+'''
+Text normalization shared by every stage that keys on message content.
+
+fold() maps text to the ASCII look-alike form the bot works on: accented and stylised letters
+(fullwidth, mathematical bold/italic, circled, ligatures) to their plain letters, Cyrillic and
+Greek homoglyphs to the Latin letters they imitate, typographic quotes and dashes to ASCII, unusual
+spaces to ' ', and zero-width characters and stray combining marks to nothing. Other characters
+(emoji, CJK, ...) are left alone.
+
+The translation table is built once at import. Pure ASCII text, which is most chat, is returned
+without a copy, and everything else is memoized, so repeated spam costs one lookup.
+'''
+import functools
+import hashlib
+import unicodedata
+
+import globals
+
+# Look-alikes Unicode decomposition doesn't fold (or folds to something unhelpful). Mostly from the
+# uni2ascii table the bot used before, plus the Cyrillic and Greek homoglyphs used to dodge filters.
+CONFUSABLES = {
+    '¡': 'i', '´': "'", 'Æ': 'AE', 'æ': 'ae', 'Ð': 'D', 'ð': 'd', 'Ø': 'O', 'ø': 'o', '×': 'x',
+    'ß': 'ss', 'Þ': 'Th', 'þ': 'th', 'Đ': 'D', 'đ': 'd', 'Ħ': 'H', 'ħ': 'h', 'ı': 'i', 'Ł': 'L',
+    'ł': 'l', 'Œ': 'OE', 'œ': 'oe', 'ƒ': 'f', 'ɑ': 'a', 'ɡ': 'g', 'ʻ': "'", 'ʼ': "'", 'ӕ': 'ae',
+    'ᵫ': 'ue', 'Ꜳ': 'AA', 'ꜳ': 'aa', '։': ':', '︰': ':',
+    # Cyrillic
+    'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H', 'О': 'O', 'Р': 'P', 'С': 'C',
+    'Т': 'T', 'У': 'Y', 'Х': 'X', 'Ѕ': 'S', 'І': 'I', 'Ј': 'J', 'а': 'a', 'б': '6', 'е': 'e',
+    'о': 'o', 'р': 'p', 'с': 'c', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'i', 'ј': 'j', 'ѵ': 'v',
+    'һ': 'h', 'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w',
+    # Greek
+    'Α': 'A', 'Β': 'B', 'Ε': 'E', 'Ζ': 'Z', 'Η': 'H', 'Ι': 'I', 'Κ': 'K', 'Μ': 'M', 'Ν': 'N',
+    'Ο': 'O', 'Ρ': 'P', 'Τ': 'T', 'Υ': 'Y', 'Χ': 'X', 'α': 'a', 'ι': 'i', 'κ': 'k', 'ν': 'v',
+    'ο': 'o', 'ρ': 'p', 'τ': 't', 'υ': 'u', 'χ': 'x',
+    # Digits from other scripts that pass for letters or numbers
+    '৪': '8', '৭': 'q', '੧': 'q', 'ଃ': '8', '୨': '9',
+    # Punctuation
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-', '−': '-', '‘': "'", '’': "'",
+    '‚': ',', '‛': "'", '“': '"', '”': '"', '„': '"', '′': "'", '″': '"', '⁄': '/', '∕': '/',
+    '≤': '<=', '≥': '>=', '≠': '!=', '★': '*', '•': '*', '«': '"', '»': '"',
+}
+
+# Characters that separate words but draw nothing, and ones that aren't meant to be seen at all
+SPACES = '\u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u202f\u205f\u3000'
+INVISIBLE = '\u00ad\u034f\u180e\u2009\u200a\u200b\u200c\u200d\u2060\u2061\u2062\u2063\u2064\ufeff'
+
+# Combining diacritics (the blocks used to stack "Zalgo" text); marks of other scripts are kept
+DIACRITICS = ((0x300, 0x370), (0x1ab0, 0x1b00), (0x1dc0, 0x1e00), (0x20d0, 0x2100), (0xfe20, 0xfe30))
+
+
+def _fold_char(char):
+    '''
+    The ASCII a character decomposes to once accents are dropped, or None if it doesn't.
+    '''
+    if any(start <= ord(char) < end for start, end in DIACRITICS):
+        return ''
+    decomposed = ''.join(c for c in unicodedata.normalize('NFKD', char) if not unicodedata.combining(c))
+    if decomposed and decomposed.isascii() and decomposed.strip():
+        return decomposed
+    return None
+
+
+def _build_table():
+    table = {}
+    # Latin, Greek, punctuation, letterlike and enclosed symbols, ligatures, fullwidth forms,
+    # mathematical alphanumerics and the enclosed alphanumeric supplement
+    for start, end in ((0x80, 0x2c00), (0xa700, 0xa800), (0xfb00, 0xfb07), (0xfe30, 0xfe70),
+                       (0xff00, 0xfff0), (0x1d400, 0x1d800), (0x1f100, 0x1f1e6)):
+        for code in range(start, end):
+            folded = _fold_char(chr(code))
+            if folded is not None:
+                table[code] = folded
+    table.update((ord(char), folded) for char, folded in CONFUSABLES.items())
+    table.update((ord(char), ' ') for char in SPACES)
+    table.update((ord(char), '') for char in INVISIBLE)
+    return table
+
+
+TABLE = _build_table()
+
+
+@functools.lru_cache(maxsize=globals.NORMALIZE_CACHE_SIZE)
+def _fold(text):
+    return text.translate(TABLE)
+
+
+def fold(text):
+    '''
+    Returns text with look-alike characters replaced by ASCII (see the module docstring).
+    '''
+    if text.isascii():
+        return text
+    return _fold(text)
+
+
+def normalize_text(text):
+    '''
+    Folds case and collapses whitespace. Expects text that has already been through fold().
+    '''
+    return ' '.join(text.casefold().split())
+
+
+@functools.lru_cache(maxsize=globals.NORMALIZE_CACHE_SIZE)
+def content_hash(text):
+    '''
+    Stable hash of the normalized form of text, used as a compact key for caches.
+    '''
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def stats():
+    folds = _fold.cache_info()
+    hashes = content_hash.cache_info()
+    return {
+        'fold_hits': folds.hits,
+        'fold_misses': folds.misses,
+        'fold_cached': folds.currsize,
+        'hash_hits': hashes.hits,
+        'hash_misses': hashes.misses,
+        'hash_cached': hashes.currsize,
+    }
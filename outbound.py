@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+import globals
+from metrics import METRICS
+from ratelimit import TokenBucket
+
+logger = logging.getLogger('discord')
+
+# Discord rejects messages longer than this
+MAX_MESSAGE_LENGTH = 2000
+# Bulk delete takes between 2 and 100 messages
+MAX_BULK_DELETE = 100
+
+
+def _settle(future, error=None):
+    # Nothing to tell a caller that stopped waiting (its task was cancelled); the action was still carried out
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class OutboundScheduler:
+    '''
+    Path for the Discord API calls that carry out moderation actions. Each call waits on a local token bucket for its
+    route (the kind of call plus the channel or user it targets, as Discord buckets them) so bursts
+    are spread out before Discord answers with 429s. Independent calls for one decision run
+    concurrently through dispatch(). Mod channel notices that arrive within `digest_window` seconds
+    are merged into one digest message, and deletions in the same channel within `delete_window`
+    seconds go out as one bulk delete.
+    '''
+    def __init__(self, digest_window=globals.OUTBOUND_DIGEST_WINDOW, delete_window=globals.OUTBOUND_DELETE_WINDOW,
+                 route_limits=globals.OUTBOUND_ROUTE_LIMITS):
+        self.digest_window = digest_window
+        self.delete_window = delete_window
+        self.route_limits = route_limits
+        self.buckets = {} # Key: (route, channel or user id) Value: TokenBucket
+        self.digests = {} # Key: channel id Value: (channel, list of (text, future)) waiting for the next digest
+        self.deletes = {} # Key: channel id Value: (channel, list of (message id, future)) waiting for the next bulk delete
+        self.in_flight = 0
+        self.tasks = set() # Digests and deletions being sent
+
+        # Metrics, per route: [calls, total latency, max latency, errors]
+        self.routes = {}
+        self.digests_sent = 0
+        self.notices_merged = 0
+        self.bulk_deletes = 0
+
+    async def dispatch(self, *actions):
+        '''
+        Runs independent actions (coroutines) concurrently. Failures are logged rather than raised,
+        so one failed send doesn't stop the others.
+        '''
+        results = await asyncio.gather(*actions, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error('Outbound Discord action failed', exc_info=result)
+        return results
+
+    async def send(self, channel, text):
+        '''
+        Sends text to a channel right away (subject to its rate limit bucket) and returns the message.
+        '''
+        return await self._call('send', channel.id, lambda: channel.send(text))
+
+    async def send_dm(self, user, text):
+        return await self._call('dm', user.id, lambda: user.send(text))
+
+    async def add_reaction(self, message, emoji):
+        return await self._call('reaction', message.channel.id, lambda: message.add_reaction(emoji))
+
+    def notify(self, channel, text):
+        '''
+        Queues a notice for the next digest in channel. Returns a future that resolves once it is sent.
+        '''
+        future = asyncio.get_event_loop().create_future()
+        if channel.id not in self.digests:
+            self.digests[channel.id] = (channel, [])
+            asyncio.get_event_loop().call_later(self.digest_window, self._flush_digest, channel.id)
+        self.digests[channel.id][1].append((text, future))
+        return future
+
+    def delete(self, channel, message_id):
+        '''
+        Queues a message for deletion. Returns a future that resolves once it is gone.
+        '''
+        future = asyncio.get_event_loop().create_future()
+        if channel.id not in self.deletes:
+            self.deletes[channel.id] = (channel, [])
+            asyncio.get_event_loop().call_later(self.delete_window, self._flush_deletes, channel.id)
+        self.deletes[channel.id][1].append((message_id, future))
+        return future
+
+    async def close(self):
+        '''
+        Sends everything still waiting for its window.
+        '''
+        for channel_id in list(self.digests):
+            self._flush_digest(channel_id)
+        for channel_id in list(self.deletes):
+            self._flush_deletes(channel_id)
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+
+    def queue_depth(self):
+        return sum(len(pending) for _, pending in self.digests.values()) + \
+            sum(len(pending) for _, pending in self.deletes.values()) + self.in_flight
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'digests_sent': self.digests_sent,
+            'notices_merged': self.notices_merged,
+            'bulk_deletes': self.bulk_deletes,
+            'routes': {route: {
+                'calls': calls,
+                'avg_latency': total / calls if calls else 0.0,
+                'max_latency': max_latency,
+                'errors': errors,
+            } for route, (calls, total, max_latency, errors) in self.routes.items()},
+        }
+
+    def _bucket(self, route, major_id):
+        bucket = self.buckets.get((route, major_id))
+        if bucket is None:
+            rate, burst = self.route_limits[route]
+            bucket = self.buckets[(route, major_id)] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _call(self, route, major_id, request):
+        self.in_flight += 1
+        try:
+            await self._bucket(route, major_id).acquire()
+            start = time.monotonic()
+            try:
+                with METRICS.timer('discord_seconds', route=route):
+                    return await request()
+            except Exception:
+                self.routes.setdefault(route, [0, 0.0, 0.0, 0])[3] += 1
+                raise
+            finally:
+                latency = time.monotonic() - start
+                metrics = self.routes.setdefault(route, [0, 0.0, 0.0, 0])
+                metrics[0] += 1
+                metrics[1] += latency
+                metrics[2] = max(metrics[2], latency)
+        finally:
+            self.in_flight -= 1
+
+    def _start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _flush_digest(self, channel_id):
+        # Already flushed if close() got there first
+        if channel_id in self.digests:
+            channel, notices = self.digests.pop(channel_id)
+            self._start(self._send_digest(channel, notices))
+
+    async def _send_digest(self, channel, notices):
+        # Pack notices into as few messages as fit under Discord's length limit
+        chunks = []
+        for text, future in notices:
+            if chunks and len(chunks[-1][0]) + 1 + len(text) <= MAX_MESSAGE_LENGTH:
+                chunks[-1][0] += '\n' + text
+                chunks[-1][1].append(future)
+            else:
+                chunks.append([text, [future]])
+
+        self.notices_merged += len(notices)
+        for text, futures in chunks:
+            try:
+                await self.send(channel, text)
+            except Exception as e:
+                for future in futures:
+                    _settle(future, e)
+            else:
+                self.digests_sent += 1
+                for future in futures:
+                    _settle(future)
+
+    def _flush_deletes(self, channel_id):
+        if channel_id in self.deletes:
+            channel, pending = self.deletes.pop(channel_id)
+            self._start(self._delete_messages(channel, pending))
+
+    async def _delete_messages(self, channel, pending):
+        for i in range(0, len(pending), MAX_BULK_DELETE):
+            batch = pending[i:i + MAX_BULK_DELETE]
+            if len(batch) > 1:
+                messages = [discord.Object(message_id) for message_id, _ in batch]
+                try:
+                    await self._call('bulk_delete', channel.id, lambda: channel.delete_messages(messages))
+                except discord.errors.HTTPException:
+                    # Bulk delete refuses the whole batch if any message is too old; delete them one by one instead
+                    logger.warning(f'Bulk delete of {len(batch)} messages in channel {channel.id} failed, deleting individually')
+                else:
+                    self.bulk_deletes += 1
+                    for _, future in batch:
+                        _settle(future)
+                    continue
+
+            for message_id, future in batch:
+                try:
+                    await self._call('delete', channel.id, lambda: channel.get_partial_message(message_id).delete())
+                except discord.errors.NotFound:
+                    # Already gone, which is what we wanted
+                    _settle(future)
+                except Exception as e:
+                    _settle(future, e)
+                else:
+                    _settle(future)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import random
+
+import aiohttp
+
+import globals
+
+logger = logging.getLogger('discord')
+
+REQUESTED_ATTRIBUTES = ['SEVERE_TOXICITY', 'PROFANITY', 'IDENTITY_ATTACK', 'THREAT', 'TOXICITY', 'FLIRTATION']
+
+# Statuses worth trying again: rate limited or a transient server-side failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PerspectiveError(Exception):
+    pass
+
+
+class PerspectiveClient:
+    '''
+    Async Perspective API client. All requests share one keep-alive connection pool, at most
+    `max_concurrency` requests are in flight at once, and rate limits / server errors are retried
+    with exponential backoff. Point `url` at a local server to run against a stand-in Perspective.
+    Retries take a token from `limiter`, the token bucket the scoring queue paces first attempts
+    with, so a burst of 429s can't push requests past the QPS quota.
+    '''
+    def __init__(self, key, url=globals.PERSPECTIVE_URL, max_concurrency=globals.PERSPECTIVE_MAX_CONCURRENCY,
+                 timeout=globals.PERSPECTIVE_TIMEOUT, max_retries=globals.PERSPECTIVE_MAX_RETRIES,
+                 backoff=globals.PERSPECTIVE_BACKOFF, max_backoff=globals.PERSPECTIVE_MAX_BACKOFF, limiter=None):
+        self.key = key
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        self.session = None
+        self.semaphore = None
+
+    def _get_session(self):
+        # The session and semaphore have to be created inside the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def score(self, text):
+        '''
+        Forwards text to Perspective and returns a dictionary of attribute -> summary score.
+        '''
+        session = self._get_session()
+        data_dict = {
+            'comment': {'text': text},
+            'languages': ['en'],
+            'requestedAttributes': {attr: {} for attr in REQUESTED_ATTRIBUTES},
+            'doNotStore': True
+        }
+        params = {'key': self.key}
+
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.limiter is not None:
+                await self.limiter.acquire()
+            try:
+                async with self.semaphore:
+                    async with session.post(self.url, params=params, data=json.dumps(data_dict)) as response:
+                        if response.status == 200:
+                            response_dict = await response.json(content_type=None)
+                            break
+                        if response.status not in RETRY_STATUSES:
+                            raise PerspectiveError(f'Perspective returned {response.status}: {await response.text()}')
+                        retry_after = response.headers.get('Retry-After')
+                        error = PerspectiveError(f'Perspective returned {response.status}')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retry_after = None
+                error = e
+
+            if attempt == self.max_retries:
+                raise PerspectiveError(f'Perspective request failed after {attempt + 1} attempts') from error
+
+            # Honour Retry-After when the server gives one, otherwise back off exponentially with jitter
+            if retry_after is not None and retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+            delay = min(delay, self.max_backoff)
+            logger.warning(f'Perspective request failed ({error}), retrying in {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+        scores = {}
+        for attr in response_dict["attributeScores"]:
+            scores[attr] = response_dict["attributeScores"][attr]["summaryScore"]["value"]
+
+        return scores
@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    '''
+    Classic token bucket: holds up to `capacity` tokens and refills at `rate` tokens per second.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self, tokens=1):
+        '''
+        Takes `tokens` from the bucket if they are available. Returns whether it succeeded.
+        '''
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens=1):
+        '''
+        Waits until `tokens` are available, then takes them.
+        '''
+        while not self.try_acquire(tokens):
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
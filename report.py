@@ -17,7 +17,55 @@ class State(Enum):
     DESCRIPTION_COMPLETE = auto()
     SET_NUM_REVIEWERS = auto()
 
-INCOMPLETE_REPORTS = {}
+class UserRef:
+    '''
+    Compact, serializable reference to a Discord user. str() gives the name the Firebase functions use.
+    '''
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, str(user))
+
+    def __str__(self):
+        return self.name
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name}
+
+    @classmethod
+    def from_dict(cls, data):
+        return None if data is None else cls(data['id'], data['name'])
+
+# Reporting user for reports the bot files itself
+MODBOT = UserRef(None, 'ModBot')
+
+class MessageRef:
+    '''
+    Compact, serializable reference to a Discord message: where it is, who wrote it and what it said.
+    The bot fetches the real message only when it has to act on it.
+    '''
+    def __init__(self, guild_id, channel_id, message_id, author_id, author_name, content):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.guild.id if message.guild else None, message.channel.id, message.id,
+                   message.author.id, message.author.name, message.content)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        return None if data is None else cls(**data)
 
 class ReportDatabaseEntry:
     def __init__(self, reporting_user, reported_user=None, reported_message=None, reported_category=None, reported_subcategory=None, reported_description=None): 
@@ -29,6 +77,25 @@ class ReportDatabaseEntry:
         self.reported_description = reported_description
         self.report_id = None
 
+    def to_dict(self):
+        return {
+            'reporting_user': self.reporting_user.to_dict() if self.reporting_user else None,
+            'reported_user': self.reported_user.to_dict() if self.reported_user else None,
+            'reported_message': self.reported_message.to_dict() if self.reported_message else None,
+            'reported_category': self.reported_category,
+            'reported_subcategory': self.reported_subcategory,
+            'reported_description': self.reported_description,
+            'report_id': self.report_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        report = cls(UserRef.from_dict(data['reporting_user']), UserRef.from_dict(data['reported_user']),
+                     MessageRef.from_dict(data['reported_message']), data['reported_category'],
+                     data['reported_subcategory'], data['reported_description'])
+        report.report_id = data['report_id']
+        return report
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
@@ -38,6 +105,7 @@ class Report:
         self.state = State.REPORT_START
         self.client = client
         self.message = None
+        self.entry = None # The report being filled in
     
     async def handle_message(self, message):
         '''
@@ -47,13 +115,14 @@ class Report:
         '''
         if self.state == State.SET_NUM_REVIEWERS:
             if message.content in ["1", "2", "3", "4"]:
-                globals.NUM_REVIEWERS = (int)(message.content)
-                del INCOMPLETE_REPORTS[message.author]
+                # Kept in the ticket store, so every bot process uses it (see ModBot.required_reviewers)
+                await self.client.tickets.set_setting('num_reviewers', (int)(message.content))
+                self.entry = None
                 self.state = State.REPORT_COMPLETE
                 return [f'```Required reviewers set to {message.content}```'], None
     
         if message.content == self.CANCEL_KEYWORD:
-            del INCOMPLETE_REPORTS[message.author]
+            self.entry = None
             self.state = State.REPORT_COMPLETE
             return ["Report cancelled."], None
         
@@ -62,7 +131,7 @@ class Report:
             reply += "Say `help` at any time for more information.\n\n"
             reply += "Please copy paste the link to the message you want to report.\n"
             reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
-            INCOMPLETE_REPORTS[message.author] = ReportDatabaseEntry(message.author)
+            self.entry = ReportDatabaseEntry(UserRef.from_user(message.author))
             self.state = State.AWAITING_MESSAGE
             return [reply], None
         
@@ -76,20 +145,29 @@ class Report:
             if not m:
                 return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."], None
             guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."], None
-            channel = guild.get_channel(int(m.group(2)))
+            if guild:
+                channel = guild.get_channel(int(m.group(2)))
+            else:
+                # DMs all arrive at the process running shard 0, so guilds on other shards aren't cached here; ask Discord
+                try:
+                    channel = await self.client.fetch_channel(int(m.group(2)))
+                except discord.errors.Forbidden:
+                    return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."], None
+                except discord.errors.NotFound:
+                    channel = None
+                if channel is not None and getattr(getattr(channel, 'guild', None), 'id', None) != int(m.group(1)):
+                    channel = None
             if not channel:
                 return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."], None
             try:
-                reported_message = await channel.fetch_message(int(m.group(3)))
+                reported_message = await self.client.get_message(channel, int(m.group(3)))
             except discord.errors.NotFound:
                 return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."], None
 
             # Here we've found the message - it's up to you to decide what to do next!
             self.state = State.MESSAGE_IDENTIFIED
-            INCOMPLETE_REPORTS[message.author].reported_user = reported_message.author
-            INCOMPLETE_REPORTS[message.author].reported_message = reported_message
+            self.entry.reported_user = UserRef.from_user(reported_message.author)
+            self.entry.reported_message = MessageRef.from_message(reported_message)
             return ["I found this message:", "```" + reported_message.author.name + ": " + reported_message.content + "```", \
                     "Please tell us more about why you're reporting this post.\n 1) I'm not interested in this post.\n 2) It's fake, spam, or fraudulent.\n 3) It's offensive, harmful, or abusive.\n 4) Another reason."], None
         
@@ -98,7 +176,7 @@ class Report:
             validReply = False
 
             if message.content in ["1", "2", "3", "4"]:
-                INCOMPLETE_REPORTS[message.author].reported_category = message.content
+                self.entry.reported_category = message.content
                 validReply = True
 
             if message.content == "1":
@@ -121,24 +199,24 @@ class Report:
 
         if self.state == State.FAKE_SPAM_FRAUD:
             if message.content in ["1", "2", "3", "4"]:
-                INCOMPLETE_REPORTS[message.author].reported_category += "," + message.content
+                self.entry.reported_category += "," + message.content
                 self.state = State.CATEGORY_COMPLETE
                 return ["Alright! Final (optional) step, please share any relevant additional information or type 'skip'and press enter."], None
 
         if self.state == State.OFFENSIVE_HARMFUL_ABUSIVE:
             if message.content in ["1", "2", "3", "4", "5"]:
-                INCOMPLETE_REPORTS[message.author].reported_category += "," + message.content
+                self.entry.reported_category += "," + message.content
                 self.state = State.CATEGORY_COMPLETE
                 return ["Alright! Final (optional) step, please share any relevant additional information or type 'skip'and press enter."], None
         
         if self.state == State.OTHER_REASON:
-            INCOMPLETE_REPORTS[message.author].reported_category = "3"
-            INCOMPLETE_REPORTS[message.author].reported_subcategory = message.content
+            self.entry.reported_category = "3"
+            self.entry.reported_subcategory = message.content
             self.state = State.CATEGORY_COMPLETE
             return ["Alright! Final (optional) step, please share any relevant additional information or type 'skip'and press enter."], None
 
         if self.state == State.CATEGORY_COMPLETE:
-            report = INCOMPLETE_REPORTS[message.author]
+            report = self.entry
             if message.content != "skip":
                 report.reported_description = message.content
             self.state = State.DESCRIPTION_COMPLETE
@@ -163,20 +241,27 @@ class Report:
             reply += "We recommend you also review Discord's privacy settings at https://support.discord.com/hc/en-us/articles/217916488-Blocking-Privacy-Settings-"
             reply += "which enable you to block users and prevent unknown server members from direct messaging you."
 
-            del INCOMPLETE_REPORTS[message.author]
+            self.entry = None
 
             self.state = State.REPORT_COMPLETE
 
-            # send report to firebase
-            report_id = add_report(str(report.reported_message.content), str(report.reported_user), str(report.reporting_user))
-            report.report_id = report_id
-
+            # The bot files it (see ModBot.open_ticket), merging it with other reports of the same message
             return [reply], report
 
         return []
 
     def report_complete(self):
         return self.state == State.REPORT_COMPLETE
+
+    def to_dict(self):
+        return {'state': self.state.name, 'entry': self.entry.to_dict() if self.entry else None}
+
+    @classmethod
+    def from_dict(cls, client, data):
+        report = cls(client)
+        report.state = State[data['state']]
+        report.entry = ReportDatabaseEntry.from_dict(data['entry']) if data['entry'] else None
+        return report
     
 
 
@@ -0,0 +1,94 @@
+import csv
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a click came from and never change the article
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'yclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid', '_ga', 'ref', 'ref_src', 'cmpid', 'smid'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    '''
+    Normalizes a link so that trivially different forms of the same article share one cache key:
+    lowercases scheme and host, drops default ports, fragments and tracking parameters, and sorts the query.
+    '''
+    parts = urlsplit(url.strip().rstrip('.,;:!?)\'"'))
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host += f':{parts.port}'
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS]
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(sorted(query)), ''))
+
+
+def domain_of(url):
+    host = (urlsplit(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class DomainReputation:
+    '''
+    Per-domain tally of past fake news verdicts. Once a domain has at least `min_samples` verdicts and
+    at least `ratio` of them agree, links to it are decided without downloading the article.
+    '''
+    def __init__(self, min_samples, ratio):
+        self.min_samples = min_samples
+        self.ratio = ratio
+        self.counts = {} # Key: domain Value: [fake verdicts, real verdicts]
+        self.learned = {} # Same, for the verdicts save() writes: everything but a read-only pre-warm file
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, domain, is_fake):
+        for index in (self.counts, self.learned):
+            counts = index.setdefault(domain, [0, 0])
+            counts[0 if is_fake else 1] += 1
+
+    def verdict(self, domain):
+        '''
+        Returns True/False for known-bad/known-good domains, or None if the domain has to be checked.
+        '''
+        fake, real = self.counts.get(domain, (0, 0))
+        total = fake + real
+        if total >= self.min_samples:
+            if fake / total >= self.ratio:
+                self.hits += 1
+                return True
+            if real / total >= self.ratio:
+                self.hits += 1
+                return False
+        self.misses += 1
+        return None
+
+    def load(self, path, learned=True):
+        '''
+        Pre-warms the index from a CSV of `domain,fake,real` rows, e.g. a curated list or a previous save().
+        Rows loaded with learned=False count towards verdicts but aren't written back by save().
+        '''
+        if not os.path.isfile(path):
+            return
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) != 3 or not row[1].isdigit() or not row[2].isdigit():
+                    continue
+                for index in (self.counts, self.learned) if learned else (self.counts,):
+                    counts = index.setdefault(row[0].lower(), [0, 0])
+                    counts[0] += int(row[1])
+                    counts[1] += int(row[2])
+
+    def save(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            for domain, (fake, real) in sorted(self.learned.items()):
+                writer.writerow([domain, fake, real])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'domains': len(self.counts),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,7 +1,8 @@
 from enum import Enum, auto
-import discord
 import re
 import globals
+from outbound import MAX_MESSAGE_LENGTH
+from spamwave import signature, similarity
 
 class State(Enum):
     REVIEW_START = auto()
@@ -49,11 +50,7 @@ class Review:
                 return [reply]
             elif message.content == "n":
                 reply = "Review complete. Message marked as a non-violation."
-                # First review
-                if case_id not in globals.REVIEWS_DATABASE:
-                    globals.REVIEWS_DATABASE[case_id] = [99]
-                else:
-                    globals.REVIEWS_DATABASE[case_id].append(99)
+                await self.client.tickets.add_review(case_id, reviewer_id, 99)
                 self.state = State.REVIEW_COMPLETE
             return [reply]
 
@@ -62,8 +59,10 @@ class Review:
                 cat_codes = message.content.split(",")
                 if cat_codes[0] is not None and cat_codes[1] is not None:
                     if cat_codes[0] in ["1", "2"] and cat_codes[1] in ["1", "2", "3", "4", "5"]:
-                        globals.REPORTS_DATABASE[(int)(case_id)].reported_category = cat_codes[0]
-                        globals.REPORTS_DATABASE[(int)(case_id)].reported_subcategory = cat_codes[1]
+                        report = await self.client.tickets.get_report(case_id)
+                        report.reported_category = cat_codes[0]
+                        report.reported_subcategory = cat_codes[1]
+                        await self.client.tickets.update_report(case_id, report)
                         message.content = "y"
 
             if message.content == "n" or (self.state == State.CONFIRM_CATEGORY_CUSTOM and message.content == "s"):
@@ -86,7 +85,7 @@ class Review:
                 reply += "Enter the correct category number followed immediately by the subcategory number. i.e. '1,1' or '2,3'"
                 return [reply]
             elif message.content == "y":
-                report = globals.REPORTS_DATABASE[(int)(case_id)]
+                report = await self.client.tickets.get_report(case_id)
                 reply = f'```SNIPPET FROM ATTORNEY-APPROVED OFFICIAL CONTENT POLICY REGARDING: {globals.get_catStr(report)}```\n'
                 if (report.reported_description != None):
                     reply += f'The victim provided the following additional information: ```{report.reported_description}```\n'
@@ -104,10 +103,7 @@ class Review:
                 else:
                     code = 99
 
-                if case_id not in globals.REVIEWS_DATABASE:
-                    globals.REVIEWS_DATABASE[case_id] = [code]
-                else:
-                    globals.REVIEWS_DATABASE[case_id].append(code)
+                await self.client.tickets.add_review(case_id, reviewer_id, code)
 
                 self.state = State.REVIEW_COMPLETE
             return ["Thank you. This review is complete."]
@@ -116,5 +112,161 @@ class Review:
 
     def review_complete(self):
         return self.state == State.REVIEW_COMPLETE
-    
 
+    def to_dict(self):
+        return {'state': self.state.name}
+
+    @classmethod
+    def from_dict(cls, client, data):
+        review = cls(client)
+        review.state = State[data['state']]
+        return review
+
+
+class BulkReview:
+    '''
+    A page of open tickets reviewed with one batched verdict such as `1-5:10, 6:99`. Tickets are
+    grouped by category and by how alike their messages are, so similar reports get consecutive
+    numbers and one range covers them. Tickets aren't leased while they are on the page; each review
+    is only recorded if the moderator could still claim the ticket when the verdict comes in.
+    '''
+    START_PATTERN = re.compile(r'^!bulk(?:\s+(\d+))?$')
+    CANCEL_KEYWORD = "cancel"
+    VERDICT_PATTERN = re.compile(r'^(\d+)(?:-(\d+))?:(\w+)$')
+    # 'y' stands for the violation code of the reported category, as the one-ticket review assigns it
+    VIOLATION_CODES = {"1": 10, "2": 20}
+    DECISION_CODES = {10, 20, 99}
+
+    def __init__(self, client):
+        self.state = State.REVIEW_START
+        self.client = client
+        self.page = [] # List of (ticket_id, reported category); number i on the page is page[i - 1]
+
+    async def start(self, reviewer_id, size):
+        '''
+        Fills the page with up to `size` tickets and returns the messages showing it, or an empty
+        list if there is nothing the reviewer can take.
+        '''
+        tickets = self.client.tickets
+        length = globals.SPAMWAVE_BANDS * globals.SPAMWAVE_ROWS
+        groups = [] # List of (category, signature of the first message, list of (ticket_id, report)), most urgent first
+        for ticket_id in await tickets.reviewable_tickets(reviewer_id, globals.NUM_REVIEWERS, globals.BULK_REVIEW_POOL):
+            report = await tickets.get_report(ticket_id)
+            category = globals.get_catStr(report)
+            ticket_signature = signature(report.reported_message.content or '', length)
+            for group_category, group_signature, members in groups:
+                if group_category == category and similarity(ticket_signature, group_signature) >= globals.SPAMWAVE_SIMILARITY:
+                    members.append((ticket_id, report))
+                    break
+            else:
+                groups.append((category, ticket_signature, [(ticket_id, report)]))
+
+        lines = []
+        for category, _, members in groups:
+            if len(self.page) >= size:
+                break
+            lines.append(f'-- {category} ({len(members)}) --')
+            for ticket_id, report in members[:size - len(self.page)]:
+                self.page.append((ticket_id, report.reported_category))
+                snippet = ' '.join(str(report.reported_message.content).split()).replace('`', "'")
+                if len(snippet) > globals.BULK_REVIEW_SNIPPET:
+                    snippet = snippet[:globals.BULK_REVIEW_SNIPPET - 3] + '...'
+                line = f'{len(self.page):>2}. #{ticket_id} {report.reported_user}: {snippet}'
+                reporters = len(await tickets.get_ticket_reports(ticket_id))
+                if reporters > 1:
+                    line += f' [{reporters} reporters]'
+                lines.append(line)
+        if not self.page:
+            return []
+
+        # The page is split into code blocks that each fit in one Discord message
+        replies = [f'Bulk review of {len(self.page)} tickets:']
+        block = ''
+        for line in lines:
+            if block and len(block) + len(line) + 7 > MAX_MESSAGE_LENGTH:
+                replies.append(f'```{block}```')
+                block = ''
+            block += line + '\n'
+        replies.append(f'```{block}```')
+        replies.append("Reply with a decision code for each number or range, e.g. `1-5:10, 6:99`. Codes: 10 delete, 20 kick and delete, "
+                       "99 not a violation; 'y' means the reported category's violation code and 'n' means 99. Numbers left out are skipped. "
+                       "Enter 'cancel' to leave bulk review.")
+        return replies
+
+    def decision_code(self, verdict, category):
+        if verdict == "n":
+            return 99
+        if verdict == "y":
+            return self.VIOLATION_CODES.get(category)
+        if verdict.isdigit() and int(verdict) in self.DECISION_CODES:
+            return int(verdict)
+        return None
+
+    def parse(self, text):
+        '''
+        Parses a batched verdict. Returns a dict from ticket id to decision code, and a list of errors.
+        '''
+        verdicts = {}
+        errors = []
+        for part in text.replace(' ', '').split(','):
+            if not part:
+                continue
+            match = self.VERDICT_PATTERN.match(part)
+            if match is None:
+                errors.append(f"'{part}' should look like '3:10' or '1-5:99'")
+                continue
+            first = int(match.group(1))
+            last = int(match.group(2) or first)
+            if not 1 <= first <= last <= len(self.page):
+                errors.append(f"'{part}' is not a range within 1-{len(self.page)}")
+                continue
+            for ticket_id, category in self.page[first - 1:last]:
+                code = self.decision_code(match.group(3).lower(), category)
+                if code is None:
+                    errors.append(f"'{match.group(3)}' is not a decision code for Ticket #{ticket_id}")
+                    break
+                verdicts[ticket_id] = code
+        return verdicts, errors
+
+    async def review_page(self, message, reviewer_id):
+        '''
+        Handles the moderator's reply to the page. Returns the replies to send and the ids of the
+        tickets that got a review.
+        '''
+        if message.content == self.CANCEL_KEYWORD:
+            self.state = State.REVIEW_COMPLETE
+            return ["Bulk review cancelled."], []
+
+        # Nothing is recorded unless the whole verdict parses, so a typo can't apply half of it
+        verdicts, errors = self.parse(message.content)
+        if errors or not verdicts:
+            reply = "Nothing was recorded. " + " ".join(errors)
+            reply += "\nEnter verdicts such as `1-5:10, 6:99`, or 'cancel'."
+            return [reply], []
+
+        reviewed = []
+        skipped = []
+        for ticket_id, code in verdicts.items():
+            if await self.client.tickets.submit_review(ticket_id, reviewer_id, code, globals.NUM_REVIEWERS):
+                reviewed.append(ticket_id)
+            else:
+                skipped.append(ticket_id)
+
+        reply = f"Thank you. Recorded {len(reviewed)} reviews."
+        if skipped:
+            reply += " Already decided or fully reviewed by others: " + ", ".join(f"#{ticket_id}" for ticket_id in skipped) + "."
+        self.state = State.REVIEW_COMPLETE
+        return [reply], reviewed
+
+    def review_complete(self):
+        return self.state == State.REVIEW_COMPLETE
+
+    def to_dict(self):
+        return {'state': self.state.name, 'page': self.page}
+
+    @classmethod
+    def from_dict(cls, client, data):
+        bulk = cls(client)
+        bulk.state = State[data['state']]
+        bulk.page = [tuple(entry) for entry in data['page']]
+        return bulk
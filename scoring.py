@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import globals
+from ratelimit import TokenBucket
+
+
+class ScoringQueue:
+    '''
+    Pipeline stage in front of the Perspective client. Messages are queued and flushed as a batch
+    once `batch_size` messages are waiting or the oldest one has waited `deadline` seconds. A batch
+    is scored concurrently, paced by a token bucket sized to the Perspective QPS quota, and each
+    caller's future is resolved with its own scores. Identical texts within a batch share one request.
+    Pass `limiter` to share the token bucket with the scorer's retries (see PerspectiveClient).
+    '''
+    def __init__(self, scorer, batch_size=globals.SCORING_BATCH_SIZE, deadline=globals.SCORING_BATCH_DEADLINE,
+                 qps=globals.PERSPECTIVE_QPS, burst=globals.PERSPECTIVE_BURST, limiter=None):
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.deadline = deadline
+        self.limiter = limiter if limiter is not None else TokenBucket(qps, burst)
+        self.pending = [] # List of (text, future) waiting for the next flush
+        self.in_flight = 0
+        self.timer = None
+
+        # Metrics
+        self.flushes = 0
+        self.messages_scored = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    async def score(self, text):
+        '''
+        Queues text for scoring and waits for its dictionary of scores.
+        '''
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.deadline, self._flush)
+
+        return await future
+
+    def queue_depth(self):
+        return len(self.pending) + self.in_flight
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'flushes': self.flushes,
+            'messages_scored': self.messages_scored,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        self.in_flight += len(batch)
+        asyncio.ensure_future(self._score_batch(batch))
+
+    async def _score_batch(self, batch):
+        start = time.monotonic()
+
+        # Group futures by text so duplicate messages in a batch cost a single request
+        by_text = {}
+        for text, future in batch:
+            by_text.setdefault(text, []).append(future)
+
+        async def score_one(text, futures):
+            await self.limiter.acquire()
+            try:
+                scores = await self.scorer(text)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(dict(scores))
+
+        try:
+            await asyncio.gather(*(score_one(text, futures) for text, futures in by_text.items()))
+        finally:
+            self.in_flight -= len(batch)
+
+        latency = time.monotonic() - start
+        self.flushes += 1
+        self.messages_scored += len(batch)
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
@@ -0,0 +1,86 @@
+'''
+Runs the bot as several processes, each owning a contiguous range of gateway shards.
+
+All processes share the ticket store (tickets.sqlite3) for ticket numbering, reviewer claims and
+report/review conversation state, and send CPU-bound model work to one shared model pool served
+from this launcher process (see workerpool.py).
+
+    python shards.py <processes> [total shards]
+
+The total shard count defaults to the number of processes.
+'''
+import multiprocessing
+import os
+import sys
+
+import globals
+
+MODEL_POOL_ADDRESS = ('127.0.0.1', 50152)
+
+
+def shard_ranges(shard_count, processes):
+    '''
+    Splits shard ids 0..shard_count-1 into `processes` contiguous, near-equal ranges.
+    '''
+    per_process, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + per_process + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def start_model_pool(authkey):
+    '''
+    Starts the shared model pool in its own process. It is not a daemon, because the pool starts
+    worker processes of its own; stop it with stop_model_pool().
+    '''
+    import workerpool
+
+    pool = multiprocessing.Process(target=workerpool.serve, args=(MODEL_POOL_ADDRESS, authkey, globals.MODEL_POOL_WORKERS),
+                                   name='model-pool')
+    pool.start()
+    return pool
+
+
+def stop_model_pool(pool):
+    pool.terminate()
+    pool.join()
+
+
+def run_shard(shard_ids, shard_count, authkey):
+    import bot
+    from workerpool import RemoteExecutor
+
+    bot.main(shard_ids, shard_count, RemoteExecutor(MODEL_POOL_ADDRESS, authkey))
+
+
+def main(processes, shard_count):
+    authkey = os.urandom(16)
+    pool = start_model_pool(authkey)
+    try:
+        workers = []
+        for shard_ids in shard_ranges(shard_count, processes):
+            worker = multiprocessing.Process(target=run_shard, args=(shard_ids, shard_count, authkey),
+                                             name=f'shards-{shard_ids[0]}-{shard_ids[-1]}')
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+    finally:
+        stop_model_pool(pool)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+    processes = int(sys.argv[1])
+    shard_count = int(sys.argv[2]) if len(sys.argv) == 3 else processes
+    if shard_count < processes:
+        print('Need at least one shard per process')
+        sys.exit(1)
+    main(processes, shard_count)
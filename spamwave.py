@@ -0,0 +1,272 @@
+'''
+Near-duplicate detection for spam waves.
+
+Coordinated raids post slightly varied copies of one message, and each copy used to be scored,
+link-checked and ticketed on its own. Every channel message now gets a MinHash signature of its
+character shingles, and a message whose estimated Jaccard similarity to a recent message is at
+least SPAMWAVE_SIMILARITY joins that message's cluster. A cluster shares one verdict (its first
+message is scored and the rest wait for that result), one fake news check per link, one ticket,
+and one decision: once a moderator deletes the ticketed message, the rest of the wave goes too,
+including copies posted afterwards (each deletion is reported to the mod channel).
+
+Signatures use one-permutation hashing (each shingle is hashed once into one of the signature's
+slots, and empty slots borrow from the next full one), so computing one is a single pass over the
+shingles. Lookups use locality-sensitive hashing: the signature is cut into SPAMWAVE_BANDS bands
+of SPAMWAVE_ROWS slots, and only clusters sharing a band with the message are compared. Clusters
+are kept for SPAMWAVE_WINDOW seconds after their last message, SPAMWAVE_MAX_CLUSTERS of them at
+most, with up to SPAMWAVE_MAX_MEMBERS messages each. Signatures use Python's string hash, so
+they are only comparable within one process.
+'''
+import asyncio
+import itertools
+import re
+import time
+from array import array
+from collections import OrderedDict
+
+import globals
+from cache import LRUCache
+from fakenews import LINK_PATTERN
+from normalize import normalize_text
+from reputation import domain_of
+
+SHINGLE_LENGTH = 4
+# Mentions, digits and punctuation are what raids vary between copies
+NOISE_PATTERN = re.compile(r'<[@#][!&]?\d+>|[^a-z ]+')
+HASH_MASK = (1 << 64) - 1
+SLOT_MASK = (1 << 32) - 1
+
+
+def shingles(text):
+    '''
+    Character shingles of text's normalized form, with links reduced to their domain.
+    '''
+    text = LINK_PATTERN.sub(lambda match: f' {domain_of(match.group())} ', normalize_text(text))
+    text = ' '.join(NOISE_PATTERN.sub(' ', text).split())
+    return {text[i:i + SHINGLE_LENGTH] for i in range(max(1, len(text) - SHINGLE_LENGTH + 1))}
+
+
+def signature(text, length):
+    '''
+    MinHash signature of text's shingles: an array of `length` 32-bit slots.
+    '''
+    slots = [None] * length
+    for shingle in shingles(text):
+        value, slot = divmod(hash(shingle) & HASH_MASK, length)
+        if slots[slot] is None or value < slots[slot]:
+            slots[slot] = value
+
+    signature = array('I', [0] * length)
+    for i in range(length):
+        # An empty slot takes the next full slot's value, mixed with how far it had to look
+        for offset in range(length):
+            value = slots[(i + offset) % length]
+            if value is not None:
+                signature[i] = (value + offset * 0x9e3779b1) & SLOT_MASK
+                break
+    return signature
+
+
+def similarity(a, b):
+    '''
+    Estimated Jaccard similarity of the shingles behind two signatures.
+    '''
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class Cluster:
+    '''
+    Near-duplicate messages seen within the window: signatures of the first few, where they were
+    posted, the shared verdict, the links already checked and the ticket opened for them, if any.
+    '''
+    def __init__(self, id, now, max_members):
+        self.id = id
+        self.signatures = []
+        self.first_seen = now
+        self.last_seen = now
+        self.size = 0
+        self.members = [] # List of (channel, message id), the first max_members messages
+        self.max_members = max_members
+        self.scores = None # Future with the first message's scores
+        self.links = set() # Canonical links already checked for fake news
+        self.checking = set() # Canonical links a check is running for
+        self.acted = False
+        self.ticket_id = None
+        self.ticket_message_id = None
+        self.removed = False
+
+    def add(self, channel, message_id, now):
+        self.size += 1
+        self.last_seen = now
+        if len(self.members) < self.max_members:
+            self.members.append((channel, message_id))
+
+    def is_wave(self):
+        return self.size > 1
+
+
+class SpamWaveDetector:
+    def __init__(self, window=globals.SPAMWAVE_WINDOW, threshold=globals.SPAMWAVE_SIMILARITY,
+                 bands=globals.SPAMWAVE_BANDS, rows=globals.SPAMWAVE_ROWS, min_length=globals.SPAMWAVE_MIN_LENGTH,
+                 max_clusters=globals.SPAMWAVE_MAX_CLUSTERS, max_members=globals.SPAMWAVE_MAX_MEMBERS,
+                 representatives=globals.SPAMWAVE_REPRESENTATIVES, ticket_clusters=globals.SPAMWAVE_TICKET_CLUSTERS):
+        self.window = window
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.min_length = min_length
+        self.max_clusters = max_clusters
+        self.max_members = max_members
+        self.representatives = representatives
+        self.clusters = OrderedDict() # Key: cluster id Value: Cluster, least recently joined first
+        self.index = {} # Key: hash of (band number, band slots) Value: id of the latest cluster with that band
+        self.tickets = LRUCache(ticket_clusters) # Key: ticket id Value: Cluster, kept after it leaves the window
+        self.ids = itertools.count()
+
+        # Metrics
+        self.messages = 0
+        self.joined = 0
+        self.verdicts_reused = 0
+        self.actions_merged = 0
+        self.removed_after_decision = 0
+
+    def _band_keys(self, signature):
+        return [hash((band, signature[band * self.rows:(band + 1) * self.rows].tobytes())) for band in range(self.bands)]
+
+    def _expire(self, now):
+        while self.clusters:
+            cluster = next(iter(self.clusters.values()))
+            if cluster.last_seen >= now - self.window and len(self.clusters) <= self.max_clusters:
+                break
+            del self.clusters[cluster.id]
+            for cluster_signature in cluster.signatures:
+                for key in self._band_keys(cluster_signature):
+                    if self.index.get(key) == cluster.id:
+                        del self.index[key]
+
+    def add(self, message, now=None):
+        '''
+        Adds a channel message to the cluster of its closest recent duplicate, or to a new cluster.
+        Returns the cluster, or None for messages too short to tell apart from ordinary chat.
+        '''
+        if len(message.content) < self.min_length:
+            return None
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        self.messages += 1
+
+        message_signature = signature(message.content, self.bands * self.rows)
+        keys = self._band_keys(message_signature)
+        best = None
+        for cluster_id in {self.index.get(key) for key in keys}:
+            cluster = self.clusters.get(cluster_id)
+            if cluster is None:
+                continue
+            score = max(similarity(message_signature, other) for other in cluster.signatures)
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, cluster)
+
+        if best is not None:
+            cluster = best[1]
+            self.joined += 1
+            self.clusters.move_to_end(cluster.id)
+        else:
+            cluster = Cluster(next(self.ids), now, self.max_members)
+            self.clusters[cluster.id] = cluster
+
+        # The first few messages of a cluster all represent it, so copies that drift from the
+        # first one still find their wave
+        if len(cluster.signatures) < self.representatives:
+            cluster.signatures.append(message_signature)
+            for key in keys:
+                self.index[key] = cluster.id
+        cluster.add(message.channel, message.id, now)
+        return cluster
+
+    async def verdict(self, cluster, evaluate):
+        '''
+        Returns the cluster's scores. The first message of a cluster runs evaluate(); later ones wait
+        for its result, and only evaluate themselves if that failed.
+        '''
+        pending = cluster.scores
+        if pending is not None:
+            try:
+                scores = await asyncio.shield(pending)
+                self.verdicts_reused += 1
+                return scores
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            except Exception:
+                pass
+
+        future = cluster.scores = asyncio.get_event_loop().create_future()
+        try:
+            scores = await evaluate()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Nobody may be waiting; mark it retrieved
+            raise
+        future.set_result(scores)
+        return scores
+
+    def unchecked_links(self, cluster, links):
+        '''
+        Returns the links no other message of the cluster has had checked or is having checked, and
+        marks them as being checked. Call links_checked once the check is over.
+        '''
+        links = set(links) - cluster.links - cluster.checking
+        cluster.checking |= links
+        return links
+
+    def links_checked(self, cluster, links, checked):
+        '''
+        Ends the check of `links`. Only those in `checked` got a verdict; the rest (fetch errors,
+        deadline, a failed check) are checked again for the next copy that links them.
+        '''
+        cluster.checking -= set(links)
+        cluster.links |= set(checked) & set(links)
+
+    def claim_action(self, cluster):
+        '''
+        True for the first message of a cluster to be deleted or reported. Later ones are covered by
+        its mod channel notice and ticket.
+        '''
+        if cluster.acted:
+            self.actions_merged += 1
+            return False
+        cluster.acted = True
+        return True
+
+    def set_ticket(self, cluster, ticket_id, message_id):
+        cluster.ticket_id = ticket_id
+        cluster.ticket_message_id = message_id
+        self.tickets.put(ticket_id, cluster)
+
+    def remove(self, ticket_id):
+        '''
+        Marks the wave a ticket was opened for as removed, so copies posted later are deleted on
+        sight, and returns the (channel, message id) of its other messages.
+        '''
+        cluster = self.tickets.get(ticket_id)
+        if cluster is None:
+            return []
+        cluster.removed = True
+        members = [(channel, message_id) for channel, message_id in cluster.members
+                   if message_id != cluster.ticket_message_id]
+        self.removed_after_decision += len(members)
+        return members
+
+    def stats(self):
+        return {
+            'messages': self.messages,
+            'joined': self.joined,
+            'clusters': len(self.clusters),
+            'waves': sum(1 for cluster in self.clusters.values() if cluster.is_wave()),
+            'verdicts_reused': self.verdicts_reused,
+            'actions_merged': self.actions_merged,
+            'removed_after_decision': self.removed_after_decision,
+        }
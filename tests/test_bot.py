@@ -0,0 +1,58 @@
+import asyncio
+
+import globals
+import model.abridged
+from bot import ModBot, shard_path
+from report import MessageRef, ReportDatabaseEntry, UserRef
+
+
+def test_modbot_constructs(tmp_path, monkeypatch):
+    monkeypatch.setattr(globals, 'TICKET_STORE_PATH', str(tmp_path / 'tickets.sqlite3'))
+    monkeypatch.setattr(globals, 'SCORE_CACHE_PATH', str(tmp_path / 'score_cache.sqlite3'))
+    monkeypatch.setattr(globals, 'DOMAIN_REPUTATION_PATH', str(tmp_path / 'domain_reputation.csv'))
+    monkeypatch.setattr(model.abridged, 'FIRESTORE_JOURNAL', None)
+
+    bot = ModBot('key')
+    try:
+        assert bot.user_registry is not None
+        assert asyncio.run(bot.tickets.backlog_stats())['open'] == 0
+    finally:
+        bot.close_stores()
+        bot.prefilter.close()
+        bot.fake_news.executor.shutdown()
+
+
+def test_shard_path():
+    assert shard_path('firestore_journal.jsonl', None) == 'firestore_journal.jsonl'
+    assert shard_path('firestore_journal.jsonl', [4, 5]) == 'firestore_journal-4.jsonl'
+
+
+def test_jobs_for_guilds_on_other_shards_are_handed_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(globals, 'TICKET_STORE_PATH', str(tmp_path / 'tickets.sqlite3'))
+    monkeypatch.setattr(globals, 'SCORE_CACHE_PATH', str(tmp_path / 'score_cache.sqlite3'))
+    monkeypatch.setattr(globals, 'DOMAIN_REPUTATION_PATH', str(tmp_path / 'domain_reputation.csv'))
+    monkeypatch.setattr(model.abridged, 'FIRESTORE_JOURNAL', None)
+    mine, theirs = (7 << 22) | 1, (6 << 22) | 1
+
+    # discord.py's client takes the current event loop
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    bot = ModBot('key', shard_ids=[1, 3], shard_count=4)
+    try:
+        assert bot.owns_guild(mine) and not bot.owns_guild(theirs)
+        report = ReportDatabaseEntry(UserRef(1, 'reporter'), UserRef(2, 'author'), MessageRef(theirs, 5, 6, 2, 'author', 'hi'), '1', '1', None)
+
+        async def hand_off():
+            ticket_id = await bot.tickets.create_ticket(report)
+            await bot.in_guild(report, 'decide', ticket_id)
+            await bot.tickets.set_setting('num_reviewers', 2)
+            return ticket_id, await bot.tickets.take_guild_jobs({theirs}), await bot.required_reviewers()
+
+        ticket_id, jobs, required = bot.loop.run_until_complete(hand_off())
+        assert jobs == [('decide', ticket_id)]
+        assert required == 2
+    finally:
+        bot.close_stores()
+        bot.prefilter.close()
+        bot.fake_news.executor.shutdown()
+        bot.loop.close()
+        asyncio.set_event_loop(None)
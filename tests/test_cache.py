@@ -0,0 +1,33 @@
+import sqlite3
+
+from cache import ScoreCache
+
+
+def rows(path):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_score_cache_batches_disk_writes(tmp_path):
+    path = str(tmp_path / 'score_cache.sqlite3')
+    cache = ScoreCache(1, ttl=60, path=path, flush_size=3, flush_interval=3600)
+    cache.put('a', {'TOXICITY': 0.1})
+    cache.put('b', {'TOXICITY': 0.2})
+    assert rows(path) == 0
+    # Evicted from memory before it was written
+    assert cache.get('a') == {'TOXICITY': 0.1}
+
+    cache.put('c', {'TOXICITY': 0.3})
+    assert rows(path) == 3
+    cache.put('d', {'TOXICITY': 0.4})
+    cache.close()
+    assert rows(path) == 4
+
+    reopened = ScoreCache(1, ttl=60, path=path)
+    try:
+        assert reopened.get('b') == {'TOXICITY': 0.2}
+    finally:
+        reopened.close()
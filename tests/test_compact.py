@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('joblib')
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from model.compact import CompactModel, export_artifact
+
+FAKE = [
+    'SHOCKING: doctors hate this one weird trick, the government is hiding the cure',
+    'BREAKING secret memo proves the moon landing was staged, share before it is deleted',
+    'Celebrity clone replaced the president last week, insiders reveal the shocking truth',
+    'They do not want you to know: tap water turns frogs and voters into zombies',
+    'Miracle fruit cures every disease overnight, big pharma furious and hiding it',
+    'Leaked footage shows aliens running the central bank, media silent',
+]
+REAL = [
+    'The city council approved the budget for road repairs on Tuesday after a public hearing',
+    'Researchers published a study on river sediment in a peer reviewed journal this month',
+    'The central bank kept interest rates unchanged, citing steady inflation figures',
+    'Local schools will open an hour later next year after a vote by the school board',
+    'The museum reopened its east wing following a two year renovation project',
+    'Officials said the bridge will close for maintenance over the holiday weekend',
+]
+UNSEEN = [
+    'Insiders reveal the shocking cure the government is hiding from voters',
+    'The school board published the budget for the bridge maintenance project',
+    'Café owners say the résumé of the naïve mayor was leaked',
+    '',
+]
+
+
+def fit(**options):
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2), **options)
+    vectors = vectorizer.fit_transform(FAKE + REAL)
+    clf = RandomForestClassifier(n_estimators=20, random_state=0).fit(vectors, [1] * len(FAKE) + [0] * len(REAL))
+    return vectorizer, clf
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'binary': True},
+    {'use_idf': False},
+    {'sublinear_tf': True, 'smooth_idf': False},
+    {'stop_words': 'english', 'strip_accents': 'unicode', 'norm': 'l1'},
+    {'strip_accents': 'ascii', 'lowercase': False, 'norm': None},
+])
+def test_exported_forest_matches_the_sklearn_model(tmp_path, options):
+    vectorizer, clf = fit(**options)
+    export_artifact(vectorizer, clf, str(tmp_path))
+    model = CompactModel(str(tmp_path))
+
+    texts = FAKE + REAL + UNSEEN
+    expected = vectorizer.transform(texts)[:, np.load(tmp_path / 'columns.npy')].toarray()
+    np.testing.assert_allclose(model.vectorizer.transform(texts).toarray(), expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(model.predict_fake_proba(texts), clf.predict_proba(vectorizer.transform(texts))[:, 1], atol=1e-6)
+
+
+def test_distilled_model_follows_the_forest(tmp_path):
+    vectorizer, clf = fit()
+    export_artifact(vectorizer, clf, str(tmp_path), distill_texts=FAKE + REAL)
+    model = CompactModel(str(tmp_path))
+
+    probabilities = model.predict_fake_proba(FAKE + REAL)
+    assert ((probabilities >= 0.5) == (clf.predict(vectorizer.transform(FAKE + REAL)) == 1)).all()
+
+
+def test_vectorizers_it_cannot_reproduce_are_rejected(tmp_path):
+    vectorizer, clf = fit(strip_accents=lambda text: text)
+    with pytest.raises(ValueError):
+        export_artifact(vectorizer, clf, str(tmp_path / 'callable'))
+    vectorizer, clf = fit(analyzer='char')
+    with pytest.raises(ValueError):
+        export_artifact(vectorizer, clf, str(tmp_path / 'char'))
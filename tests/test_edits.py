@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from edits import EditTracker
+
+
+def edit(content, id=1):
+    return SimpleNamespace(id=id, content=content)
+
+
+def test_a_burst_of_edits_is_handled_once_with_the_latest_content():
+    tracker = EditTracker(debounce=0.05, max_delay=1.0)
+    handled = []
+
+    async def handler(message):
+        handled.append(message.content)
+
+    async def run():
+        for content in ('a', 'ab', 'abc'):
+            tracker.submit(edit(content), handler)
+            await asyncio.sleep(0.01)
+        tracker.submit(edit('other', id=2), handler)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert handled == ['abc', 'other']
+    assert tracker.stats()['coalesced'] == 2
+    assert tracker.stats()['pending'] == 0
+
+
+def test_a_long_burst_is_handled_by_the_max_delay():
+    tracker = EditTracker(debounce=0.05, max_delay=0.12)
+    handled = []
+
+    async def handler(message):
+        handled.append(message.content)
+
+    async def run():
+        # An edit every 30 ms never leaves 50 ms of quiet, so only the max delay ends the burst
+        for i in range(8):
+            tracker.submit(edit(str(i)), handler)
+            await asyncio.sleep(0.03)
+        during = len(handled)
+        await asyncio.sleep(0.1)
+        return during
+
+    assert asyncio.run(run()) >= 1
+    assert handled[-1] == '7'
+    assert len(handled) < 8
+
+
+def test_plan_reruns_only_the_stages_whose_input_changed():
+    tracker = EditTracker()
+    link = 'https://news.example/story'
+    assert tracker.plan(1, f'hello {link}').rescore
+
+    tracker.record(1, f'hello {link}', {'TOXICITY': 0.1})
+    assert not tracker.plan(1, f'hello  {link}')
+    plan = tracker.plan(1, f'hello {link} https://other.example/')
+    assert not plan.rescore and plan.new_links == {'https://other.example/'}
+    plan = tracker.plan(1, f'goodbye {link}')
+    assert plan.rescore and plan.new_links == set()
+    assert tracker.stats()['unchanged'] == 1
@@ -0,0 +1,104 @@
+import asyncio
+
+from aiohttp import web
+
+import globals
+from fakenews import FakeNewsChecker, NotAnArticle
+from model.extract import ArticleExtractor, EXTRACT_CHUNK, decode, extract_text, is_html
+
+SENTENCE = 'The quick brown fox jumps over the lazy dog again'
+
+
+def paragraphs(count, prefix='p'):
+    return ''.join(f'<p>{prefix}{i} {SENTENCE}</p>' for i in range(count))
+
+
+def test_extraction_stops_at_the_word_budget():
+    page = f'<html><body>{paragraphs(20000)}</body></html>'
+    assert len(page) > 50 * EXTRACT_CHUNK
+    text = extract_text(page, max_words=100)
+    kept = text.split('\n\n')
+    # Ten words per paragraph: the budget is reached after ten of them
+    assert kept == [f'p{i} {SENTENCE}' for i in range(10)]
+
+
+def test_the_parser_is_not_fed_past_the_budget(monkeypatch):
+    fed = []
+    feed = ArticleExtractor.feed
+
+    def counting_feed(self, data):
+        fed.append(len(data))
+        feed(self, data)
+
+    monkeypatch.setattr(ArticleExtractor, 'feed', counting_feed)
+    extract_text(f'<html><body>{paragraphs(20000)}</body></html>', max_words=100)
+    assert fed == [EXTRACT_CHUNK]
+
+
+def test_only_the_marked_up_article_is_kept():
+    page = f'''<html><head><title>Site</title><script>var x = "{SENTENCE}";</script></head><body>
+        <nav>{paragraphs(3, 'nav')}</nav>
+        <p>teaser {SENTENCE}</p>
+        <article><h1>Headline</h1><p>Short byline</p>{paragraphs(2, 'body')}
+        <p><a href="/a">related one {SENTENCE}</a> and more</p>
+        <p>Entities &amp; quotes &quot;decoded&quot; in this paragraph of article text</p></article>
+        <footer>{paragraphs(2, 'footer')}</footer>{paragraphs(2, 'comment')}</body></html>'''
+    assert extract_text(page).split('\n\n') == [
+        f'body0 {SENTENCE}', f'body1 {SENTENCE}', 'Entities & quotes "decoded" in this paragraph of article text']
+
+
+def test_decode_handles_truncated_and_unknown_charsets():
+    body = 'naïve café'.encode('utf-8')
+    # The byte budget cut the last character in half
+    assert decode(body[:-1], 'text/html') == 'naïve caf�'
+    assert decode('naïve'.encode('latin-1'), 'text/html; charset="ISO-8859-1"') == 'naïve'
+    assert decode(body, 'text/html; charset=no-such-charset') == 'naïve café'
+
+
+def test_only_html_is_parsed():
+    assert is_html(None)
+    assert is_html('text/html; charset=utf-8')
+    assert is_html('application/xhtml+xml')
+    assert not is_html('application/pdf')
+    assert not is_html('image/png')
+
+
+async def fetch_pages(max_bytes):
+    page = f'<html><body>{paragraphs(100000)}</body></html>'.encode('utf-8')
+
+    async def article(request):
+        return web.Response(body=page, content_type='text/html')
+
+    async def pdf(request):
+        return web.Response(body=b'%PDF-1.4' + b'0' * 1024 * 1024, content_type='application/pdf')
+
+    app = web.Application()
+    app.add_routes([web.get('/article', article), web.get('/paper.pdf', pdf)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    base = f'http://127.0.0.1:{runner.addresses[0][1]}'
+    checker = FakeNewsChecker(max_bytes=max_bytes)
+    try:
+        html, url = await checker.fetch(f'{base}/article')
+        try:
+            await checker.fetch(f'{base}/paper.pdf')
+        except NotAnArticle:
+            refused = True
+        else:
+            refused = False
+        return len(page), html, url, refused
+    finally:
+        await checker.close()
+        checker.executor.shutdown()
+        await runner.cleanup()
+
+
+def test_downloads_are_capped_and_non_html_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(globals, 'DOMAIN_REPUTATION_PATH', str(tmp_path / 'domain_reputation.csv'))
+    size, html, url, refused = asyncio.run(fetch_pages(100 * 1024))
+    assert size > 1024 * 1024
+    assert len(html) == 100 * 1024
+    assert url.endswith('/article')
+    assert refused
@@ -0,0 +1,30 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+from fakenews import FakeNewsChecker
+
+
+def test_one_bad_link_does_not_sink_the_post(tmp_path, monkeypatch):
+    monkeypatch.setattr(globals, 'DOMAIN_REPUTATION_PATH', str(tmp_path / 'domain_reputation.csv'))
+    checker = FakeNewsChecker(executor=ThreadPoolExecutor(1))
+    classify = checker.classify
+
+    async def classify_known(link):
+        if 'hoax.example' in link:
+            return 0.9, 'model'
+        if 'broken.example' in link:
+            raise RuntimeError('model pool went away')
+        return await classify(link)
+
+    checker.classify = classify_known
+
+    async def check():
+        try:
+            return await checker.check('http://bad.example:99999/a http://[zz]/b https://broken.example/c https://hoax.example/d')
+        finally:
+            await checker.close()
+
+    result = asyncio.run(check())
+    assert result.is_fake
+    assert [verdict.error is None for verdict in result.links] == [False, False, False, True]
@@ -0,0 +1,50 @@
+from normalize import content_hash, fold
+
+# The transliterations of uni2ascii, which fold() replaced, that it still agrees with
+UNI2ASCII = {
+    '¡': 'i', '²': '2', '³': '3', '´': "'", 'À': 'A', 'Á': 'A', 'Â': 'A', 'Ã': 'A', 'Ä': 'A', 'Å': 'A', 'Æ': 'AE',
+    'Ç': 'C', 'È': 'E', 'É': 'E', 'Ê': 'E', 'Ë': 'E', 'Ì': 'I', 'Í': 'I', 'Î': 'I', 'Ï': 'I', 'Ð': 'D', 'Ñ': 'N',
+    'Ò': 'O', 'Ó': 'O', 'Ô': 'O', 'Õ': 'O', 'Ö': 'O', '×': 'x', 'Ù': 'U', 'Ú': 'U', 'Û': 'U', 'Ü': 'U', 'Ý': 'Y',
+    'à': 'a', 'á': 'a', 'â': 'a', 'ã': 'a', 'ä': 'a', 'å': 'a', 'æ': 'ae', 'ç': 'c', 'è': 'e', 'é': 'e', 'ê': 'e',
+    'ë': 'e', 'ì': 'i', 'í': 'i', 'î': 'i', 'ï': 'i', 'ñ': 'n', 'ò': 'o', 'ó': 'o', 'ô': 'o', 'õ': 'o', 'ö': 'o',
+    'ù': 'u', 'ú': 'u', 'û': 'u', 'ü': 'u', 'ý': 'y', 'ÿ': 'y', 'ć': 'c', 'ę': 'e', 'ğ': 'g', 'ģ': 'g', 'ī': 'i',
+    'ń': 'n', 'ō': 'o', 'Œ': 'OE', 'œ': 'oe', 'š': 's', 'Ÿ': 'Y', 'Ž': 'Z', 'ƒ': 'f', 'ɑ': 'a', 'ɡ': 'g', 'ʻ': "'",
+    'ν': 'v', 'ο': 'o', 'ρ': 'p', 'а': 'a', 'б': '6', 'е': 'e', 'о': 'o', 'р': 'p', 'с': 'c', 'у': 'y', 'х': 'x',
+    'ѕ': 's', 'і': 'i', 'ј': 'j', 'ѵ': 'v', 'ӕ': 'ae', '։': ':', '৪': '8', '৭': 'q', '੧': 'q', 'ଃ': '8', '୨': '9',
+    'ᵫ': 'ue', 'ṭ': 't', '‐': '-', '‒': '-', '–': '-', '—': '-', '―': '-', '’': "'", '“': '"', '”': '"', '…': '...',
+    '′': "'", '⁄': '/', '₁': '1', '₂': '2', '∕': '/', '≤': '<=', '≥': '>=', '★': '*', 'Ꜳ': 'AA', 'ꜳ': 'aa',
+    'ﬀ': 'ff', 'ﬁ': 'fi', 'ﬃ': 'ffi', 'ﬄ': 'ffl', 'ﬆ': 'st', '︰': ':', '\u2000': ' ', '\u2001': ' ',
+    '\u2002': ' ', '\u2003': ' ', '\u2004': ' ', '\u2005': ' ', '\u2006': ' ',
+    '\u2007': ' ', '\u2008': ' ', '\u202f': ' ', '\u205f': ' ', '\u3000': ' ', '\u2009': '',
+    '\u200a': '',
+}
+# Where fold() deliberately differs from uni2ascii: stray combining marks and zero-width characters vanish
+# rather than becoming '^' or a space
+UNI2ASCII_DIFFERENCES = {
+    '\u0302': '', '\u0311': '', '\u200b': '', '\u200c': '', '\u200d': '', '\u2060': '', '\ufeff': '',
+}
+
+
+def test_fold_agrees_with_the_uni2ascii_table():
+    for char, ascii in {**UNI2ASCII, **UNI2ASCII_DIFFERENCES}.items():
+        assert fold(char) == ascii, f'U+{ord(char):04X}'
+        assert fold(f'a{char}b') == f'a{ascii}b'
+
+
+def test_fold_catches_what_uni2ascii_missed():
+    assert fold('ＦＲＥＥ ｎｉｔｒｏ') == 'FREE nitro'
+    assert fold('𝐟𝐫𝐞𝐞 𝓷𝓲𝓽𝓻𝓸') == 'free nitro'
+    assert fold('ⓕⓡⓔⓔ') == 'free'
+    assert fold('РауРаl') == 'PayPal'
+    assert fold('z̸̡a̶l̷g̴o͎') == 'zalgo'
+    assert fold('f\u200br\u00adee\u00a0nitro') == 'free nitro'
+
+
+def test_fold_leaves_ascii_and_other_scripts_alone():
+    text = 'plain ascii, already folded'
+    assert fold(text) is text
+    assert fold('안녕 😀 日本') == '안녕 😀 日本'
+
+
+def test_look_alikes_share_a_content_hash():
+    assert content_hash(fold('FREE  Nitro')) == content_hash(fold('ＦＲＥＥ ｎｉｔｒｏ')) == content_hash(fold('free nitro'))
@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from outbound import MAX_MESSAGE_LENGTH, OutboundScheduler
+
+UNLIMITED = {route: (1000.0, 1000) for route in ('send', 'dm', 'delete', 'bulk_delete', 'reaction')}
+
+
+class FakeChannel:
+    def __init__(self, id, bulk_fails=False):
+        self.id = id
+        self.bulk_fails = bulk_fails
+        self.sent = []
+        self.bulk_deleted = []
+        self.deleted = []
+
+    async def send(self, text):
+        self.sent.append(text)
+
+    async def delete_messages(self, messages):
+        if self.bulk_fails:
+            raise discord.errors.HTTPException(SimpleNamespace(status=400, reason='Bad Request'), 'message too old')
+        self.bulk_deleted.append([message.id for message in messages])
+
+    def get_partial_message(self, message_id):
+        async def delete():
+            if message_id == 404:
+                raise discord.errors.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+            self.deleted.append(message_id)
+        return SimpleNamespace(delete=delete)
+
+
+def scheduler():
+    return OutboundScheduler(digest_window=0.01, delete_window=0.01, route_limits=UNLIMITED)
+
+
+def test_notices_within_the_window_share_a_digest():
+    outbound = scheduler()
+    mod, other = FakeChannel(1), FakeChannel(2)
+
+    async def run():
+        await outbound.dispatch(outbound.notify(mod, 'first'), outbound.notify(mod, 'second'), outbound.notify(other, 'third'))
+        await outbound.notify(mod, 'later')
+
+    asyncio.run(run())
+    assert mod.sent == ['first\nsecond', 'later']
+    assert other.sent == ['third']
+    assert outbound.stats()['digests_sent'] == 3
+    assert outbound.stats()['notices_merged'] == 4
+
+
+def test_digest_is_split_at_the_message_length_limit():
+    outbound = scheduler()
+    mod = FakeChannel(1)
+    notices = ['x' * 900, 'y' * 900, 'z' * 900]
+
+    async def run():
+        await outbound.dispatch(*(outbound.notify(mod, text) for text in notices))
+
+    asyncio.run(run())
+    assert mod.sent == [notices[0] + '\n' + notices[1], notices[2]]
+    assert all(len(text) <= MAX_MESSAGE_LENGTH for text in mod.sent)
+
+
+def test_deletions_in_a_channel_are_grouped_into_bulk_deletes():
+    outbound = scheduler()
+    channel, quiet = FakeChannel(1), FakeChannel(2)
+
+    async def run():
+        await outbound.dispatch(*(outbound.delete(channel, message_id) for message_id in range(1000, 1150)),
+                                outbound.delete(quiet, 7))
+
+    asyncio.run(run())
+    # At most 100 messages per bulk delete; a lone deletion is a plain delete
+    assert channel.bulk_deleted == [list(range(1000, 1100)), list(range(1100, 1150))]
+    assert channel.deleted == []
+    assert quiet.bulk_deleted == [] and quiet.deleted == [7]
+    assert outbound.stats()['bulk_deletes'] == 2
+
+
+def test_refused_bulk_delete_falls_back_to_single_deletes():
+    outbound = scheduler()
+    channel = FakeChannel(1, bulk_fails=True)
+
+    async def run():
+        return await outbound.dispatch(*(outbound.delete(channel, message_id) for message_id in (1, 404, 3)))
+
+    # A message that is already gone counts as deleted
+    assert asyncio.run(run()) == [None, None, None]
+    assert channel.deleted == [1, 3]
+    assert outbound.stats()['bulk_deletes'] == 0
+
+
+def test_a_cancelled_caller_does_not_break_the_digest_or_delete():
+    outbound = scheduler()
+    mod, channel = FakeChannel(1), FakeChannel(2)
+
+    async def run():
+        waiting = asyncio.ensure_future(outbound.dispatch(outbound.notify(mod, 'first'), outbound.delete(channel, 5), outbound.delete(channel, 6)))
+        second = outbound.notify(mod, 'second')
+        await asyncio.sleep(0)
+        waiting.cancel()
+        # The digest that resolves the second notice is the one that had the cancelled first one in it
+        await asyncio.wait_for(second, 1)
+        await outbound.close()
+        return waiting.cancelled()
+
+    assert asyncio.run(run())
+    assert mod.sent == ['first\nsecond']
+    assert channel.bulk_deleted == [[5, 6]]
@@ -0,0 +1,44 @@
+import asyncio
+
+from aiohttp import web
+
+from perspective import REQUESTED_ATTRIBUTES, PerspectiveClient
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    async def acquire(self, tokens=1):
+        self.acquired += tokens
+
+
+async def score_with_retries(statuses, limiter, max_backoff):
+    responses = iter(statuses)
+
+    async def analyze(request):
+        status = next(responses)
+        if status != 200:
+            return web.Response(status=status, headers={'Retry-After': '3600'})
+        return web.json_response({'attributeScores': {attr: {'summaryScore': {'value': 0.25}} for attr in REQUESTED_ATTRIBUTES}})
+
+    app = web.Application()
+    app.add_routes([web.post('/analyze', analyze)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    client = PerspectiveClient('key', url=f'http://127.0.0.1:{runner.addresses[0][1]}/analyze', max_backoff=max_backoff, limiter=limiter)
+    try:
+        return await asyncio.wait_for(client.score('hello'), 5)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def test_retries_take_tokens_and_cap_retry_after():
+    limiter = CountingLimiter()
+    scores = asyncio.run(score_with_retries([429, 503, 200], limiter, max_backoff=0.01))
+    assert scores['TOXICITY'] == 0.25
+    # The first attempt is paced by the scoring queue, each retry by the client
+    assert limiter.acquired == 2
@@ -0,0 +1,15 @@
+import asyncio
+
+from model.prefilter import LocalPrefilter
+
+
+def test_escalates_everything_without_a_model(tmp_path):
+    prefilter = LocalPrefilter(str(tmp_path / 'missing.joblib'))
+    try:
+        # Short and outside the lexicon: only Perspective can judge it
+        assert asyncio.run(prefilter.escalate('you absolute clown'))
+        assert prefilter.should_escalate('nice weather today')
+        assert prefilter.stats()['escalation_rate'] == 1.0
+        assert not prefilter.stats()['enabled']
+    finally:
+        prefilter.close()
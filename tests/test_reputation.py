@@ -0,0 +1,20 @@
+from reputation import DomainReputation
+
+
+def test_shard_saves_only_what_it_learned(tmp_path):
+    shared = tmp_path / 'domain_reputation.csv'
+    shared.write_text('hoax.example,5,0\n')
+    own = tmp_path / 'domain_reputation-1.csv'
+    own.write_text('news.example,0,2\n')
+
+    reputation = DomainReputation(5, 0.9)
+    reputation.load(str(shared), learned=False)
+    reputation.load(str(own))
+    assert reputation.verdict('hoax.example') is True
+
+    for _ in range(3):
+        reputation.record('news.example', False)
+    assert reputation.verdict('news.example') is False
+    reputation.save(str(own))
+    assert own.read_text().splitlines() == ['news.example,0,5']
+    assert shared.read_text() == 'hoax.example,5,0\n'
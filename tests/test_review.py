@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+from report import MessageRef, ReportDatabaseEntry, UserRef
+from review import BulkReview
+from tickets import AsyncTicketStore, MemoryTicketStore, DECIDED
+
+
+def bulk_review(categories):
+    bulk = BulkReview(None)
+    bulk.page = [(100 + i, category) for i, category in enumerate(categories, 1)]
+    return bulk
+
+
+def test_ranges_and_single_numbers():
+    bulk = bulk_review(['1'] * 6)
+    verdicts, errors = bulk.parse('1-5:10, 6:99')
+    assert errors == []
+    assert verdicts == {101: 10, 102: 10, 103: 10, 104: 10, 105: 10, 106: 99}
+    # Numbers left out are skipped
+    assert bulk.parse('2:20,4-4:99') == ({102: 20, 104: 99}, [])
+
+
+def test_y_and_n_follow_each_tickets_category():
+    bulk = bulk_review(['1', '2', '1'])
+    assert bulk.parse('1-3:y') == ({101: 10, 102: 20, 103: 10}, [])
+    assert bulk.parse('1-3:N') == ({101: 99, 102: 99, 103: 99}, [])
+
+
+def test_out_of_range_and_malformed_parts_are_errors():
+    bulk = bulk_review(['1'] * 3)
+    for text in ('0:10', '2-4:10', '3-2:10', '4:99'):
+        verdicts, errors = bulk.parse(text)
+        assert errors == [f"'{text}' is not a range within 1-3"]
+    assert bulk.parse('1=10')[1] == ["'1=10' should look like '3:10' or '1-5:99'"]
+    assert bulk.parse('1-:10')[1] == ["'1-:10' should look like '3:10' or '1-5:99'"]
+
+
+def test_bad_codes_are_errors():
+    bulk = bulk_review(['1', '3'])
+    assert bulk.parse('1:30')[1] == ["'30' is not a decision code for Ticket #101"]
+    assert bulk.parse('1:maybe')[1] == ["'maybe' is not a decision code for Ticket #101"]
+    # 'y' has no violation code for a ticket whose category has none
+    assert bulk.parse('1-2:y')[1] == ["'y' is not a decision code for Ticket #102"]
+
+
+def page_of_tickets(store, count):
+    ids = []
+    for i in range(count):
+        message = MessageRef(10, 20, i, 7, 'spammer', f'message {i}')
+        ids.append(store.create_ticket(ReportDatabaseEntry(UserRef(i, f'user{i}'), UserRef(7, 'spammer'), message, '1', '1', None)))
+    return ids
+
+
+def review_page(bulk, content):
+    return asyncio.run(bulk.review_page(SimpleNamespace(content=content), 500))
+
+
+def test_nothing_is_recorded_unless_the_whole_verdict_parses():
+    store = MemoryTicketStore()
+    ids = page_of_tickets(store, 3)
+    bulk = BulkReview(SimpleNamespace(tickets=AsyncTicketStore(store)))
+    bulk.page = [(ticket_id, '1') for ticket_id in ids]
+    try:
+        replies, reviewed = review_page(bulk, '1-2:10, 3:42')
+        assert reviewed == []
+        assert replies[0].startswith('Nothing was recorded.')
+        assert all(store.get_reviews(ticket_id) == [] for ticket_id in ids)
+        assert not bulk.review_complete()
+
+        store.set_state(ids[2], DECIDED)
+        replies, reviewed = review_page(bulk, '1-2:y, 3:n')
+        assert reviewed == ids[:2]
+        assert [store.get_reviews(ticket_id) for ticket_id in ids] == [[10], [10], []]
+        assert replies == [f'Thank you. Recorded 2 reviews. Already decided or fully reviewed by others: #{ids[2]}.']
+        assert bulk.review_complete()
+    finally:
+        bulk.client.tickets.close()
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+from spamwave import SpamWaveDetector
+
+RAID = 'FREE NITRO for everyone who joins our server today, click the link below'
+
+
+def post(content, id):
+    return SimpleNamespace(content=content, channel='general', id=id)
+
+
+def test_copies_share_the_first_verdict():
+    detector = SpamWaveDetector()
+    first = detector.add(post(RAID, 1))
+    assert detector.add(post(RAID + ' !!', 2)) is first
+    evaluated = []
+
+    async def evaluate():
+        evaluated.append(1)
+        return {'TOXICITY': 0.9}
+
+    async def run():
+        return await asyncio.gather(detector.verdict(first, evaluate), detector.verdict(first, evaluate))
+
+    assert asyncio.run(run()) == [{'TOXICITY': 0.9}, {'TOXICITY': 0.9}]
+    assert len(evaluated) == 1
+    assert detector.stats()['verdicts_reused'] == 1
+
+
+def test_links_are_checked_again_after_a_failed_check():
+    detector = SpamWaveDetector()
+    cluster = detector.add(post(RAID, 1))
+    links = {'https://a.example/x', 'https://b.example/y'}
+    assert detector.unchecked_links(cluster, links) == links
+    # Still running: other copies don't start their own check
+    assert detector.unchecked_links(cluster, links) == set()
+
+    detector.links_checked(cluster, links, ['https://a.example/x'])
+    assert detector.unchecked_links(cluster, links) == {'https://b.example/y'}
@@ -0,0 +1,194 @@
+import asyncio
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+import tickets
+from report import MessageRef, ReportDatabaseEntry, UserRef
+from tickets import (AsyncTicketStore, MemoryTicketStore, SQLiteTicketStore, CREATED, DECIDED, DUPLICATE, MERGED,
+                     merged_priority)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(tickets, 'time', SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    store = MemoryTicketStore() if request.param == 'memory' else SQLiteTicketStore(str(tmp_path / 'tickets.sqlite3'))
+    yield store
+    store.close()
+
+
+def report(reporter_id, message_id=1, category='1'):
+    message = MessageRef(10, 20, message_id, 7, 'spammer', f'message {message_id}')
+    return ReportDatabaseEntry(UserRef(reporter_id, f'user{reporter_id}'), UserRef(7, 'spammer'), message, category, '1', None)
+
+
+def priority(store, ticket_id):
+    if isinstance(store, MemoryTicketStore):
+        return store.tickets[ticket_id]['priority']
+    return store.db.execute('SELECT priority FROM tickets WHERE id = ?', (ticket_id,)).fetchone()[0]
+
+
+def test_expired_lease_is_swept_and_the_ticket_reclaimed(store, clock):
+    ticket_id = store.create_ticket(report(1))
+    assert store.claim(ticket_id, 100, 1, 60)
+    assert not store.claim(ticket_id, 200, 1, 60)
+    assert store.reviewer_ticket(100) == ticket_id
+
+    clock.value += 61
+    assert store.reviewer_ticket(100) is None
+    assert store.expire_leases() == [(100, ticket_id)]
+    assert store.expire_leases() == []
+    assert store.claim_next(200, 1, 60) == ticket_id
+    assert store.ticket_reviewers(ticket_id) == [200]
+
+
+def test_renewed_lease_does_not_expire(store, clock):
+    ticket_id = store.create_ticket(report(1))
+    assert store.claim(ticket_id, 100, 1, 60)
+    clock.value += 50
+    store.renew_lease(100, 60)
+    clock.value += 50
+    assert store.expire_leases() == []
+    assert store.reviewer_ticket(100) == ticket_id
+
+
+def test_only_one_process_reports_an_expired_lease(tmp_path, clock):
+    path = str(tmp_path / 'tickets.sqlite3')
+    first, second = SQLiteTicketStore(path), SQLiteTicketStore(path)
+    try:
+        ticket_id = first.create_ticket(report(1))
+        assert first.claim(ticket_id, 100, 1, 60)
+        clock.value += 61
+        assert first.expire_leases() + second.expire_leases() == [(100, ticket_id)]
+    finally:
+        first.close()
+        second.close()
+
+
+def review(path, ticket_id, reviewer_id, required, barrier, results):
+    store = SQLiteTicketStore(path)
+    barrier.wait()
+    added = store.submit_review(ticket_id, reviewer_id, 10, required)
+    results.put((reviewer_id, added, store.try_decide(ticket_id, required)))
+    store.close()
+
+
+@pytest.mark.parametrize('required, added', [(1, 1), (2, 2)])
+def test_concurrent_reviews_from_two_processes(tmp_path, required, added):
+    path = str(tmp_path / 'tickets.sqlite3')
+    store = SQLiteTicketStore(path)
+    ticket_id = store.create_ticket(report(1))
+    barrier = multiprocessing.Barrier(2)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=review, args=(path, ticket_id, reviewer_id, required, barrier, results))
+                 for reviewer_id in (100, 200)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+
+    # The ticket never takes more reviews than it needs, and exactly one process gets to apply the decision
+    assert sum(added for _, added, _ in outcomes) == added
+    assert len(store.get_reviews(ticket_id)) == added
+    assert sum(decided for _, _, decided in outcomes) == 1
+    store.close()
+
+
+def test_reports_of_one_message_merge_into_one_ticket(store):
+    ticket_id, outcome = store.file_report(report(1), 2.0, 0.5)
+    assert outcome == CREATED
+    assert store.file_report(report(2), 3.0, 0.8) == (ticket_id, MERGED)
+    assert store.file_report(report(2, category='2'), 4.0, 0.8) == (ticket_id, DUPLICATE)
+    assert store.file_report(report(3, message_id=2), 1.0, 0.5)[1] == CREATED
+
+    assert [r.reporting_user.id for r in store.get_ticket_reports(ticket_id)] == [1, 2]
+    assert store.tickets_for_user(2) == [ticket_id]
+    # Scored from the strongest report, with the other reporter as corroboration
+    assert priority(store, ticket_id) == pytest.approx(merged_priority([(2.0, 0.5), (3.0, 0.8)]))
+
+    # Once decided, a new report of the message opens a new ticket
+    store.set_state(ticket_id, DECIDED)
+    new_id, outcome = store.file_report(report(4), 1.0, 0.5)
+    assert outcome == CREATED and new_id != ticket_id
+
+
+def test_concurrent_filers_merge_into_one_sqlite_ticket(tmp_path):
+    path = str(tmp_path / 'tickets.sqlite3')
+    first, second = SQLiteTicketStore(path), SQLiteTicketStore(path)
+    try:
+        ticket_id, outcome = first.file_report(report(1), 2.0, 0.5)
+        assert second.file_report(report(2), 3.0, 0.8) == (ticket_id, MERGED)
+        assert priority(second, ticket_id) == pytest.approx(merged_priority([(2.0, 0.5), (3.0, 0.8)]))
+    finally:
+        first.close()
+        second.close()
+
+
+def test_tickets_are_claimed_by_priority_then_age(store, clock, monkeypatch):
+    monkeypatch.setattr(tickets.globals, 'REVIEW_AGE_WEIGHT', 0.25)
+    low = store.create_ticket(report(1, message_id=1), 1.0)
+    clock.value += 4 * 3600
+    high = store.create_ticket(report(1, message_id=2), 1.5)
+    middle = store.create_ticket(report(1, message_id=3), 1.2)
+    tie = store.create_ticket(report(1, message_id=4), 1.2)
+
+    # Four hours of waiting lift the oldest ticket from 1.0 to 2.0; equal priorities go oldest first
+    assert store.reviewable_tickets(100, 1, 10) == [low, high, middle, tie]
+    assert store.reviewable_tickets(100, 1, 2) == [low, high]
+    assert [store.claim_next(reviewer_id, 1, 60) for reviewer_id in (100, 200, 300, 400, 500)] == [low, high, middle, tie, None]
+
+
+def test_mod_message_lookup(store):
+    ticket_id = store.create_ticket(report(1))
+    store.set_mod_message(ticket_id, 555)
+    assert store.ticket_for_mod_message(555) == ticket_id
+    store.set_mod_message(ticket_id, 556)
+    assert store.ticket_for_mod_message(555) is None
+    assert store.ticket_for_mod_message(556) == ticket_id
+    store.set_mod_message(ticket_id, None)
+    assert store.ticket_for_mod_message(556) is None
+    assert store.get_mod_message(ticket_id) is None
+
+
+def test_async_store_awaits_store_calls(tmp_path):
+    store = AsyncTicketStore(SQLiteTicketStore(str(tmp_path / 'tickets.sqlite3')))
+
+    async def run():
+        ticket_id = await store.create_ticket(report(1))
+        return ticket_id, await store.get_report(ticket_id), await store.backlog_stats()
+
+    try:
+        ticket_id, stored, stats = asyncio.run(run())
+        assert stored.reporting_user.id == 1
+        assert stats['open'] == 1
+    finally:
+        store.close()
+
+
+def test_guild_jobs_go_to_the_process_that_takes_their_guild(tmp_path):
+    path = str(tmp_path / 'tickets.sqlite3')
+    first, second = SQLiteTicketStore(path), SQLiteTicketStore(path)
+    try:
+        first.add_guild_job(10, 'post', 1)
+        first.add_guild_job(11, 'decide', 2)
+        first.add_guild_job(10, 'take_down', 1)
+        assert second.take_guild_jobs({10, 12}) == [('post', 1), ('take_down', 1)]
+        assert first.take_guild_jobs({10}) == []
+        assert first.take_guild_jobs({11}) == [('decide', 2)]
+    finally:
+        first.close()
+        second.close()
+
+
+def test_settings_are_shared(store):
+    assert store.get_setting('num_reviewers') is None
+    store.set_setting('num_reviewers', 3)
+    assert store.get_setting('num_reviewers') == 3
@@ -0,0 +1,78 @@
+import json
+import threading
+
+from model.writer import FirestoreWriter
+
+
+class RecordingWriter(FirestoreWriter):
+    '''
+    Writer whose write() records mutations instead of calling Firestore, optionally failing or
+    waiting for `release` first.
+    '''
+    def __init__(self, *args, fail=False, release=None, **kwargs):
+        self.written = []
+        self.fail = fail
+        self.release = release
+        super().__init__(None, *args, max_retries=0, **kwargs)
+
+    def write(self, mutations):
+        if self.release is not None:
+            self.release.wait()
+        if self.fail:
+            raise RuntimeError('Firestore is down')
+        self.written.extend(mutations)
+
+
+def test_full_queue_spills_to_the_journal_in_order(tmp_path):
+    journal = str(tmp_path / 'journal.jsonl')
+    release = threading.Event()
+    writer = RecordingWriter(journal, max_queue=1, release=release)
+    for i in range(10):
+        writer.enqueue({'op': 'add_user_report', 'n': i})
+    assert writer.stats()['spilled'] > 0
+
+    release.set()
+    assert writer.flush(timeout=10)
+    assert [m['n'] for m in writer.written] == list(range(10))
+    assert open(journal).read() == ''
+
+
+class PoisonWriter(RecordingWriter):
+    # Fails any batch holding a mutation for user 'ghost', the way a batch.update of a missing document does
+    def write(self, mutations):
+        if any(m.get('user_name') == 'ghost' for m in mutations):
+            raise LookupError('No document to update: users/ghost')
+        super().write(mutations)
+
+
+def test_bad_mutation_is_dead_lettered_and_the_rest_written(tmp_path):
+    journal = str(tmp_path / 'journal.jsonl')
+    release = threading.Event()
+    writer = PoisonWriter(journal, release=release)
+    for user_name in ('a', 'ghost', 'b'):
+        writer.enqueue({'op': 'evaluate_user_report', 'user_name': user_name})
+    release.set()
+    assert writer.flush(timeout=10)
+
+    assert [m['user_name'] for m in writer.written] == ['a', 'b']
+    assert writer.stats()['dead_lettered'] == 1
+    with open(str(tmp_path / 'journal-dead-letter.jsonl')) as f:
+        assert [json.loads(line)['mutation']['user_name'] for line in f] == ['ghost']
+    # Nothing is left to replay
+    assert open(journal).read() == ''
+
+
+def test_uncommitted_mutations_are_replayed_on_next_start(tmp_path):
+    journal = str(tmp_path / 'journal.jsonl')
+    failing = RecordingWriter(journal, fail=True)
+    failing.enqueue({'op': 'evaluate_user_report', 'user_name': 'a'})
+    failing.enqueue({'op': 'evaluate_user_report', 'user_name': 'b'})
+    failing.flush()
+
+    writer = RecordingWriter(journal)
+    writer.enqueue({'op': 'evaluate_user_report', 'user_name': 'c'})
+    writer.flush()
+    assert [m['user_name'] for m in writer.written] == ['a', 'b', 'c']
+    assert len({m['seq'] for m in writer.written}) == 3
+    # Everything is committed, so the journal was emptied
+    assert open(journal).read() == ''
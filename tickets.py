@@ -0,0 +1,665 @@
+'''
+Ticket store for live moderation state: tickets and their reports, reviewer decisions, which
+reviewer is working on which ticket, and per-user bad report counts.
+
+Open tickets form a priority work queue. Each ticket gets a priority when it is created (see
+ticket_priority) and gains REVIEW_AGE_WEIGHT per hour it waits. Reviewers claim a ticket by taking a
+lease on it: a claim is one atomic statement, a reviewer holds at most one lease at a time, and a
+ticket never has more leases plus reviews than the number of reviewers it needs. Leases that run out
+before the review is finished are dropped and the ticket goes back to the queue. Bulk review lists
+the tickets a reviewer could claim without leasing them, and each review from it is only added if
+the reviewer could still claim the ticket at that moment.
+
+Reports are filed per reported message: a report of a message that already has an undecided ticket
+is merged into it rather than opening another, and the ticket keeps every reporter's report. Its
+priority is that of its strongest report plus REVIEW_CORROBORATION_WEIGHT for each further reporter,
+scaled by their track record. A reporter can only be counted once per ticket.
+
+It also holds the state of in-progress report and review DM conversations, so that any bot
+process (see shards.py) can pick a conversation up where another left off, settings changed at
+runtime, and guild jobs: work on a ticket that only the process running its guild's shard can do
+(posting it to the mod channel, taking the post down, applying a decision), left there by whichever
+process got the DM that called for it.
+
+Two backends share the same methods: MemoryTicketStore for tests and throwaway runs, and
+SQLiteTicketStore, which keeps everything in a WAL-mode SQLite file so it survives restarts and can
+be shared between processes. Reports are stored as compact references to Discord users and messages
+(see report.py), never as discord.py objects. The bot reaches either through AsyncTicketStore, which
+runs every call on a worker thread so that waiting on another process's lock never blocks the event loop.
+'''
+import asyncio
+import functools
+import itertools
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+from report import ReportDatabaseEntry
+
+OPEN = 'open'
+REVIEWED = 'reviewed' # All reviews are in and one process is applying the decision
+DECIDED = 'decided'
+
+# Outcomes of filing a report
+CREATED = 'created'
+MERGED = 'merged'
+DUPLICATE = 'duplicate' # The reporter had already reported the message
+
+
+def ticket_priority(report, score=0.0, reporter_weight=None):
+    '''
+    Base priority of a new ticket from the severity of its category, the highest Perspective (or
+    fake news) score for the message, and how often the reporter's past reports turned out correct.
+    Reporters without a record count as 0.5.
+    '''
+    severity = globals.CATEGORY_SEVERITY.get(report.reported_category, {})
+    severity = severity.get(report.reported_subcategory, globals.DEFAULT_SEVERITY) if isinstance(severity, dict) else severity
+    if reporter_weight is None:
+        reporter_weight = 0.5
+    return globals.REVIEW_SEVERITY_WEIGHT * severity + globals.REVIEW_SCORE_WEIGHT * score + \
+        globals.REVIEW_REPORTER_WEIGHT * reporter_weight
+
+
+def message_key(report):
+    message = report.reported_message
+    return f'{message.guild_id}/{message.channel_id}/{message.message_id}'
+
+
+def reporter_key(report):
+    '''
+    Who filed a report, for counting each reporter once. The bot's own reports count once per category.
+    '''
+    if report.reporting_user is not None and report.reporting_user.id is not None:
+        return str(report.reporting_user.id)
+    return f'{report.reporting_user}:{report.reported_category},{report.reported_subcategory}'
+
+
+def merged_priority(reports):
+    '''
+    Priority of a ticket from its (priority, reporter weight) reports.
+    '''
+    strongest = max(reports)
+    return strongest[0] + globals.REVIEW_CORROBORATION_WEIGHT * (sum(weight for _, weight in reports) - strongest[1])
+
+
+def effective_priority(priority, created_at, now):
+    return priority + globals.REVIEW_AGE_WEIGHT * (now - created_at) / 3600
+
+
+class MemoryTicketStore:
+    def __init__(self):
+        self.next_id = itertools.count(1)
+        self.tickets = {} # Key: ticket_id Value: {'state', 'report', 'priority', 'created_at', 'decided_at', 'mod_message_id'}
+        self.reviews = {} # Key: ticket_id Value: list of (reviewer_id, decision code)
+        self.leases = {} # Key: reviewer_id Value: (ticket_id, expires_at)
+        self.tickets_by_user = {} # Key: user_id Value: set of ticket_ids the user reported or was reported in
+        self.live_tickets = {} # Key: message_key of the reported message Value: its undecided ticket_id
+        self.mod_messages = {} # Key: mod channel message id Value: ticket_id it posts
+        self.ticket_reports = {} # Key: ticket_id Value: {reporter_key: (report dict, priority, weight)}, in filing order
+        self.bad_reports = {} # Key: user_id Value: number of reports judged not a violation
+        self.conversations = {} # Key: (kind, user_id) Value: serialized Report/Review state
+        self.settings = {} # Key: setting name Value: its value
+        self.guild_jobs = [] # List of (guild_id, job, ticket_id), oldest first
+
+    def create_ticket(self, report, priority=0.0):
+        ticket_id = next(self.next_id)
+        self.tickets[ticket_id] = {'state': OPEN, 'report': report.to_dict(), 'priority': priority,
+                                   'created_at': time.time(), 'decided_at': None, 'mod_message_id': None}
+        for user in (report.reporting_user, report.reported_user):
+            if user is not None and user.id is not None:
+                self.tickets_by_user.setdefault(user.id, set()).add(ticket_id)
+        return ticket_id
+
+    def file_report(self, report, priority=0.0, weight=0.5):
+        '''
+        Adds a report to the undecided ticket for its message, or opens one. Returns the ticket id
+        and CREATED, MERGED or DUPLICATE.
+        '''
+        key = message_key(report)
+        ticket_id = self.live_tickets.get(key)
+        outcome = MERGED
+        if ticket_id is None:
+            ticket_id = self.live_tickets[key] = self.create_ticket(report, priority)
+            outcome = CREATED
+
+        reports = self.ticket_reports.setdefault(ticket_id, {})
+        reporter = reporter_key(report)
+        if reporter in reports:
+            return ticket_id, DUPLICATE
+        reports[reporter] = (report.to_dict(), priority, weight)
+        self.tickets[ticket_id]['priority'] = merged_priority([(p, w) for _, p, w in reports.values()])
+        if report.reporting_user is not None and report.reporting_user.id is not None:
+            self.tickets_by_user.setdefault(report.reporting_user.id, set()).add(ticket_id)
+        return ticket_id, outcome
+
+    def get_report(self, ticket_id):
+        ticket = self.tickets.get(ticket_id)
+        return None if ticket is None else ReportDatabaseEntry.from_dict(ticket['report'])
+
+    def get_ticket_reports(self, ticket_id):
+        '''
+        Every report filed into the ticket, in filing order. Tickets created directly have none.
+        '''
+        return [ReportDatabaseEntry.from_dict(data) for data, _, _ in self.ticket_reports.get(ticket_id, {}).values()]
+
+    def update_report(self, ticket_id, report):
+        self.tickets[ticket_id]['report'] = report.to_dict()
+
+    def get_state(self, ticket_id):
+        ticket = self.tickets.get(ticket_id)
+        return None if ticket is None else ticket['state']
+
+    def set_state(self, ticket_id, state):
+        ticket = self.tickets[ticket_id]
+        ticket['state'] = state
+        ticket['decided_at'] = time.time() if state == DECIDED else None
+        if state == DECIDED:
+            key = message_key(ReportDatabaseEntry.from_dict(ticket['report']))
+            if self.live_tickets.get(key) == ticket_id:
+                del self.live_tickets[key]
+
+    def try_decide(self, ticket_id, required):
+        '''
+        Moves an open ticket with at least `required` reviews to REVIEWED. Returns whether it did, so
+        that exactly one caller goes on to apply the decision.
+        '''
+        ticket = self.tickets.get(ticket_id)
+        if ticket is None or ticket['state'] != OPEN or len(self.reviews.get(ticket_id, [])) < required:
+            return False
+        ticket['state'] = REVIEWED
+        return True
+
+    def set_mod_message(self, ticket_id, message_id):
+        ticket = self.tickets[ticket_id]
+        self.mod_messages.pop(ticket['mod_message_id'], None)
+        ticket['mod_message_id'] = message_id
+        if message_id is not None:
+            self.mod_messages[message_id] = ticket_id
+
+    def get_mod_message(self, ticket_id):
+        ticket = self.tickets.get(ticket_id)
+        return None if ticket is None else ticket['mod_message_id']
+
+    def ticket_for_mod_message(self, message_id):
+        return self.mod_messages.get(message_id)
+
+    def tickets_for_user(self, user_id):
+        return sorted(self.tickets_by_user.get(user_id, ()))
+
+    def add_review(self, ticket_id, reviewer_id, code):
+        self.reviews.setdefault(ticket_id, []).append((reviewer_id, code))
+
+    def get_reviews(self, ticket_id):
+        return [code for _, code in self.reviews.get(ticket_id, [])]
+
+    def clear_reviews(self, ticket_id):
+        self.reviews.pop(ticket_id, None)
+
+    def _active_leases(self, ticket_id, now, exclude=None):
+        return sum(1 for reviewer_id, (leased, expires_at) in self.leases.items()
+                   if leased == ticket_id and expires_at > now and reviewer_id != exclude)
+
+    def _claimable(self, ticket_id, reviewer_id, required, now):
+        ticket = self.tickets.get(ticket_id)
+        if ticket is None or ticket['state'] != OPEN:
+            return False
+        held = self.leases.get(reviewer_id)
+        if held is not None and held[0] != ticket_id and held[1] > now:
+            return False
+        reviewers = [r for r, _ in self.reviews.get(ticket_id, [])]
+        return reviewer_id not in reviewers and len(reviewers) + self._active_leases(ticket_id, now, reviewer_id) < required
+
+    def claim(self, ticket_id, reviewer_id, required, lease):
+        '''
+        Leases ticket_id to reviewer_id for `lease` seconds. Returns whether the claim succeeded.
+        '''
+        now = time.time()
+        if not self._claimable(ticket_id, reviewer_id, required, now):
+            return False
+        self.leases[reviewer_id] = (ticket_id, now + lease)
+        return True
+
+    def claim_next(self, reviewer_id, required, lease):
+        '''
+        Leases the highest priority ticket reviewer_id can take. Returns its id, or None if there is none.
+        '''
+        now = time.time()
+        candidates = [(effective_priority(ticket['priority'], ticket['created_at'], now), -ticket_id, ticket_id)
+                      for ticket_id, ticket in self.tickets.items() if self._claimable(ticket_id, reviewer_id, required, now)]
+        if not candidates:
+            return None
+        ticket_id = max(candidates)[2]
+        self.leases[reviewer_id] = (ticket_id, now + lease)
+        return ticket_id
+
+    def reviewable_tickets(self, reviewer_id, required, limit):
+        '''
+        Up to `limit` tickets reviewer_id could claim, highest priority first. Nothing is leased.
+        '''
+        now = time.time()
+        candidates = sorted(((effective_priority(ticket['priority'], ticket['created_at'], now), -ticket_id, ticket_id)
+                             for ticket_id, ticket in self.tickets.items() if self._claimable(ticket_id, reviewer_id, required, now)),
+                            reverse=True)
+        return [ticket_id for _, _, ticket_id in candidates[:limit]]
+
+    def submit_review(self, ticket_id, reviewer_id, code, required):
+        '''
+        Adds a review of a ticket that isn't leased to reviewer_id, if they could still claim it.
+        Returns whether it was added.
+        '''
+        if not self._claimable(ticket_id, reviewer_id, required, time.time()):
+            return False
+        self.add_review(ticket_id, reviewer_id, code)
+        return True
+
+    def renew_lease(self, reviewer_id, lease):
+        held = self.leases.get(reviewer_id)
+        if held is not None and held[1] > time.time():
+            self.leases[reviewer_id] = (held[0], time.time() + lease)
+
+    def expire_leases(self):
+        '''
+        Drops expired leases and returns them as (reviewer_id, ticket_id) pairs.
+        '''
+        now = time.time()
+        expired = [(reviewer_id, ticket_id) for reviewer_id, (ticket_id, expires_at) in self.leases.items() if expires_at <= now]
+        for reviewer_id, _ in expired:
+            del self.leases[reviewer_id]
+        return expired
+
+    def reviewer_ticket(self, reviewer_id):
+        held = self.leases.get(reviewer_id)
+        return held[0] if held is not None and held[1] > time.time() else None
+
+    def release_reviewer(self, reviewer_id):
+        self.leases.pop(reviewer_id, None)
+
+    def ticket_reviewers(self, ticket_id):
+        now = time.time()
+        return [reviewer_id for reviewer_id, (leased, expires_at) in self.leases.items() if leased == ticket_id and expires_at > now]
+
+    def backlog_stats(self):
+        now = time.time()
+        open_tickets = [ticket for ticket in self.tickets.values() if ticket['state'] == OPEN]
+        decision_times = [ticket['decided_at'] - ticket['created_at'] for ticket in self.tickets.values() if ticket['decided_at'] is not None]
+        return {
+            'open': len(open_tickets),
+            'claimed': len({ticket_id for ticket_id, expires_at in self.leases.values() if expires_at > now}),
+            'oldest_open_age': max((now - ticket['created_at'] for ticket in open_tickets), default=0.0),
+            'decided': len(decision_times),
+            'avg_time_to_decision': sum(decision_times) / len(decision_times) if decision_times else 0.0,
+            'max_time_to_decision': max(decision_times, default=0.0),
+        }
+
+    def bad_report_count(self, user_id):
+        return self.bad_reports.get(user_id, 0)
+
+    def add_bad_report(self, user_id):
+        self.bad_reports[user_id] = self.bad_reports.get(user_id, 0) + 1
+
+    def load_conversation(self, kind, user_id):
+        return self.conversations.get((kind, user_id))
+
+    def save_conversation(self, kind, user_id, data):
+        self.conversations[(kind, user_id)] = data
+
+    def delete_conversation(self, kind, user_id):
+        self.conversations.pop((kind, user_id), None)
+
+    def get_setting(self, name):
+        return self.settings.get(name)
+
+    def set_setting(self, name, value):
+        self.settings[name] = value
+
+    def add_guild_job(self, guild_id, job, ticket_id):
+        self.guild_jobs.append((guild_id, job, ticket_id))
+
+    def take_guild_jobs(self, guild_ids):
+        '''
+        Removes and returns the (job, ticket_id) jobs queued for any of guild_ids, oldest first.
+        '''
+        taken = [(job, ticket_id) for guild_id, job, ticket_id in self.guild_jobs if guild_id in guild_ids]
+        self.guild_jobs = [entry for entry in self.guild_jobs if entry[0] not in guild_ids]
+        return taken
+
+    def close(self):
+        pass
+
+
+class SQLiteTicketStore:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            state TEXT NOT NULL,
+            report TEXT NOT NULL,
+            reporting_user_id INTEGER,
+            reported_user_id INTEGER,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tickets_reporting_user ON tickets (reporting_user_id);
+        CREATE INDEX IF NOT EXISTS tickets_reported_user ON tickets (reported_user_id);
+        CREATE TABLE IF NOT EXISTS ticket_reports (
+            ticket_id INTEGER NOT NULL,
+            reporter TEXT NOT NULL,
+            report TEXT NOT NULL,
+            priority REAL NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (ticket_id, reporter)
+        );
+        CREATE TABLE IF NOT EXISTS reviews (
+            ticket_id INTEGER NOT NULL,
+            reviewer_id INTEGER NOT NULL,
+            code INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS reviews_ticket ON reviews (ticket_id);
+        -- Reviewer assignments without expiry, replaced by leases
+        DROP TABLE IF EXISTS reviewers;
+        CREATE TABLE IF NOT EXISTS leases (
+            reviewer_id INTEGER PRIMARY KEY,
+            ticket_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS leases_ticket ON leases (ticket_id);
+        CREATE TABLE IF NOT EXISTS bad_reports (
+            user_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS conversations (
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS guild_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            job TEXT NOT NULL,
+            ticket_id INTEGER NOT NULL
+        );
+    '''
+    # Added to the tickets table after it was first created, so older files are migrated on open
+    TICKET_COLUMNS = [
+        ('priority', 'REAL NOT NULL DEFAULT 0'),
+        ('decided_at', 'REAL'),
+        ('mod_message_id', 'INTEGER'),
+        ('message_key', 'TEXT'),
+    ]
+    # Tickets from before message_key have none, so they never take part in merging
+    INDEXES = '''
+        CREATE INDEX IF NOT EXISTS tickets_state ON tickets (state);
+        CREATE INDEX IF NOT EXISTS tickets_mod_message ON tickets (mod_message_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS tickets_live_message ON tickets (message_key) WHERE state != 'decided';
+    '''
+    # Whether ticket t can be leased to :reviewer: it is open, the reviewer hasn't reviewed it or
+    # got a live lease on another ticket, and its reviews plus other live leases are below :required
+    CLAIMABLE = '''
+        t.state = 'open'
+        AND NOT EXISTS (SELECT 1 FROM leases l WHERE l.reviewer_id = :reviewer AND l.ticket_id != t.id AND l.expires_at > :now)
+        AND NOT EXISTS (SELECT 1 FROM reviews r WHERE r.ticket_id = t.id AND r.reviewer_id = :reviewer)
+        AND (SELECT COUNT(*) FROM reviews r WHERE r.ticket_id = t.id)
+            + (SELECT COUNT(*) FROM leases l WHERE l.ticket_id = t.id AND l.reviewer_id != :reviewer AND l.expires_at > :now) < :required
+    '''
+
+    def __init__(self, path):
+        # Autocommit; each statement below is atomic on its own, including across processes.
+        # The connection is opened here but used from AsyncTicketStore's worker thread
+        self.db = sqlite3.connect(path, isolation_level=None, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(tickets)')}
+        for name, definition in self.TICKET_COLUMNS:
+            if name not in columns:
+                self.db.execute(f'ALTER TABLE tickets ADD COLUMN {name} {definition}')
+        self.db.executescript(self.INDEXES)
+
+    def create_ticket(self, report, priority=0.0):
+        reporting_id = report.reporting_user.id if report.reporting_user is not None else None
+        reported_id = report.reported_user.id if report.reported_user is not None else None
+        cursor = self.db.execute('INSERT INTO tickets (state, report, reporting_user_id, reported_user_id, created_at, priority) VALUES (?, ?, ?, ?, ?, ?)',
+                                 (OPEN, json.dumps(report.to_dict()), reporting_id, reported_id, time.time(), priority))
+        return cursor.lastrowid
+
+    def file_report(self, report, priority=0.0, weight=0.5):
+        reporting_id = report.reporting_user.id if report.reporting_user is not None else None
+        reported_id = report.reported_user.id if report.reported_user is not None else None
+        key = message_key(report)
+        while True:
+            row = self.db.execute("SELECT id FROM tickets WHERE message_key = ? AND state != 'decided'", (key,)).fetchone()
+            if row is not None:
+                ticket_id, outcome = row[0], MERGED
+                break
+            # Of several processes filing at once, exactly one creates the ticket; the others merge on the next pass
+            cursor = self.db.execute('''
+                INSERT INTO tickets (state, report, reporting_user_id, reported_user_id, created_at, priority, message_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (message_key) WHERE state != 'decided' DO NOTHING''',
+                (OPEN, json.dumps(report.to_dict()), reporting_id, reported_id, time.time(), priority, key))
+            if cursor.rowcount == 1:
+                ticket_id, outcome = cursor.lastrowid, CREATED
+                break
+
+        cursor = self.db.execute('INSERT INTO ticket_reports VALUES (?, ?, ?, ?, ?) ON CONFLICT DO NOTHING',
+                                 (ticket_id, reporter_key(report), json.dumps(report.to_dict()), priority, weight))
+        if cursor.rowcount == 0:
+            return ticket_id, DUPLICATE
+        # merged_priority in one statement, so concurrent merges can't overwrite each other with a partial sum
+        self.db.execute('''
+            UPDATE tickets SET priority = (
+                SELECT r.priority + :corroboration * ((SELECT SUM(weight) FROM ticket_reports WHERE ticket_id = :ticket) - r.weight)
+                FROM ticket_reports r WHERE r.ticket_id = :ticket ORDER BY r.priority DESC, r.weight DESC LIMIT 1)
+            WHERE id = :ticket''', {'ticket': ticket_id, 'corroboration': globals.REVIEW_CORROBORATION_WEIGHT})
+        return ticket_id, outcome
+
+    def get_report(self, ticket_id):
+        row = self.db.execute('SELECT report FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+        return None if row is None else ReportDatabaseEntry.from_dict(json.loads(row[0]))
+
+    def get_ticket_reports(self, ticket_id):
+        rows = self.db.execute('SELECT report FROM ticket_reports WHERE ticket_id = ? ORDER BY rowid', (ticket_id,))
+        return [ReportDatabaseEntry.from_dict(json.loads(row[0])) for row in rows]
+
+    def update_report(self, ticket_id, report):
+        self.db.execute('UPDATE tickets SET report = ? WHERE id = ?', (json.dumps(report.to_dict()), ticket_id))
+
+    def get_state(self, ticket_id):
+        row = self.db.execute('SELECT state FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_state(self, ticket_id, state):
+        self.db.execute('UPDATE tickets SET state = ?, decided_at = ? WHERE id = ?',
+                        (state, time.time() if state == DECIDED else None, ticket_id))
+
+    def try_decide(self, ticket_id, required):
+        cursor = self.db.execute('UPDATE tickets SET state = ? WHERE id = ? AND state = ? AND (SELECT COUNT(*) FROM reviews WHERE ticket_id = ?) >= ?',
+                                 (REVIEWED, ticket_id, OPEN, ticket_id, required))
+        return cursor.rowcount == 1
+
+    def set_mod_message(self, ticket_id, message_id):
+        self.db.execute('UPDATE tickets SET mod_message_id = ? WHERE id = ?', (message_id, ticket_id))
+
+    def get_mod_message(self, ticket_id):
+        row = self.db.execute('SELECT mod_message_id FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def ticket_for_mod_message(self, message_id):
+        row = self.db.execute('SELECT id FROM tickets WHERE mod_message_id = ?', (message_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def tickets_for_user(self, user_id):
+        rows = self.db.execute('''
+            SELECT id FROM tickets WHERE reporting_user_id = ? UNION SELECT id FROM tickets WHERE reported_user_id = ?
+            UNION SELECT ticket_id FROM ticket_reports WHERE reporter = ? ORDER BY id''', (user_id, user_id, str(user_id)))
+        return [row[0] for row in rows]
+
+    def add_review(self, ticket_id, reviewer_id, code):
+        self.db.execute('INSERT INTO reviews VALUES (?, ?, ?)', (ticket_id, reviewer_id, code))
+
+    def get_reviews(self, ticket_id):
+        return [row[0] for row in self.db.execute('SELECT code FROM reviews WHERE ticket_id = ? ORDER BY rowid', (ticket_id,))]
+
+    def clear_reviews(self, ticket_id):
+        self.db.execute('DELETE FROM reviews WHERE ticket_id = ?', (ticket_id,))
+
+    def claim(self, ticket_id, reviewer_id, required, lease):
+        now = time.time()
+        cursor = self.db.execute(f'INSERT OR REPLACE INTO leases SELECT :reviewer, t.id, :expires FROM tickets t WHERE t.id = :ticket AND {self.CLAIMABLE}',
+                                 {'reviewer': reviewer_id, 'ticket': ticket_id, 'now': now, 'expires': now + lease, 'required': required})
+        return cursor.rowcount == 1
+
+    def claim_next(self, reviewer_id, required, lease):
+        now = time.time()
+        cursor = self.db.execute(f'''
+            INSERT OR REPLACE INTO leases SELECT :reviewer, t.id, :expires FROM tickets t WHERE {self.CLAIMABLE}
+            ORDER BY t.priority + :age_weight * (:now - t.created_at) / 3600 DESC, t.id LIMIT 1''',
+            {'reviewer': reviewer_id, 'now': now, 'expires': now + lease, 'required': required, 'age_weight': globals.REVIEW_AGE_WEIGHT})
+        return self.reviewer_ticket(reviewer_id) if cursor.rowcount == 1 else None
+
+    def reviewable_tickets(self, reviewer_id, required, limit):
+        rows = self.db.execute(f'''
+            SELECT t.id FROM tickets t WHERE {self.CLAIMABLE}
+            ORDER BY t.priority + :age_weight * (:now - t.created_at) / 3600 DESC, t.id LIMIT :limit''',
+            {'reviewer': reviewer_id, 'now': time.time(), 'required': required, 'age_weight': globals.REVIEW_AGE_WEIGHT, 'limit': limit})
+        return [row[0] for row in rows]
+
+    def submit_review(self, ticket_id, reviewer_id, code, required):
+        cursor = self.db.execute(f'INSERT INTO reviews SELECT t.id, :reviewer, :code FROM tickets t WHERE t.id = :ticket AND {self.CLAIMABLE}',
+                                 {'reviewer': reviewer_id, 'ticket': ticket_id, 'code': code, 'now': time.time(), 'required': required})
+        return cursor.rowcount == 1
+
+    def renew_lease(self, reviewer_id, lease):
+        now = time.time()
+        self.db.execute('UPDATE leases SET expires_at = ? WHERE reviewer_id = ? AND expires_at > ?', (now + lease, reviewer_id, now))
+
+    def expire_leases(self):
+        now = time.time()
+        expired = []
+        for reviewer_id, ticket_id in self.db.execute('SELECT reviewer_id, ticket_id FROM leases WHERE expires_at <= ?', (now,)).fetchall():
+            # Every bot process sweeps; only the one whose delete goes through reports the lease
+            cursor = self.db.execute('DELETE FROM leases WHERE reviewer_id = ? AND ticket_id = ? AND expires_at <= ?', (reviewer_id, ticket_id, now))
+            if cursor.rowcount == 1:
+                expired.append((reviewer_id, ticket_id))
+        return expired
+
+    def reviewer_ticket(self, reviewer_id):
+        row = self.db.execute('SELECT ticket_id FROM leases WHERE reviewer_id = ? AND expires_at > ?', (reviewer_id, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def release_reviewer(self, reviewer_id):
+        self.db.execute('DELETE FROM leases WHERE reviewer_id = ?', (reviewer_id,))
+
+    def ticket_reviewers(self, ticket_id):
+        return [row[0] for row in self.db.execute('SELECT reviewer_id FROM leases WHERE ticket_id = ? AND expires_at > ?', (ticket_id, time.time()))]
+
+    def backlog_stats(self):
+        now = time.time()
+        open_tickets, oldest = self.db.execute('SELECT COUNT(*), MIN(created_at) FROM tickets WHERE state = ?', (OPEN,)).fetchone()
+        claimed = self.db.execute('SELECT COUNT(DISTINCT ticket_id) FROM leases WHERE expires_at > ?', (now,)).fetchone()[0]
+        decided, avg_decision, max_decision = self.db.execute(
+            'SELECT COUNT(*), AVG(decided_at - created_at), MAX(decided_at - created_at) FROM tickets WHERE decided_at IS NOT NULL').fetchone()
+        return {
+            'open': open_tickets,
+            'claimed': claimed,
+            'oldest_open_age': now - oldest if oldest is not None else 0.0,
+            'decided': decided,
+            'avg_time_to_decision': avg_decision or 0.0,
+            'max_time_to_decision': max_decision or 0.0,
+        }
+
+    def bad_report_count(self, user_id):
+        row = self.db.execute('SELECT count FROM bad_reports WHERE user_id = ?', (user_id,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def add_bad_report(self, user_id):
+        self.db.execute('INSERT INTO bad_reports VALUES (?, 1) ON CONFLICT (user_id) DO UPDATE SET count = count + 1', (user_id,))
+
+    def load_conversation(self, kind, user_id):
+        row = self.db.execute('SELECT data FROM conversations WHERE kind = ? AND user_id = ?', (kind, user_id)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save_conversation(self, kind, user_id, data):
+        self.db.execute('INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)', (kind, user_id, json.dumps(data)))
+
+    def delete_conversation(self, kind, user_id):
+        self.db.execute('DELETE FROM conversations WHERE kind = ? AND user_id = ?', (kind, user_id))
+
+    def get_setting(self, name):
+        row = self.db.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_setting(self, name, value):
+        self.db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', (name, json.dumps(value)))
+
+    def add_guild_job(self, guild_id, job, ticket_id):
+        self.db.execute('INSERT INTO guild_jobs (guild_id, job, ticket_id) VALUES (?, ?, ?)', (guild_id, job, ticket_id))
+
+    def take_guild_jobs(self, guild_ids):
+        # The table only holds jobs not yet picked up, so reading all of it is cheap
+        taken = []
+        for id, guild_id, job, ticket_id in self.db.execute('SELECT id, guild_id, job, ticket_id FROM guild_jobs ORDER BY id').fetchall():
+            if guild_id not in guild_ids:
+                continue
+            # Two processes running the same shard would both see the job; only the one whose delete goes through runs it
+            if self.db.execute('DELETE FROM guild_jobs WHERE id = ?', (id,)).rowcount == 1:
+                taken.append((job, ticket_id))
+        return taken
+
+    def close(self):
+        self.db.close()
+
+
+class Conversations:
+    '''
+    Map from user IDs to their in-progress Report, Review or BulkReview, kept in an AsyncTicketStore.
+    Objects are rebuilt on every lookup, so call save() after changing one.
+    '''
+    def __init__(self, store, kind, cls, client):
+        self.store = store
+        self.kind = kind
+        self.cls = cls
+        self.client = client
+
+    async def get(self, user_id):
+        data = await self.store.load_conversation(self.kind, user_id)
+        return None if data is None else self.cls.from_dict(self.client, data)
+
+    async def save(self, user_id, conversation):
+        await self.store.save_conversation(self.kind, user_id, conversation.to_dict())
+
+    async def pop(self, user_id):
+        await self.store.delete_conversation(self.kind, user_id)
+
+
+class AsyncTicketStore:
+    '''
+    Wraps a ticket store so that each of its methods is a coroutine run on one worker thread. A
+    SQLite statement can wait up to 30 seconds for a lock held by another process, and the event
+    loop keeps running meanwhile; calls still run one at a time, in the order they were made.
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tickets')
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def call(*args):
+            return await asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(method, *args))
+        return call
+
+    def close(self):
+        self.executor.submit(self.store.close).result()
+        self.executor.shutdown()
+
+
+def open_ticket_store(path):
+    '''
+    SQLite store at path, or an in-memory store if path is None.
+    '''
+    return MemoryTicketStore() if path is None else SQLiteTicketStore(path)
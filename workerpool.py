@@ -0,0 +1,81 @@
+'''
+Model worker pool shared by every bot process.
+
+When the bot runs as several shard processes (see shards.py), each one would otherwise start its
+own pool of model workers. Instead the launcher serves a single pool over a multiprocessing manager
+and each shard submits its CPU-bound model work (article parsing, fake news prediction) to it
+through RemoteExecutor, which can be passed anywhere a concurrent.futures executor is expected.
+'''
+import signal
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+
+from model.abridged import extract_article_text, predict_fake_news_batch
+
+# Functions shards may run in the pool, by name
+JOBS = {
+    'extract_article_text': extract_article_text,
+    'predict_fake_news_batch': predict_fake_news_batch,
+}
+
+
+class ModelPoolManager(BaseManager):
+    pass
+
+
+class ModelPool:
+    def __init__(self, max_workers):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def run(self, name, args):
+        return self.executor.submit(JOBS[name], *args).result()
+
+
+def serve(address, authkey, max_workers):
+    '''
+    Runs the shared pool server until the process is terminated, then shuts the pool's workers down.
+    Must not run in a daemon process, since daemons can't start the pool's worker processes.
+    '''
+    pool = ModelPool(max_workers)
+    ModelPoolManager.register('get_pool', callable=lambda: pool)
+    manager = ModelPoolManager(address=address, authkey=authkey)
+    # Process.terminate() sends SIGTERM; leave serve_forever() through SystemExit so the finally runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        manager.get_server().serve_forever()
+    finally:
+        pool.executor.shutdown()
+
+
+class RemoteExecutor:
+    '''
+    Executor that runs jobs in the shared pool. Each submitted job waits for its result on a local
+    thread, so up to max_threads jobs from this process can be in the pool at once.
+    '''
+    def __init__(self, address, authkey, max_threads=8):
+        self.address = address
+        self.authkey = authkey
+        self.threads = ThreadPoolExecutor(max_workers=max_threads)
+        self.manager = None
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        # Jobs start on several threads at once; only publish the manager once it is connected
+        with self.lock:
+            if self.manager is None:
+                ModelPoolManager.register('get_pool')
+                manager = ModelPoolManager(address=self.address, authkey=self.authkey)
+                manager.connect()
+                self.manager = manager
+        # Proxies are per-thread, so each pool thread gets its own connection
+        return self.manager.get_pool()
+
+    def submit(self, fn, *args):
+        if fn.__name__ not in JOBS:
+            raise ValueError(f'{fn.__name__} cannot run in the shared model pool')
+        return self.threads.submit(lambda: self._get_pool().run(fn.__name__, args))
+
+    def shutdown(self, wait=True):
+        self.threads.shutdown(wait=wait)